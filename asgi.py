@@ -0,0 +1,342 @@
+"""Production ASGI entry point for the events API.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 8000
+
+Flask still handles every request, on a pool of ``DB_POOL_SIZE`` threads. The
+difference is the outbound I/O around it: holiday and weather lookups go out
+on the event loop through one shared ``httpx.AsyncClient``, so a slow upstream
+parks a coroutine instead of a worker thread. Before ``GET /api/events/<id>``
+is handed to Flask, its holiday and forecast are loaded concurrently (waiting
+up to ``METADATA_WAIT``) into the caches Flask reads, and ``GET /weather``
+refreshes the city forecasts the same way, so the Flask threads only ever wait
+on SQLite. Long polls of ``/api/events/changes`` and the change stream wait
+on the loop too, for ``/api/calendars/<cid>/events`` as for the default
+database. Database reads made here run on their own executor.
+"""
+import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+import httpx
+from a2wsgi import WSGIMiddleware
+from werkzeug.exceptions import HTTPException
+from werkzeug.routing import RequestRedirect
+
+import main
+
+config = main.app.config
+# Metadata and long polls are awaited here instead; Flask then only reads what is already there
+metadata_wait, config['METADATA_WAIT'] = config['METADATA_WAIT'], 0
+changes_max_wait, config['CHANGES_MAX_WAIT'] = config['CHANGES_MAX_WAIT'], 0
+
+flask_app = WSGIMiddleware(main.app, workers=config['DB_POOL_SIZE'])
+db_executor = ThreadPoolExecutor(max_workers=config['DB_POOL_SIZE'], thread_name_prefix='sqlite')
+
+
+async def run_db(fn, *args, calendar=None):
+    """Run ``fn(*args)`` on the SQLite executor, inside an app context so ``get_db`` works.
+
+    With a ``calendar`` that context is addressed to its shard; if there is no
+    such calendar, ``fn`` isn't called and the result is None.
+    """
+    def call():
+        with main.app.app_context():
+            if calendar is not None and main.use_calendar(calendar) is None:
+                return None
+            return fn(*args)
+
+    return await asyncio.get_running_loop().run_in_executor(db_executor, call)
+
+
+class Upstream:
+    """Async client for the upstream APIs: pooled keep-alive connections, timeouts and retries."""
+
+    def __init__(self):
+        self._client = None
+
+    @property
+    def client(self):
+        # Created on first use so it belongs to the serving loop
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=config['UPSTREAM_TIMEOUT'],
+                limits=httpx.Limits(max_connections=config['UPSTREAM_POOL_SIZE'],
+                                    max_keepalive_connections=config['UPSTREAM_POOL_SIZE']))
+        return self._client
+
+    async def get_json(self, url, label):
+        retries = config['UPSTREAM_RETRIES']
+        for attempt in range(retries + 1):
+            if attempt:
+                await asyncio.sleep(config['UPSTREAM_BACKOFF'] * 2 ** (attempt - 1))
+            try:
+                with main.upstream_latency.time(label):
+                    response = await self.client.get(url)
+            except httpx.TransportError:
+                if attempt == retries:
+                    raise
+                continue
+            if response.status_code in main.retry_statuses and attempt < retries:
+                continue
+            response.raise_for_status()
+            return response.json()
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+upstream = Upstream()
+
+
+class AsyncLoader:
+    """Loads misses of a ``main.BackgroundCache`` on the event loop rather than on its thread pool.
+
+    Loads started here and by Flask threads share the cache's in-flight table, so
+    a key is still fetched once however many requests miss it.
+    """
+
+    def __init__(self, cache, fetch):
+        self.cache = cache
+        self.fetch = fetch
+        self._tasks = set()
+
+    def start(self, key):
+        future = Future()
+
+        async def load():
+            try:
+                value = await self.fetch(key)
+            except Exception as e:
+                main.logger.warning("Failed to load %r: %s", key, e)
+                future.set_result(self.cache.store(key, None, failed=True))
+            else:
+                future.set_result(self.cache.store(key, value))
+
+        task = asyncio.get_running_loop().create_task(load())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return future
+
+    async def get(self, key, wait=0):
+        value, future = self.cache.lookup(key, self.start)
+        if future is None or not wait:
+            return value
+        try:
+            # Shielded so a timeout leaves the load running for the next reader
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), wait)
+        except Exception:
+            return None
+
+
+async def fetch_holidays(year):
+    return main.parse_holidays(await upstream.get_json(config['HOLIDAY_API_URL'].format(year=year), 'nager'))
+
+
+async def fetch_forecast(cell):
+    lat, lon = cell
+    return main.parse_forecast(await upstream.get_json(config['WEATHER_API_URL'].format(lat=lat, lon=lon), '7timer'))
+
+
+async def fetch_city_weather(lat, lon):
+    try:
+        return await upstream.get_json(config['CITY_WEATHER_API_URL'].format(lat=lat, lon=lon), '7timer')
+    except (httpx.HTTPError, ValueError):
+        return None
+
+
+holidays = AsyncLoader(main.holiday_cache, fetch_holidays)
+forecasts = AsyncLoader(main.weather_cache, fetch_forecast)
+city_weather_lock = asyncio.Lock()
+
+
+def event_metadata_keys(event_id):
+    record = main.get_cached_event(event_id)
+    if record is None:
+        return None
+    lat, lon = main.weather_location(record.suburb, record.state, record.post_code)
+    return main.metadata_keys(record.date, {'lat': lat, 'lon': lon})
+
+
+async def load_event_metadata(event_id, calendar=None):
+    keys = await run_db(event_metadata_keys, event_id, calendar=calendar)
+    if keys is not None:
+        year, cell = keys
+        await asyncio.gather(holidays.get(year, metadata_wait), forecasts.get(cell, metadata_wait))
+
+
+async def refresh_city_weather():
+    if not main.city_weather_expired():
+        return
+    async with city_weather_lock:
+        if main.city_weather_expired():
+            main.store_city_weather(await asyncio.gather(
+                *(fetch_city_weather(lat, lon) for lat, lon in main.cities.values())))
+
+
+class ChangeSignal:
+    """Publishes of one shard's ``ChangeFeed``, seen from the event loop."""
+
+    def __init__(self, feed):
+        self.feed = feed
+        self._event = None
+
+    def current(self):
+        """The event set by the next publish; take it before reading the log so no commit slips between."""
+        if self._event is None:
+            loop = asyncio.get_running_loop()
+            self._event = asyncio.Event()
+            self.feed.subscribe(lambda: loop.call_soon_threadsafe(self._publish))
+        return self._event
+
+    def _publish(self):
+        self._event.set()
+        self._event = asyncio.Event()
+
+
+change_signals = {}
+
+
+async def change_signal(calendar):
+    """The ``ChangeSignal`` of ``calendar`` (None for the default database), or None if there is no such calendar."""
+    shard = main.default_shard if calendar is None else await run_db(main.current_shard, calendar=calendar)
+    if shard is None:
+        return None
+    if shard not in change_signals:
+        change_signals[shard] = ChangeSignal(shard.change_feed)
+    return change_signals[shard]
+
+
+async def wait_for_change(event, timeout, *others):
+    """Wait until ``event`` is set, any of ``others`` is done, or ``timeout`` seconds pass."""
+    waiter = asyncio.ensure_future(event.wait())
+    try:
+        await asyncio.wait((waiter, *others), timeout=max(timeout, 0), return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        waiter.cancel()
+
+
+def query_params(scope):
+    return {key: values[0] for key, values in parse_qs(scope['query_string'].decode('latin-1')).items()}
+
+
+def changed_since(since):
+    c = main.get_db().cursor()
+    c.execute('SELECT 1 FROM event_changes WHERE seq > ? LIMIT 1', (since,))
+    return c.fetchone() is not None
+
+
+async def hold_long_poll(scope, calendar=None):
+    """Wait, as ``/api/events/changes?wait=`` asks, until there is something to answer with."""
+    params = query_params(scope)
+    try:
+        since = int(params.get('since', 0))
+        wait = min(max(float(params.get('wait', 0)), 0.0), changes_max_wait)
+    except ValueError:
+        return
+    signal = await change_signal(calendar)
+    if signal is None:
+        return
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + wait
+    while True:
+        event = signal.current()
+        remaining = deadline - loop.time()
+        if await run_db(changed_since, since, calendar=calendar) or remaining <= 0:
+            return
+        await wait_for_change(event, min(remaining, config['CHANGES_POLL_INTERVAL']))
+
+
+async def stream_changes(scope, receive, send, calendar=None):
+    """Serve ``/api/events/changes/stream`` on the loop, as Flask would but without holding a thread."""
+    headers = dict(scope['headers'])
+    try:
+        since = main.parse_change_token(headers.get(b'last-event-id', b'').decode('latin-1')
+                                        or query_params(scope).get('since', '0'))
+    except HTTPException:
+        # Let Flask explain the bad token
+        return await flask_app(scope, receive, send)
+    signal = await change_signal(calendar)
+    if signal is None:
+        # Or the missing calendar
+        return await flask_app(scope, receive, send)
+
+    async def disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    def read(token):
+        return main.read_changes(main.get_db().cursor(), token, 100)
+
+    await send({'type': 'http.response.start', 'status': 200,
+                'headers': [(b'content-type', b'text/event-stream; charset=utf-8'), (b'cache-control', b'no-cache'),
+                            (b'x-accel-buffering', b'no')]})
+    disconnected = asyncio.ensure_future(disconnect())
+    loop = asyncio.get_running_loop()
+    heartbeat = config['CHANGES_HEARTBEAT']
+    quiet_until = loop.time() + heartbeat
+    try:
+        while not disconnected.done():
+            event = signal.current()
+            changes, has_more = await run_db(read, since, calendar=calendar)
+            body = None
+            if changes:
+                since = changes[-1][0]
+                body = ''.join(main.change_message(*change) for change in changes)
+                quiet_until = loop.time() + heartbeat
+            elif loop.time() >= quiet_until:
+                body = ': keep-alive\n\n'
+                quiet_until = loop.time() + heartbeat
+            if body is not None:
+                await send({'type': 'http.response.body', 'body': body.encode(), 'more_body': True})
+            if not has_more:
+                await wait_for_change(event, min(quiet_until - loop.time(), config['CHANGES_POLL_INTERVAL']),
+                                      disconnected)
+    finally:
+        disconnected.cancel()
+
+
+url_adapter = main.app.url_map.bind('localhost')
+
+
+def match(path):
+    """Return the endpoint, resource class (None for plain views) and arguments a GET of ``path`` routes to."""
+    try:
+        endpoint, args = url_adapter.match(path, 'GET')
+    except (HTTPException, RequestRedirect):
+        return None, None, {}
+    return endpoint, getattr(main.app.view_functions[endpoint], 'view_class', None), args
+
+
+async def prefetch(scope, endpoint, resource, args):
+    """Do the waiting a GET would otherwise block a Flask thread on."""
+    if resource is main.Event:
+        await load_event_metadata(args['event_id'], args.get('cid'))
+    elif resource is main.EventChanges:
+        await hold_long_poll(scope, args.get('cid'))
+    elif endpoint == 'get_weather':
+        await refresh_city_weather()
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await upstream.aclose()
+            db_executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] == 'http' and scope['method'] in ('GET', 'HEAD'):
+        endpoint, resource, args = match(scope['path'])
+        if resource is main.EventChangeStream and scope['method'] == 'GET':
+            return await stream_changes(scope, receive, send, args.get('cid'))
+        await prefetch(scope, endpoint, resource, args)
+    await flask_app(scope, receive, send)
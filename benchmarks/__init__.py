@@ -0,0 +1,12 @@
+"""Benchmarks and load generation for the MyCalendar API.
+
+Run from the repository root:
+
+    python -m benchmarks run --out before.json     # micro-benchmarks + in-process load
+    python -m benchmarks run --mode http --out after.json
+    python -m benchmarks compare before.json after.json
+
+``generator`` builds synthetic calendars, ``stubs`` stands in for 7timer and
+nager.at, ``micro`` and ``load`` produce the results, and the remaining
+modules are focused experiments runnable as ``python -m benchmarks.<name>``.
+"""
@@ -0,0 +1,89 @@
+"""``python -m benchmarks run`` records a run; ``compare`` flags regressions between two."""
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+from benchmarks import load, micro
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    results = micro.run(args.size, args.samples)
+    results += load.run(args.mode, args.clients, args.requests, args.write_ratio, args.overlap, args.seed_size,
+                        args.upstream_latency)
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'arguments': {key: value for key, value in vars(args).items()
+                          if key not in ('command', 'handler', 'out')},
+        },
+        'results': results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+def compare(args):
+    def load_results(path):
+        with open(path) as f:
+            report = json.load(f)
+        return report['meta'], {item['name']: item for item in report['results']}
+
+    base_meta, base = load_results(args.base)
+    new_meta, new = load_results(args.new)
+    print(f"{'benchmark':<32} {base_meta['commit'] or 'base':>12} {new_meta['commit'] or 'new':>12} {'change':>8}")
+    regressions = []
+    for name, item in new.items():
+        if name not in base:
+            print(f"{name:<32} {'-':>12} {item['value']:>12} {'new':>8}")
+            continue
+        before, after = base[name]['value'], item['value']
+        change = (after - before) / before if before else 0.0 if after == before else float('inf')
+        worse = change < -args.threshold if item['better'] == 'higher' else change > args.threshold
+        flag = '  REGRESSION' if worse else ''
+        print(f"{name:<32} {before:>12} {after:>12} {change:>+8.1%}{flag}")
+        if worse:
+            regressions.append(name)
+    if regressions:
+        print(f'{len(regressions)} regression(s) beyond {args.threshold:.0%}', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='python -m benchmarks')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='run the micro-benchmarks and a load test')
+    run_parser.add_argument('--out', help='write the JSON report here instead of stdout')
+    run_parser.add_argument('--size', type=int, default=10000, help='events in the micro-benchmark database')
+    run_parser.add_argument('--samples', type=int, default=50)
+    load.add_arguments(run_parser)
+    run_parser.set_defaults(handler=run)
+
+    compare_parser = commands.add_parser('compare', help='compare two reports and exit 1 on regression')
+    compare_parser.add_argument('base')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=0.1, help='relative change that counts')
+    compare_parser.set_defaults(handler=compare)
+
+    args = parser.parse_args()
+    args.handler(args)
@@ -0,0 +1,77 @@
+"""Calendar analytics on the NumPy column snapshot versus SQL and Python loops.
+
+Seeds a scratch database, loads the EventColumns snapshot once, then times the
+same aggregates (events starting per hour, per-suburb and per-state counts,
+busy seconds per day) three ways.
+
+    python -m benchmarks.analytics_vectorized 1000000
+"""
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from benchmarks.generator import seed  # noqa: E402
+
+SAMPLES = 5
+
+SQL_QUERIES = (
+    "SELECT (start_epoch % 86400) / 3600, COUNT(*) FROM events GROUP BY 1",
+    "SELECT suburb, COUNT(*) FROM events GROUP BY suburb",
+    "SELECT state, COUNT(*) FROM events GROUP BY state",
+    "SELECT start_epoch / 86400, SUM(end_epoch - start_epoch) FROM events GROUP BY 1",
+)
+
+
+def timed(fn):
+    timings = []
+    for _ in range(SAMPLES):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000
+
+
+def run(sizes):
+    print(f"{'events':>10} {'load ms':>10} {'numpy ms':>10} {'sql ms':>10} {'python ms':>10}")
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            seed(os.path.join(tmp, 'events.db'), size)
+            conn = sqlite3.connect(main.app.config['DATABASE'])
+
+            started = time.perf_counter()
+            main.event_columns.loaded = False
+            view, names = main.get_event_columns(conn.cursor())
+            load_ms = (time.perf_counter() - started) * 1000
+
+            def vectorized():
+                main.busy_hours(view['start'], view['end'])
+                main.category_counts(view['suburb'], names['suburb'])
+                main.category_counts(view['state'], names['state'])
+                main.daily_utilization(view['start'], view['end'])
+
+            def sql():
+                for query in SQL_QUERIES:
+                    conn.execute(query).fetchall()
+
+            def python():
+                hours, suburbs, states, days = Counter(), Counter(), Counter(), defaultdict(int)
+                for _, start, end, suburb, state, _ in conn.execute(main.event_columns_query):
+                    hours[start % 86400 // 3600] += 1
+                    suburbs[suburb] += 1
+                    states[state] += 1
+                    days[start // 86400] += end - start
+
+            numpy_ms, sql_ms, python_ms = timed(vectorized), timed(sql), timed(python)
+            conn.close()
+        print(f"{size:>10} {load_ms:>10.1f} {numpy_ms:>10.1f} {sql_ms:>10.1f} {python_ms:>10.1f}")
+
+
+if __name__ == '__main__':
+    run([int(arg) for arg in sys.argv[1:]] or [100000, 1000000])
@@ -0,0 +1,177 @@
+"""Throughput of the WSGI and ASGI serving modes behind slow upstreams.
+
+Both modes get the same number of app threads (``DB_POOL_SIZE``). Under WSGI
+each thread is a worker of a pooled werkzeug server, as with a threaded
+production WSGI server, and blocks on the holiday and forecast lookups of the
+event it serves. Under ASGI (``asgi:app`` on uvicorn) those lookups are awaited
+on the event loop, so the threads only run Flask. The metadata caches are
+shrunk to one entry and events span decades and every capital, so nearly
+every GET /api/events/<id> misses both caches and waits on a stub that takes
+``--upstream-latency`` seconds to answer.
+
+    python -m benchmarks.async_serving --clients 32 --requests 2000 --upstream-latency 0.2
+"""
+import argparse
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import random
+import socket
+import statistics
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+
+def client_worker(port, worker, count, max_id):
+    import http.client
+
+    rng = random.Random(worker)
+    timings, statuses = [], Counter()
+    for _ in range(count):
+        # A connection per request, so queued requests wait for a free app thread rather than a connection
+        conn = http.client.HTTPConnection('127.0.0.1', port)
+        started = time.perf_counter()
+        conn.request('GET', f'/api/events/{rng.randint(1, max_id)}')
+        response = conn.getresponse()
+        body = json.loads(response.read())
+        timings.append(time.perf_counter() - started)
+        conn.close()
+        metadata = body.get('_metadata') or {}
+        statuses[f'{response.status} {"weather" if "weather" in metadata else "no weather"}'] += 1
+    return timings, statuses
+
+
+def serve_wsgi(app, workers):
+    """Start a werkzeug server that handles requests on a fixed pool of ``workers`` threads."""
+    from werkzeug.serving import BaseWSGIServer
+
+    class PooledWSGIServer(BaseWSGIServer):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.pool = ThreadPoolExecutor(workers, thread_name_prefix='wsgi')
+
+        def process_request(self, request, client_address):
+            self.pool.submit(self.handle_pooled, request, client_address)
+
+        def handle_pooled(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    server = PooledWSGIServer('127.0.0.1', 0, app)
+    server.request_queue_size = 1024
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def stop():
+        server.shutdown()
+        server.pool.shutdown()
+        server.server_close()
+
+    return server.port, stop
+
+
+def serve_asgi(app):
+    """Start uvicorn serving ``app`` from a background thread."""
+    import uvicorn
+
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    server = uvicorn.Server(uvicorn.Config(app, log_level='warning', backlog=1024))
+    thread = threading.Thread(target=server.run, kwargs={'sockets': [sock]}, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+
+    def stop():
+        server.should_exit = True
+        thread.join()
+        sock.close()
+
+    return sock.getsockname()[1], stop
+
+
+def spread_locations(path):
+    """Move events round the state capitals so their forecasts come from different grid cells."""
+    import sqlite3
+
+    import main
+
+    conn = sqlite3.connect(path)
+    for i, (state, city) in enumerate(main.state_capitals.items()):
+        conn.execute("UPDATE events SET suburb=?, state=?, post_code='' WHERE id % ? = ?",
+                     (city, state, len(main.state_capitals), i))
+    conn.commit()
+    conn.close()
+
+
+def run(mode='asgi', clients=32, requests=2000, seed_size=20000, upstream_latency=0.2, wait=1.0):
+    import main
+    from benchmarks.generator import seed
+    from benchmarks.stubs import StubUpstreams
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    saved = {'holiday': main.holiday_cache.max_entries, 'weather': main.weather_cache.max_entries,
+             'wait': main.app.config['METADATA_WAIT']}
+    main.holiday_cache.max_entries = main.weather_cache.max_entries = 1
+    with tempfile.TemporaryDirectory() as tmp, StubUpstreams(upstream_latency):
+        path = os.path.join(tmp, 'events.db')
+        # One event a day, so ids range over decades of holiday calendars
+        seed(path, seed_size, per_day=1)
+        spread_locations(path)
+
+        if mode == 'wsgi':
+            main.app.config['METADATA_WAIT'] = wait
+            port, stop = serve_wsgi(main.app, main.app.config['DB_POOL_SIZE'])
+        else:
+            import asgi
+
+            asgi.metadata_wait, main.app.config['METADATA_WAIT'] = wait, 0
+            port, stop = serve_asgi(asgi.app)
+        try:
+            with multiprocessing.get_context('spawn').Pool(clients) as pool:
+                started = time.perf_counter()
+                outcomes = pool.starmap(client_worker, [(port, worker, requests // clients, seed_size)
+                                                        for worker in range(clients)])
+                elapsed = time.perf_counter() - started
+        finally:
+            stop()
+            main.holiday_cache.max_entries, main.weather_cache.max_entries = saved['holiday'], saved['weather']
+            main.app.config['METADATA_WAIT'] = saved['wait']
+
+    timings = sorted(itertools.chain.from_iterable(timings for timings, _ in outcomes))
+    statuses = sum((statuses for _, statuses in outcomes), Counter())
+    prefix = f'serving.{mode}'
+    return [
+        {'name': f'{prefix}.throughput', 'value': round(len(timings) / elapsed, 1), 'unit': 'req/s',
+         'better': 'higher'},
+        {'name': f'{prefix}.p50', 'value': round(statistics.median(timings) * 1000, 3), 'unit': 'ms',
+         'better': 'lower'},
+        {'name': f'{prefix}.p99', 'value': round(timings[int(len(timings) * 0.99) - 1] * 1000, 3), 'unit': 'ms',
+         'better': 'lower'},
+        {'name': f'{prefix}.errors', 'value': sum(count for status, count in statuses.items()
+                                                  if not status.startswith('200')),
+         'unit': 'requests', 'better': 'lower', 'statuses': dict(sorted(statuses.items()))},
+    ]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mode', choices=('wsgi', 'asgi', 'both'), default='both')
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--seed-size', type=int, default=20000, help='events stored, one a day')
+    parser.add_argument('--upstream-latency', type=float, default=0.2, help='seconds added by the stub upstreams')
+    parser.add_argument('--wait', type=float, default=1.0, help='METADATA_WAIT for an uncached lookup')
+    args = parser.parse_args()
+    results = []
+    for mode in (('wsgi', 'asgi') if args.mode == 'both' else (args.mode,)):
+        results += run(mode, args.clients, args.requests, args.seed_size, args.upstream_latency, args.wait)
+    print(json.dumps(results, indent=2))
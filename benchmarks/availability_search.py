@@ -0,0 +1,78 @@
+"""Latency of /api/events/availability over a densely booked calendar.
+
+Seeds a year of working days packed with short meetings, leaving only a few
+gaps, then asks for free slots over the whole year: the next slot long enough
+for a rare long meeting, and the first 100 half-hour slots. Each query runs
+against the in-process interval index and against SQL.
+
+    python -m benchmarks.availability_search 40
+"""
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from benchmarks.generator import insert_rows  # noqa: E402
+
+SAMPLES = 50
+QUERIES = {
+    'next 4h slot': {'duration': 240, 'limit': 1},
+    'first 100 30m slots': {'duration': 30, 'limit': 100},
+}
+
+
+def seed(path, per_day):
+    """Book ``per_day`` back-to-back 10-20 minute meetings from 08:00 every day of 2030."""
+    main.app.config['DATABASE'] = path
+    main.init_db()
+    rng = random.Random(0)
+    rows = []
+    for offset in range(365):
+        day = (date(2030, 1, 1) + timedelta(days=offset)).strftime('%d-%m-%Y')
+        minute = 8 * 60
+        for i in range(per_day):
+            length = rng.randint(10, 20)
+            gap = 45 if rng.random() < 0.05 else rng.randint(0, 2)
+            from_time = f'{minute // 60:02d}:{minute % 60:02d}'
+            minute = min(minute + length, 23 * 60 + 59)
+            to_time = f'{minute // 60:02d}:{minute % 60:02d}'
+            minute = min(minute + gap, 23 * 60 + 59)
+            rows.append((f'meeting {i}', day, from_time, to_time, '1 George St', 'Sydney', 'NSW', '2000', '',
+                         '2030-01-01T00:00:00', *main.event_span(day, from_time, to_time)))
+    insert_rows(path, rows)
+    return len(rows)
+
+
+def measure(client, params):
+    query = {'from': '2030-01-01', 'to': '2030-12-31', 'hours': '08:00-18:00', **params}
+    timings = []
+    for _ in range(SAMPLES):
+        started = time.perf_counter()
+        response = client.get('/api/events/availability', query_string=query)
+        timings.append(time.perf_counter() - started)
+        assert response.status_code == 200, response.get_json()
+    return statistics.median(timings) * 1000, max(timings) * 1000, len(response.get_json()['slots'])
+
+
+def run(per_day):
+    with tempfile.TemporaryDirectory() as tmp:
+        total = seed(os.path.join(tmp, 'events.db'), per_day)
+        print(f'{total} events over 365 days')
+        print(f"{'mode':>8} {'query':>22} {'median ms':>10} {'max ms':>10} {'slots':>6}")
+        for mode, enabled in (('index', True), ('sql', False)):
+            main.app.config['INTERVAL_INDEX'] = enabled
+            main.interval_index.loaded = False
+            with main.app.test_client() as client:
+                for label, params in QUERIES.items():
+                    median_ms, max_ms, slots = measure(client, params)
+                    print(f'{mode:>8} {label:>22} {median_ms:>10.2f} {max_ms:>10.2f} {slots:>6}')
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 40)
@@ -0,0 +1,100 @@
+"""One SQLite file against a file per calendar: concurrent writes and cross-calendar statistics.
+
+The writers post non-overlapping events at the same time, either all into the
+default database or each into its own calendar. Statistics then come from
+/api/events/statistics over one file holding every event, and from
+/api/calendars/statistics fanned out over the calendar files on the worker
+processes.
+
+    python -m benchmarks.calendar_shards --calendars 8 --size 200000 --writes 200
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from benchmarks.generator import event_row, generate_events, insert_rows, seed  # noqa: E402
+from benchmarks.stubs import StubUpstreams  # noqa: E402
+
+SAMPLES = 5
+
+
+def write(url_for_writer, writers, writes):
+    """Post ``writes`` events from each of ``writers`` threads at once; returns posts/s and failures."""
+    barrier = threading.Barrier(writers + 1)
+    failures = []
+
+    def writer(i):
+        client = main.app.test_client()
+        events = generate_events(writes, first_day=date(2100 + i, 1, 1), prefix=f'writer {i}')
+        barrier.wait()
+        for event in events:
+            response = client.post(url_for_writer(i), json=event)
+            if response.status_code != 201:
+                failures.append(response.status_code)
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return writers * writes / (time.perf_counter() - started), len(failures)
+
+
+def measure(client, url):
+    timings = []
+    for _ in range(SAMPLES):
+        started = time.perf_counter()
+        response = client.get(url)
+        timings.append(time.perf_counter() - started)
+        assert response.status_code == 200, response.get_json()
+    return statistics.median(timings) * 1000, response.get_json()
+
+
+def run(calendars, size, writes):
+    with tempfile.TemporaryDirectory() as tmp, StubUpstreams():
+        main.app.config['CALENDAR_DIR'] = os.path.join(tmp, 'calendars')
+        main.shards.clear()
+        seed(os.path.join(tmp, 'events.db'), size)
+        # The same events again, dealt out over the calendars
+        rows = [event_row(event) for event in generate_events(size)]
+        with main.app.app_context():
+            for i in range(calendars):
+                main.get_shard(f'cal{i}', create=True)
+        for i in range(calendars):
+            insert_rows(main.calendar_path(f'cal{i}'), rows[i::calendars])
+
+        print(f'{calendars} writers, {writes} posts each')
+        print(f"{'layout':>16} {'posts/s':>10} {'failed':>7}")
+        for label, url in (('one file', lambda i: '/api/events/'),
+                           ('file per writer', lambda i: f'/api/calendars/cal{i}/events/')):
+            rate, failed = write(url, calendars, writes)
+            print(f'{label:>16} {rate:>10.0f} {failed:>7}')
+
+        client = main.app.test_client()
+        print(f'\n{size} events, statistics over {calendars} calendars on {main.app.config["SHARD_WORKERS"]} workers')
+        print(f"{'query':>16} {'median ms':>10} {'total':>8}")
+        # The first fan-out pays for starting the worker processes
+        client.get('/api/calendars/statistics')
+        for label, url in (('one file', '/api/events/statistics'),
+                           ('fan-out', '/api/calendars/statistics')):
+            median_ms, body = measure(client, url)
+            print(f'{label:>16} {median_ms:>10.2f} {body["total"]:>8}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--calendars', type=int, default=8)
+    parser.add_argument('--size', type=int, default=200000, help='events stored, in total over the calendars')
+    parser.add_argument('--writes', type=int, default=200, help='posts per writer')
+    args = parser.parse_args()
+    run(args.calendars, args.size, args.writes)
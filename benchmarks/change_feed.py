@@ -0,0 +1,90 @@
+"""Cost of finding out what changed: re-listing every page against the change feed.
+
+Seeds a calendar, takes a sync token, then makes a few writes. A polling client
+either walks the whole list again (with its COUNT) to diff it, or asks
+/api/events/changes for what happened after its token.
+
+    python -m benchmarks.change_feed --size 20000 --writes 20
+"""
+import argparse
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from benchmarks.generator import LOCATION, seed  # noqa: E402
+from benchmarks.stubs import StubUpstreams  # noqa: E402
+
+SAMPLES = 5
+
+
+def full_list(client, page_size):
+    """Walk every page of the list with cursor paging, as a client diffing snapshots has to."""
+    url, size, requests = f'/api/events/?paging=cursor&page_size={page_size}', 0, 0
+    while url:
+        response = client.get(url)
+        size += len(response.data)
+        requests += 1
+        next_link = response.get_json()['metadata']['_links']['next']
+        url = next_link['href'].replace('/api/events?', '/api/events/?') if next_link else None
+    return size, requests
+
+
+def changes(client, token):
+    size, requests = 0, 0
+    while True:
+        body = client.get(f'/api/events/changes?since={token}&limit=1000')
+        size += len(body.data)
+        requests += 1
+        page = body.get_json()
+        token = page['next']
+        if not page['has_more']:
+            return size, requests
+
+
+def measure(fn):
+    timings = []
+    for _ in range(SAMPLES):
+        started = time.perf_counter()
+        size, requests = fn()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000, size, requests
+
+
+def run(size, writes, page_size):
+    with tempfile.TemporaryDirectory() as tmp, StubUpstreams():
+        path = os.path.join(tmp, 'events.db')
+        seed(path, size)
+        client = main.app.test_client()
+        # The client is in sync up to the end of the log before the writes
+        conn = sqlite3.connect(path)
+        token = str(conn.execute('SELECT MAX(seq) FROM event_changes').fetchone()[0])
+        conn.close()
+        for i in range(writes):
+            if i % 2:
+                client.patch(f'/api/events/{i + 1}', json={'name': f'renamed {i}'})
+            else:
+                client.post('/api/events/', json={'name': f'new {i}', 'date': '01-01-2101', 'from': f'{i // 2:02d}:00',
+                                                  'to': f'{i // 2:02d}:30', 'description': '',
+                                                  'location': dict(LOCATION)})
+
+        print(f'{size} events, {writes} writes since the last sync')
+        print(f"{'strategy':>12} {'median ms':>10} {'bytes':>10} {'requests':>9}")
+        for label, fn in (('full list', lambda: full_list(client, page_size)),
+                          ('changes', lambda: changes(client, token))):
+            median_ms, body_bytes, requests = measure(fn)
+            print(f'{label:>12} {median_ms:>10.2f} {body_bytes:>10} {requests:>9}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', type=int, default=20000, help='events stored before the writes')
+    parser.add_argument('--writes', type=int, default=20, help='inserts and updates after the sync token')
+    parser.add_argument('--page-size', type=int, default=100)
+    args = parser.parse_args()
+    run(args.size, args.writes, args.page_size)
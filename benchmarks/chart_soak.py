@@ -0,0 +1,81 @@
+"""Soak the statistics image endpoint and watch resident memory.
+
+Issues many ?format=image requests from several threads against a scratch
+database, posting a new event every few requests so the chart keeps changing
+and has to be re-rendered. Prints RSS at regular checkpoints; it should stay
+flat once the caches have warmed up.
+
+    python -m benchmarks.chart_soak --requests 10000 --threads 4
+"""
+import argparse
+import itertools
+import os
+import resource
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+
+def rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # Peak rather than current RSS, but still shows unbounded growth
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run(total, threads, write_every, checkpoints):
+    counter = itertools.count()
+    statuses = {}
+    lock = threading.Lock()
+
+    def worker(_):
+        client = main.app.test_client()
+        while True:
+            i = next(counter)
+            if i >= total:
+                return
+            if i % write_every == 0:
+                day = f'{i // write_every % 28 + 1:02d}-01-2024'
+                minute = i // write_every // 28
+                client.post('/api/events/', json={
+                    'name': f'soak {i}', 'date': day, 'from': f'{minute // 60:02d}:{minute % 60:02d}',
+                    'to': f'{minute // 60:02d}:{minute % 60:02d}', 'description': '',
+                    'location': {'street': '1 George St', 'suburb': 'Sydney', 'state': 'NSW', 'post-code': '2000'},
+                })
+            status = client.get('/api/events/statistics?format=image').status_code
+            with lock:
+                statuses[status] = statuses.get(status, 0) + 1
+            if i % (total // checkpoints) == 0:
+                print(f'{i:>8} requests  rss {rss_mb():8.1f} MB', flush=True)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        main.app.config['DATABASE'] = os.path.join(tmp, 'events.db')
+        main.init_db()
+        main.interval_index.loaded = False
+        before = rss_mb()
+        with ThreadPoolExecutor(threads) as pool:
+            list(pool.map(worker, range(threads)))
+        after = rss_mb()
+
+    print(f'statuses: {statuses}')
+    print(f'rss before {before:.1f} MB, after {after:.1f} MB')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=10000)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--write-every', type=int, default=10, help='post an event every N image requests')
+    parser.add_argument('--checkpoints', type=int, default=10)
+    args = parser.parse_args()
+    run(args.requests, args.threads, args.write_every, args.checkpoints)
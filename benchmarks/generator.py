@@ -0,0 +1,61 @@
+"""Synthetic calendars: event payloads and scratch databases of a given size.
+
+Events fill ``per_day`` half-hour slots a day from midnight. A fraction
+``overlap`` of them starts 15 minutes early instead, inside the previous
+event, so the overlap paths have something to find.
+"""
+import random
+import sqlite3
+from datetime import date, timedelta
+
+LOCATION = {'street': '1 George St', 'suburb': 'Sydney', 'state': 'NSW', 'post-code': '2000'}
+
+INSERT_EVENT = '''INSERT INTO events (name, date, from_time, to_time, street, suburb, state, post_code,
+description, last_update, start_epoch, end_epoch) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'''
+
+
+def generate_events(size, overlap=0.0, per_day=20, first_day=date(2000, 1, 1), seed=0, prefix='event'):
+    """Yield ``size`` event payloads shaped like a POST to /api/events/."""
+    if not 1 <= per_day <= 48:
+        raise ValueError('per_day must be between 1 and 48 half-hour slots')
+    rng = random.Random(seed)
+    for i in range(size):
+        day = (first_day + timedelta(days=i // per_day)).strftime('%d-%m-%Y')
+        start = i % per_day * 30
+        if start and overlap and rng.random() < overlap:
+            start -= 15
+        end = start + 29
+        yield {
+            'name': f'{prefix} {i}', 'date': day, 'from': f'{start // 60:02d}:{start % 60:02d}',
+            'to': f'{end // 60:02d}:{end % 60:02d}', 'description': '', 'location': dict(LOCATION),
+        }
+
+
+def event_row(event, last_update='2000-01-01T00:00:00'):
+    """The values INSERT_EVENT stores for an event payload."""
+    import main
+
+    location = event['location']
+    return (event['name'], event['date'], event['from'], event['to'], location['street'], location['suburb'],
+            location['state'], location['post-code'], event['description'], last_update,
+            *main.event_span(event['date'], event['from'], event['to']))
+
+
+def insert_rows(path, rows):
+    """Insert INSERT_EVENT rows directly, skipping the API and its overlap check."""
+    conn = sqlite3.connect(path)
+    conn.executemany(INSERT_EVENT, rows)
+    conn.commit()
+    conn.close()
+
+
+def seed(path, size, overlap=0.0, per_day=20):
+    """Point the app at a fresh database at ``path`` holding ``size`` generated events."""
+    import main
+
+    main.app.config['DATABASE'] = path
+    main.init_db()
+    for cache in (main.interval_index, main.event_columns, main.event_locations, main.recurrence_index):
+        cache.loaded = False
+    main.event_count.invalidate()
+    insert_rows(path, (event_row(event) for event in generate_events(size, overlap, per_day)))
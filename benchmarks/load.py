@@ -0,0 +1,140 @@
+"""Load driver: a mixed read/write workload against the API.
+
+In ``inprocess`` mode client threads share the app through Flask's test
+client, which measures the application without a network stack. In ``http``
+mode the app is served by a threaded werkzeug server and each client is its
+own process with a keep-alive connection, so clients don't compete with the
+server for the GIL. Upstream APIs are stubbed either way.
+
+    python -m benchmarks.load --mode http --clients 8 --requests 4000
+"""
+import argparse
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+from benchmarks.generator import generate_events
+
+
+def workload(worker, count, write_ratio, overlap, max_id):
+    """Yield ``(method, path, body)`` for one client; each client posts into its own range of days."""
+    rng = random.Random(worker)
+    posts = generate_events(count, overlap, first_day=date(2100, 1, 1) + timedelta(days=worker * 1000),
+                            seed=worker, prefix=f'load {worker}')
+    for _ in range(count):
+        roll = rng.random()
+        if roll < write_ratio:
+            yield 'POST', '/api/events/', next(posts)
+        elif roll < 0.55:
+            yield 'GET', f'/api/events/?page={rng.randint(1, 5)}&page_size=10', None
+        elif roll < 0.85:
+            yield 'GET', f'/api/events/{rng.randint(1, max_id)}', None
+        else:
+            yield 'GET', '/api/events/statistics', None
+
+
+def inprocess_worker(worker, count, write_ratio, overlap, max_id):
+    import main
+
+    client = main.app.test_client()
+    timings, statuses = [], Counter()
+    for method, path, body in workload(worker, count, write_ratio, overlap, max_id):
+        started = time.perf_counter()
+        response = client.open(path, method=method, json=body)
+        timings.append(time.perf_counter() - started)
+        statuses[f'{method} {response.status_code}'] += 1
+    return timings, statuses
+
+
+def http_worker(port, worker, count, write_ratio, overlap, max_id):
+    import http.client
+
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    timings, statuses = [], Counter()
+    for method, path, body in workload(worker, count, write_ratio, overlap, max_id):
+        started = time.perf_counter()
+        if body is None:
+            conn.request(method, path)
+        else:
+            conn.request(method, path, body=json.dumps(body), headers={'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        response.read()
+        timings.append(time.perf_counter() - started)
+        statuses[f'{method} {response.status}'] += 1
+    conn.close()
+    return timings, statuses
+
+
+def run(mode='inprocess', clients=8, requests=4000, write_ratio=0.1, overlap=0.0, seed_size=1000,
+        upstream_latency=0.0):
+    import main
+    from benchmarks.generator import seed
+    from benchmarks.stubs import StubUpstreams
+
+    per_client = requests // clients
+    with tempfile.TemporaryDirectory() as tmp, StubUpstreams(upstream_latency):
+        seed(os.path.join(tmp, 'events.db'), seed_size)
+        args = [(worker, per_client, write_ratio, overlap, seed_size) for worker in range(clients)]
+
+        if mode == 'inprocess':
+            started = time.perf_counter()
+            with ThreadPoolExecutor(clients) as pool:
+                outcomes = list(pool.map(lambda worker_args: inprocess_worker(*worker_args), args))
+            elapsed = time.perf_counter() - started
+        else:
+            from werkzeug.serving import make_server
+
+            logging.getLogger('werkzeug').setLevel(logging.WARNING)
+            server = make_server('127.0.0.1', 0, main.app, threaded=True)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            try:
+                with multiprocessing.get_context('spawn').Pool(clients) as pool:
+                    started = time.perf_counter()
+                    outcomes = pool.starmap(http_worker, [(server.port, *worker_args) for worker_args in args])
+                    elapsed = time.perf_counter() - started
+            finally:
+                server.shutdown()
+
+    timings = sorted(itertools.chain.from_iterable(timings for timings, _ in outcomes))
+    statuses = sum((statuses for _, statuses in outcomes), Counter())
+    # Posts that overlap are rejected with 409 by design; any 5xx is an error
+    errors = sum(count for status, count in statuses.items() if int(status.split()[1]) >= 500)
+    prefix = f'load.{mode}'
+    return [
+        {'name': f'{prefix}.throughput', 'value': round(len(timings) / elapsed, 1), 'unit': 'req/s',
+         'better': 'higher'},
+        {'name': f'{prefix}.p50', 'value': round(statistics.median(timings) * 1000, 3), 'unit': 'ms',
+         'better': 'lower'},
+        {'name': f'{prefix}.p99', 'value': round(timings[int(len(timings) * 0.99) - 1] * 1000, 3), 'unit': 'ms',
+         'better': 'lower'},
+        {'name': f'{prefix}.errors', 'value': errors, 'unit': 'requests', 'better': 'lower',
+         'statuses': dict(sorted(statuses.items()))},
+    ]
+
+
+def add_arguments(parser):
+    parser.add_argument('--mode', choices=('inprocess', 'http'), default='inprocess')
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=4000)
+    parser.add_argument('--write-ratio', type=float, default=0.1)
+    parser.add_argument('--overlap', type=float, default=0.0, help='fraction of posts that overlap an event')
+    parser.add_argument('--seed-size', type=int, default=1000, help='events stored before the run starts')
+    parser.add_argument('--upstream-latency', type=float, default=0.0, help='seconds added by the stub upstreams')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_arguments(parser)
+    args = parser.parse_args()
+    print(json.dumps(run(args.mode, args.clients, args.requests, args.write_ratio, args.overlap, args.seed_size,
+                         args.upstream_latency), indent=2))
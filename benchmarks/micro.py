@@ -0,0 +1,82 @@
+"""Micro-benchmarks for the hot paths: the overlap test, statistics and list paging.
+
+Each result is ``{'name', 'value', 'unit', 'better'}`` so runs can be compared
+with ``python -m benchmarks compare``.
+
+    python -m benchmarks.micro --size 100000
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+import timeit
+
+
+def per_call(fn, number, repeat=5):
+    """Best-of-``repeat`` seconds per call of ``fn``, over ``number`` calls each."""
+    return min(timeit.repeat(fn, number=number, repeat=repeat)) / number
+
+
+def median_seconds(fn, samples):
+    timings = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def result(name, value, unit, better='lower'):
+    return {'name': name, 'value': round(value, 4), 'unit': unit, 'better': better}
+
+
+def run(size=10000, samples=50):
+    import main
+    from benchmarks.generator import seed
+    from benchmarks.stubs import StubUpstreams
+
+    results = [
+        result('is_time_overlap.disjoint',
+               per_call(lambda: main.is_time_overlap('01-01-2030', '09:00', '10:00', '01-01-2030', '10:00', '11:00'),
+                        20000) * 1e6, 'us'),
+        result('is_time_overlap.overlapping',
+               per_call(lambda: main.is_time_overlap('01-01-2030', '09:00', '10:30', '01-01-2030', '10:00', '11:00'),
+                        20000) * 1e6, 'us'),
+    ]
+
+    with tempfile.TemporaryDirectory() as tmp, StubUpstreams():
+        seed(os.path.join(tmp, 'events.db'), size, overlap=0.05)
+        client = main.app.test_client()
+
+        def get(url, **query):
+            def fetch():
+                response = client.get(url, query_string=query)
+                assert response.status_code == 200, (url, response.status_code)
+            return fetch
+
+        last_page = max(size // 10, 1)
+        deep_cursor = main.encode_cursor('+id', [max(size - 20, 0)], 'next')
+        timings = {
+            'get_statistics_json': get('/api/events/statistics'),
+            'get_statistics_json.range': get('/api/events/statistics', **{'from': '2000-01-01', 'to': '2000-03-31'}),
+            'list.first_page': get('/api/events/'),
+            'list.offset_last_page': get('/api/events/', page=last_page),
+            'list.cursor_last_page': get('/api/events/', paging='cursor', cursor=deep_cursor),
+            'list.order_by_name': get('/api/events/', order='-name', count='false'),
+            'event.get': get('/api/events/1'),
+        }
+        for name, fetch in timings.items():
+            fetch()
+            results.append(result(name, median_seconds(fetch, samples) * 1000, 'ms'))
+
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', type=int, default=10000, help='events in the scratch database')
+    parser.add_argument('--samples', type=int, default=50)
+    args = parser.parse_args()
+    print(json.dumps(run(args.size, args.samples), indent=2))
@@ -0,0 +1,63 @@
+"""Write latency of EventList.post as the calendar grows.
+
+Seeds a scratch database with N events (20 half-hour slots per day) and then
+times a batch of non-conflicting posts through the Flask test client, once with
+the in-process interval index and once with the SQL range query.
+
+    python -m benchmarks.overlap_latency 1000 10000 100000 1000000
+"""
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from benchmarks.generator import LOCATION, seed  # noqa: E402
+
+SLOTS_PER_DAY = 20
+SAMPLES = 200
+
+
+def measure(client, size):
+    day = (date(2000, 1, 1) + timedelta(days=size // SLOTS_PER_DAY // 2)).strftime('%d-%m-%Y')
+    timings = []
+    for i in range(SAMPLES):
+        start, end = 12 * 60 + i, 12 * 60 + i + 1
+        payload = {
+            'name': 'probe', 'date': day, 'from': f'{start // 60:02d}:{start % 60:02d}',
+            'to': f'{end // 60:02d}:{end % 60:02d}', 'description': '',
+            'location': dict(LOCATION),
+        }
+        started = time.perf_counter()
+        response = client.post('/api/events/', json=payload)
+        timings.append(time.perf_counter() - started)
+        assert response.status_code == 201, response.data
+    timings.sort()
+    return statistics.median(timings) * 1000, timings[int(len(timings) * 0.99) - 1] * 1000
+
+
+def run(sizes):
+    client = main.app.test_client()
+    print(f"{'events':>10} {'mode':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    for size in sizes:
+        for use_index in (True, False):
+            with tempfile.TemporaryDirectory() as tmp:
+                seed(os.path.join(tmp, 'events.db'), size)
+                main.app.config['INTERVAL_INDEX'] = use_index
+                main.interval_index.loaded = False
+                if use_index:
+                    # Load the index outside the timed loop
+                    conn = sqlite3.connect(main.app.config['DATABASE'])
+                    main.find_conflicting_event(conn.cursor(), '', 0, 0)
+                    conn.close()
+                p50, p99 = measure(client, size)
+                print(f"{size:>10} {'index' if use_index else 'sql':>8} {p50:>8.3f} {p99:>8.3f}")
+
+
+if __name__ == '__main__':
+    run([int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000, 1000000])
@@ -0,0 +1,105 @@
+"""Weekly meetings stored as one recurring series each versus one row per meeting.
+
+Books ``series`` weekly half-hour meetings over ``years`` years both ways, then
+times a non-conflicting event post (the overlap check), the statistics for one
+year, the occurrences of one month and a month of availability.
+
+    python -m benchmarks.recurring_events 100 5
+"""
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from benchmarks.generator import LOCATION, event_row, insert_rows, seed  # noqa: E402
+
+SAMPLES = 50
+FIRST_DAY = date(2030, 1, 7)  # a Monday
+QUERIES = {
+    'statistics, 1 year': ('/api/events/statistics', {'from': '2031-01-01', 'to': '2031-12-31'}),
+    'occurrences, 1 month': ('/api/events/occurrences', {'from': '2031-03-01', 'to': '2031-03-31', 'limit': 1000}),
+    'availability, 1 month': ('/api/events/availability', {'from': '2031-03-01', 'to': '2031-03-31',
+                                                           'duration': 60, 'hours': '08:00-18:00', 'limit': 100}),
+}
+
+
+def meeting(k):
+    """Weekday and start time of the k-th weekly meeting: five a day from 08:00, half an hour apart."""
+    weekday, slot = k % 5, k // 5
+    start = 8 * 60 + slot * 30
+    return weekday, f'{start // 60:02d}:{start % 60:02d}', f'{(start + 29) // 60:02d}:{(start + 29) % 60:02d}'
+
+
+def book_rows(path, series, years):
+    rows = []
+    for k in range(series):
+        weekday, from_time, to_time = meeting(k)
+        for week in range(52 * years):
+            day = (FIRST_DAY + timedelta(days=week * 7 + weekday)).strftime('%d-%m-%Y')
+            rows.append(event_row({'name': f'meeting {k}', 'date': day, 'from': from_time, 'to': to_time,
+                                   'description': '', 'location': LOCATION}))
+    insert_rows(path, rows)
+    return len(rows)
+
+
+def book_series(client, series, years):
+    until = (FIRST_DAY + timedelta(weeks=52 * years) - timedelta(days=1)).strftime('%d-%m-%Y')
+    for k in range(series):
+        weekday, from_time, to_time = meeting(k)
+        response = client.post('/api/events/recurring', json={
+            'name': f'meeting {k}', 'from': from_time, 'to': to_time, 'description': '', 'location': LOCATION,
+            'rule': {'freq': 'weekly', 'by-day': [main.weekday_codes[weekday]],
+                     'start': FIRST_DAY.strftime('%d-%m-%Y'), 'until': until},
+        })
+        assert response.status_code == 201, response.get_json()
+    return series
+
+
+def median_ms(fn):
+    timings = []
+    for _ in range(SAMPLES):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000
+
+
+def run(series, years):
+    print(f"{'storage':>8} {'rows':>8} {'query':>22} {'median ms':>10}")
+    for storage in ('rows', 'series'):
+        with tempfile.TemporaryDirectory() as tmp, main.app.test_client() as client:
+            path = os.path.join(tmp, 'events.db')
+            seed(path, 0)
+            rows = book_rows(path, series, years) if storage == 'rows' else book_series(client, series, years)
+            probes = iter(range(10 ** 6))
+
+            def post():
+                # Evenings are free, so every probe passes the overlap check
+                i = next(probes)
+                day = (FIRST_DAY + timedelta(days=i // 60)).strftime('%d-%m-%Y')
+                start = 19 * 60 + i % 60
+                response = client.post('/api/events/', json={
+                    'name': 'probe', 'date': day, 'from': f'{start // 60:02d}:{start % 60:02d}',
+                    'to': f'{(start + 1) // 60:02d}:{(start + 1) % 60:02d}', 'description': '', 'location': LOCATION})
+                assert response.status_code == 201, response.data
+
+            def get(url, query):
+                def fetch():
+                    response = client.get(url, query_string=query)
+                    assert response.status_code == 200, response.get_json()
+                return fetch
+
+            timings = {'event post': post}
+            timings.update((label, get(url, query)) for label, (url, query) in QUERIES.items())
+            for label, fn in timings.items():
+                fn()
+                print(f'{storage:>8} {rows:>8} {label:>22} {median_ms(fn):>10.3f}')
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100, int(sys.argv[2]) if len(sys.argv) > 2 else 5)
@@ -0,0 +1,98 @@
+"""Latency of GET /api/events?q= over the FTS5 index versus a LIKE table scan.
+
+Seeds events whose names and descriptions are drawn from a Zipf-ish
+vocabulary, so there are rare words, common words and phrases to search for,
+then times the list endpoint with q= and the equivalent LIKE query.
+
+    python -m benchmarks.search_latency 1000000
+"""
+import itertools
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from benchmarks.generator import INSERT_EVENT  # noqa: E402
+
+SAMPLES = 20
+VOCABULARY = ['meeting', 'review', 'planning', 'standup', 'lunch', 'client', 'budget', 'roadmap', 'interview',
+              'workshop', 'training', 'retro', 'demo', 'launch', 'offsite', 'hiring', 'sync', 'design', 'audit',
+              'onboarding'] + [f'topic{i}' for i in range(5000)]
+QUERIES = {
+    'rare word': ('topic4321', ['%topic4321%']),
+    'common word': ('planning', ['%planning%']),
+    'prefix': ('onboard*', ['%onboard%']),
+    'phrase': ('"budget review"', ['%budget review%']),
+    'two words': ('client demo', ['%client%', '%demo%']),
+}
+
+
+def seed(path, size):
+    main.app.config['DATABASE'] = path
+    main.init_db()
+    rng = random.Random(0)
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(VOCABULARY))))
+    rows = []
+    conn = sqlite3.connect(path)
+    for i in range(size):
+        day = (date(2000, 1, 1) + timedelta(days=i // 48)).strftime('%d-%m-%Y')
+        from_time, to_time = f'{i % 48 // 2:02d}:{i % 2 * 30:02d}', f'{i % 48 // 2:02d}:{i % 2 * 30 + 29:02d}'
+        name = ' '.join(rng.choices(VOCABULARY, cum_weights=cum_weights, k=2)).capitalize()
+        description = ' '.join(rng.choices(VOCABULARY, cum_weights=cum_weights, k=8))
+        rows.append((name, day, from_time, to_time, '1 George St', 'Sydney', 'NSW', '2000', description,
+                     '2000-01-01T00:00:00', *main.event_span(day, from_time, to_time)))
+        if len(rows) == 100000 or i == size - 1:
+            conn.executemany(INSERT_EVENT, rows)
+            conn.commit()
+            rows = []
+    conn.close()
+
+
+def timed(fn):
+    timings = []
+    for _ in range(SAMPLES):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000
+
+
+def like_scan(conn, patterns):
+    # What a counted q= page costs without the index: every pattern against every searchable column
+    where = ' AND '.join('(name LIKE ? OR description LIKE ? OR street LIKE ? OR suburb LIKE ?)' for _ in patterns)
+    params = [pattern for pattern in patterns for _ in range(4)]
+    conn.execute(f'SELECT COUNT(*) FROM events WHERE {where}', params).fetchone()
+    conn.execute(f'SELECT id, name FROM events WHERE {where} ORDER BY id LIMIT 21', params).fetchall()
+
+
+def run(size):
+    with tempfile.TemporaryDirectory() as tmp:
+        started = time.perf_counter()
+        seed(os.path.join(tmp, 'events.db'), size)
+        print(f'{size} events seeded in {time.perf_counter() - started:.0f} s')
+        conn = sqlite3.connect(main.app.config['DATABASE'])
+        print(f"{'query':>12} {'matches':>8} {'q= ms':>8} {'no count':>9} {'by id':>8} {'like ms':>8}")
+        with main.app.test_client() as client:
+            for label, (q, patterns) in QUERIES.items():
+                query = {'q': q, 'filter': 'id,name', 'page_size': 20}
+                response = client.get('/api/events/', query_string=query)
+                assert response.status_code == 200, response.get_json()
+                matches = response.get_json()['metadata']['total_events']
+                search_ms = timed(lambda: client.get('/api/events/', query_string=query))
+                uncounted_ms = timed(lambda: client.get('/api/events/', query_string={**query, 'count': 'false'}))
+                by_id_ms = timed(lambda: client.get('/api/events/', query_string={**query, 'order': '-id'}))
+                like_ms = timed(lambda: like_scan(conn, patterns))
+                print(f'{label:>12} {matches:>8} {search_ms:>8.1f} {uncounted_ms:>9.1f} {by_id_ms:>8.1f} '
+                      f'{like_ms:>8.1f}')
+        conn.close()
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
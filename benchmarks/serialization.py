@@ -0,0 +1,107 @@
+"""Memory per cached event and serialization speed: EventRecord against flask_restx marshalling.
+
+The marshalling side rebuilds what the read paths did before EventRecord: the
+event cache kept each row with its marshalled body, and the list built a dict
+per row, called url_for for its link and marshalled the page. Both sides end in
+the same JSON text.
+
+    python -m benchmarks.serialization --size 20000 --page-size 1000
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import url_for  # noqa: E402
+from flask_restx import marshal  # noqa: E402
+
+import main  # noqa: E402
+from benchmarks.generator import seed  # noqa: E402
+
+
+def marshalled_body(row):
+    return marshal({
+        'id': row[0], 'name': row[1], 'date': row[2], 'from': row[3], 'to': row[4],
+        'location': {'street': row[5], 'suburb': row[6], 'state': row[7], 'post-code': row[8]},
+        'description': row[9], '_links': {'self': {'href': f'http://localhost:5000/api/events/{row[0]}'}},
+        '_metadata': None, 'last-update': row[10],
+    }, main.event)
+
+
+def marshalled_page(rows, filter_columns):
+    events = []
+    for row in rows:
+        event_dict = {}
+        for field, value in zip(filter_columns, row):
+            if field == 'date' or field == 'from_time':
+                event_dict['datetime'] = value if 'datetime' not in event_dict else event_dict['datetime'] + ' ' + value
+            else:
+                event_dict[field] = value
+        if 'id' in event_dict:
+            event_dict['_links'] = {'self': {'href': url_for('api/events_event', event_id=event_dict['id'],
+                                                             _external=True)}}
+        events.append(event_dict)
+    return json.dumps(marshal({'events': events, 'metadata': {}}, main.event_list_page))
+
+
+def record_page(rows, filter_columns):
+    encode = main.summary_encoder(filter_columns, main.json_string(main.link_template('api/events_event', 'event_id')))
+    return '{"events": [' + ', '.join([encode(row) for row in rows]) + '], "metadata": {}}'
+
+
+def bytes_per_event(build, rows):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    kept = [build(row) for row in rows]
+    size = sum(stat.size_diff for stat in tracemalloc.take_snapshot().compare_to(before, 'filename'))
+    tracemalloc.stop()
+    del kept
+    return size / len(rows)
+
+
+def run(size, page_size, number):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'events.db')
+        seed(path, size)
+        conn = sqlite3.connect(path)
+        rows = conn.execute('SELECT * FROM events ORDER BY id').fetchall()
+        filter_columns = ['id', 'name', 'date', 'from_time', 'last_update']
+        page = conn.execute(f"SELECT {', '.join(filter_columns)} FROM events ORDER BY id LIMIT ?",
+                            (page_size,)).fetchall()
+        conn.close()
+
+    print(f'{"cache entry":>24} {"bytes/event":>12}')
+    for label, build in (('row + marshalled body', lambda row: (row, marshalled_body(row))),
+                         ('EventRecord', main.EventRecord._make)):
+        print(f'{label:>24} {bytes_per_event(build, rows):>12.0f}')
+
+    with main.app.test_request_context():
+        assert json.loads(marshalled_page(page, filter_columns)) == json.loads(record_page(page, filter_columns))
+        assert json.loads(json.dumps(marshalled_body(rows[0]))) == json.loads(main.EventRecord._make(rows[0]).json())
+        cases = {
+            f'list page of {page_size}': (lambda: marshalled_page(page, filter_columns),
+                                          lambda: record_page(page, filter_columns), page_size),
+            'single event': (lambda: json.dumps(marshalled_body(rows[0])),
+                             lambda: main.EventRecord._make(rows[0]).json(), 1),
+        }
+        print(f'\n{"serialize":>24} {"marshal ms":>11} {"record ms":>10} {"events/s":>12} {"speedup":>8}')
+        for label, (old, new, events) in cases.items():
+            old_s = min(timeit.repeat(old, number=number, repeat=3)) / number
+            new_s = min(timeit.repeat(new, number=number, repeat=3)) / number
+            print(f'{label:>24} {old_s * 1000:>11.3f} {new_s * 1000:>10.3f} {events / new_s:>12.0f} '
+                  f'{old_s / new_s:>7.1f}x')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', type=int, default=20000, help='events whose cache footprint is measured')
+    parser.add_argument('--page-size', type=int, default=1000)
+    parser.add_argument('--number', type=int, default=20, help='serializations per timing')
+    args = parser.parse_args()
+    run(args.size, args.page_size, args.number)
@@ -0,0 +1,96 @@
+"""Radius and bounding-box event lookups: STRtree index versus a linear scan.
+
+Seeds events spread over the suburbs of the geocoding data, then times
+``near``/``bbox`` lookups against EventLocations and against geocoding every
+row and testing its distance, plus the full /api/events request.
+
+    python -m benchmarks.spatial_lookup 100000
+"""
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from benchmarks.generator import insert_rows  # noqa: E402
+
+SAMPLES = 20
+NEAR = (-33.87, 151.21)
+RADIUS = 10
+BBOX = (144.5, -38.2, 145.2, -37.6)
+
+
+def seed(path, size):
+    main.app.config['DATABASE'] = path
+    main.init_db()
+    geocoder = main.get_geocoder()
+    suburbs = list(geocoder.suburbs)
+    rng = random.Random(0)
+    rows = []
+    for i in range(size):
+        suburb, state = rng.choice(suburbs)
+        post_code = f'{geocoder.post_codes[geocoder.suburbs[suburb, state]]:04d}'
+        day = (date(2030, 1, 1) + timedelta(days=i // 48)).strftime('%d-%m-%Y')
+        from_time, to_time = f'{i % 48 // 2:02d}:{i % 2 * 30:02d}', f'{i % 48 // 2:02d}:{i % 2 * 30 + 29:02d}'
+        rows.append((f'event {i}', day, from_time, to_time, '1 Main St', suburb.title(), state, post_code, '',
+                     '2030-01-01T00:00:00', *main.event_span(day, from_time, to_time)))
+    insert_rows(path, rows)
+
+
+def timed(fn):
+    timings = []
+    for _ in range(SAMPLES):
+        started = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000, result
+
+
+def linear_scan(conn, inside):
+    geocoder = main.get_geocoder()
+    ids = []
+    for event_id, suburb, state, post_code in conn.execute(main.event_locations_query):
+        point = geocoder.locate(suburb, state, post_code)
+        if point is not None and inside(*point):
+            ids.append(event_id)
+    return ids
+
+
+def run(size):
+    with tempfile.TemporaryDirectory() as tmp:
+        seed(os.path.join(tmp, 'events.db'), size)
+        conn = sqlite3.connect(main.app.config['DATABASE'])
+        started = time.perf_counter()
+        main.event_locations.loaded = False
+        locations = main.get_event_locations(conn.cursor())
+        print(f'{size} events, index built in {(time.perf_counter() - started) * 1000:.0f} ms')
+
+        def in_radius(lat, lon):
+            return main.haversine_km(*NEAR, lat, lon) <= RADIUS
+
+        def in_bbox(lat, lon):
+            return BBOX[0] <= lon <= BBOX[2] and BBOX[1] <= lat <= BBOX[3]
+
+        print(f"{'query':>8} {'index ms':>10} {'scan ms':>10} {'matches':>8}")
+        for label, indexed, inside in (('near', lambda: locations.within_radius(*NEAR, RADIUS), in_radius),
+                                       ('bbox', lambda: locations.within_bbox(*BBOX), in_bbox)):
+            index_ms, ids = timed(indexed)
+            scan_ms, scanned = timed(lambda: linear_scan(conn, inside))
+            assert ids == sorted(scanned)
+            print(f'{label:>8} {index_ms:>10.2f} {scan_ms:>10.1f} {len(ids):>8}')
+        conn.close()
+
+        with main.app.test_client() as client:
+            query = {'near': f'{NEAR[0]},{NEAR[1]}', 'radius': RADIUS, 'filter': 'id,name', 'page_size': 20}
+            request_ms, _ = timed(lambda: client.get('/api/events/', query_string=query))
+        print(f'GET /api/events?near=...: {request_ms:.1f} ms')
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
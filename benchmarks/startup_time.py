@@ -0,0 +1,51 @@
+"""Cold-start cost: time from interpreter launch to the first served request.
+
+Each run spawns a fresh interpreter in a scratch directory, imports main and
+issues one GET /api/events/ through the test client. Reports the median of the
+import time, first-request time and total wall time across runs.
+
+    python -m benchmarks.startup_time --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = '''
+import json, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+response = main.app.test_client().get('/api/events/')
+served = time.perf_counter()
+assert response.status_code == 200, response.status_code
+print(json.dumps({'import': imported - started, 'first_request': served - imported}))
+'''
+
+
+def run_once():
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, PYTHONPATH=REPO)
+        started = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', PROBE], cwd=tmp, env=env, check=True,
+                                capture_output=True, text=True).stdout
+        wall = time.perf_counter() - started
+    timings = json.loads(output.strip().splitlines()[-1])
+    timings['wall'] = wall
+    return timings
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    runs = [run_once() for _ in range(args.runs)]
+    for key in ('import', 'first_request', 'wall'):
+        print(f'{key + " ms:":<18} {statistics.median(run[key] for run in runs) * 1000:.1f}')
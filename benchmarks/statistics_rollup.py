@@ -0,0 +1,60 @@
+"""get_statistics_json from the daily_counts rollup versus the old full scans.
+
+Seeds a scratch database (the triggers build the rollup as rows go in) and
+times the statistics endpoint against the four scan queries it replaced.
+
+    python -m benchmarks.statistics_rollup 1000000
+"""
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from benchmarks.generator import seed  # noqa: E402
+
+SAMPLES = 20
+
+SCAN_QUERIES = (
+    "SELECT COUNT(*) FROM events",
+    "SELECT COUNT(*) FROM events WHERE date >= date('now', 'weekday 0', '-7 days') AND date <= date('now', "
+    "'weekday 0')",
+    "SELECT COUNT(*) FROM events WHERE date >= date('now', 'start of month') AND date <= date('now', "
+    "'start of month', '+1 month', '-1 day')",
+    "SELECT date, COUNT(*) FROM events GROUP BY date",
+)
+
+
+def timed(fn):
+    timings = []
+    for _ in range(SAMPLES):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000
+
+
+def run(sizes):
+    client = main.app.test_client()
+    print(f"{'events':>10} {'rollup ms':>10} {'scan ms':>10}")
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            seed(os.path.join(tmp, 'events.db'), size)
+            conn = sqlite3.connect(main.app.config['DATABASE'])
+
+            def scan():
+                for query in SCAN_QUERIES:
+                    conn.execute(query).fetchall()
+
+            rollup_ms = timed(lambda: client.get('/api/events/statistics'))
+            scan_ms = timed(scan)
+            conn.close()
+        print(f"{size:>10} {rollup_ms:>10.2f} {scan_ms:>10.2f}")
+
+
+if __name__ == '__main__':
+    run([int(arg) for arg in sys.argv[1:]] or [10000, 100000, 1000000])
@@ -0,0 +1,98 @@
+"""Local stand-ins for the nager.at holiday API and the 7timer forecasts.
+
+    with StubUpstreams(latency=0.2) as stubs:
+        ...  # the app's upstream URLs point at the stubs until the block exits
+        print(stubs.requests)
+
+Responses have the shape the app parses; ``latency`` seconds are added to each
+one to model a slow upstream.
+"""
+import json
+import threading
+import time
+from collections import Counter
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+
+def holidays(year):
+    return [{'date': f'{year}-01-01', 'name': "New Year's Day"}, {'date': f'{year}-01-26', 'name': 'Australia Day'},
+            {'date': f'{year}-12-25', 'name': 'Christmas Day'}]
+
+
+def daily_forecast():
+    today = date.today()
+    return {'dataseries': [{'date': int((today + timedelta(days=i)).strftime('%Y%m%d')), 'weather': 'clear',
+                            'temp2m': {'max': 24, 'min': 14}, 'wind10m_max': 3} for i in range(7)]}
+
+
+def three_hourly_forecast():
+    return {'dataseries': [{'timepoint': 3 * (i + 1), 'weather': 'clearday', 'temp2m': 20, 'rh2m': '50%',
+                            'wind10m': {'direction': 'N', 'speed': 2}} for i in range(64)]}
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Every app thread may hit the stubs at once on a cold cache
+    request_queue_size = 128
+
+
+class StubUpstreams:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.requests = Counter()
+        self._saved = {}
+
+    def __enter__(self):
+        import main
+
+        stubs = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                path = urlparse(self.path).path
+                if path.startswith('/api/v2/publicholidays/'):
+                    upstream, body = 'nager', holidays(path.split('/')[4])
+                elif path == '/bin/civillight.php':
+                    upstream, body = '7timer-civillight', daily_forecast()
+                elif path == '/bin/civil.php':
+                    upstream, body = '7timer-civil', three_hourly_forecast()
+                else:
+                    upstream, body = None, None
+                stubs.requests[upstream or 'unknown'] += 1
+                if stubs.latency:
+                    time.sleep(stubs.latency)
+                payload = json.dumps(body).encode()
+                self.send_response(200 if body is not None else 404)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = StubServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+        base = f'http://127.0.0.1:{self._server.server_port}'
+        urls = {
+            'HOLIDAY_API_URL': base + '/api/v2/publicholidays/{year}/AU',
+            'WEATHER_API_URL': base + '/bin/civillight.php?lon={lon}&lat={lat}&ac=0&unit=metric&output=json',
+            'CITY_WEATHER_API_URL': base + '/bin/civil.php?lat={lat}&lon={lon}&ac=1&unit=metric&output=json',
+        }
+        self._saved = {key: main.app.config[key] for key in urls}
+        main.app.config.update(urls)
+        return self
+
+    def __exit__(self, *exc_info):
+        import main
+
+        for cache in (main.holiday_cache, main.weather_cache):
+            cache.drain()
+        main.app.config.update(self._saved)
+        self._server.shutdown()
+        self._server.server_close()
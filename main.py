@@ -1,18 +1,260 @@
-from datetime import datetime
+import base64
+import bisect
+import csv
+import functools
+import hashlib
+import heapq
+import itertools
+import json
+import logging
+import math
+import multiprocessing
+import os
+import queue
+import re
+import sys
+import time
+import threading
+from array import array
+from collections import Counter, OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from urllib.parse import urlencode
+from datetime import datetime, timedelta, timezone
 import requests
-from flask import Flask, request, url_for
-from flask_restx import Api, Resource, fields
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from flask import Flask, g, has_app_context, request, url_for
+from flask_restx import Api, Resource, fields, inputs
 import sqlite3
-from flask import send_file
-import numpy as np
-import matplotlib.pyplot as plt
+from flask import Response, send_file, stream_with_context
+from werkzeug.local import LocalProxy
 import io
-import geopandas as gpd
-from shapely.geometry import Point
-import matplotlib
-matplotlib.use('Agg')
+
+from recurrence import (EPOCH_ORDINAL, MAX_ORDINAL, Recurrence, RecurrenceIndex, day_seconds, iso_ordinal,
+                        load_recurrences, ordinal_day, recurrence_frequencies, weekday_codes)
+from shard_worker import shard_queries, shard_statistics, statistics_figures
 
 app = Flask(__name__)
+app.config.setdefault('DATABASE', 'events.db')
+# Each calendar under /api/calendars/<cid>/events is its own SQLite file <cid>.db in this directory
+app.config.setdefault('CALENDAR_DIR', os.path.join(app.instance_path, 'calendars'))
+# Processes that cross-calendar lists and statistics fan out over
+app.config.setdefault('SHARD_WORKERS', os.cpu_count() or 1)
+# Calendars kept open in this process, each with its own connection pool; past this the least recently used is closed
+app.config.setdefault('SHARD_CACHE_SIZE', 32)
+app.config.setdefault('DB_POOL_SIZE', 8)
+# Keep an in-process interval index (and recurrence rules) for overlap checks. It never
+# sees other processes' writes, so only enable it when a single process writes to the
+# database; otherwise the checks run the SQL range query inside the write transaction.
+app.config.setdefault('INTERVAL_INDEX', False)
+app.config.setdefault('HOLIDAY_API_URL', 'https://date.nager.at/api/v2/publicholidays/{year}/AU')
+app.config.setdefault('WEATHER_API_URL', 'http://www.7timer.info/bin/civillight.php?lon={lon}&lat={lat}&ac=0'
+                                         '&unit=metric&output=json&tzshift=0')
+# Three-hourly forecast drawn on the /weather map
+app.config.setdefault('CITY_WEATHER_API_URL', 'https://www.7timer.info/bin/civil.php?lat={lat}&lon={lon}&ac=1'
+                                              '&unit=metric&output=json&product=two')
+app.config.setdefault('UPSTREAM_TIMEOUT', 10)
+# Upstream GETs are retried with exponential backoff on connection errors and 429/5xx responses
+app.config.setdefault('UPSTREAM_RETRIES', 2)
+app.config.setdefault('UPSTREAM_BACKOFF', 0.2)
+# Keep-alive connections kept per upstream host
+app.config.setdefault('UPSTREAM_POOL_SIZE', 32)
+app.config.setdefault('HOLIDAY_TTL', 24 * 60 * 60)
+app.config.setdefault('WEATHER_TTL', 60 * 60)
+app.config.setdefault('WEATHER_CACHE_SIZE', 1024)
+# Forecasts are cached per grid cell of this many degrees
+app.config.setdefault('WEATHER_GRID', 0.5)
+# Seconds Event.get may wait for a metadata miss; 0 returns immediately and fills the cache in the background
+app.config.setdefault('METADATA_WAIT', 0)
+app.config.setdefault('RENDER_CACHE_BYTES', 64 * 1024 * 1024)
+# Rendered images also persist here across restarts; None keeps them in memory only
+app.config.setdefault('RENDER_CACHE_DIR', os.path.join(app.instance_path, 'render-cache'))
+app.config.setdefault('RENDER_CACHE_FILES', 256)
+app.config.setdefault('CHART_CACHE_BYTES', 16 * 1024 * 1024)
+# Statistics charts render on this many threads, with at most CHART_QUEUE more waiting
+app.config.setdefault('CHART_WORKERS', 2)
+app.config.setdefault('CHART_QUEUE', 8)
+# Bulk imports commit every BULK_CHUNK_SIZE rows and report at most BULK_MAX_ERRORS row errors
+app.config.setdefault('BULK_CHUNK_SIZE', 1000)
+app.config.setdefault('EVENT_CACHE_SIZE', 4096)
+# Bounds how long another process's writes can go unseen by this one's event cache
+app.config.setdefault('EVENT_CACHE_TTL', 30)
+app.config.setdefault('BULK_MAX_ERRORS', 1000)
+# List pages of more than this many events are streamed to the client as they are read
+app.config.setdefault('LIST_STREAM_ROWS', 1000)
+# CSV of postcode,suburb,state,lat,lon rows used to place events on the map
+app.config.setdefault('GEOCODE_DATA', os.path.join(app.root_path, 'data', 'postcodes.csv'))
+# Set to score only the newest this many matches of q= searches ordered by rank, so broad terms
+# stay cheap; pages then say "truncated": true when older matches were left out
+app.config.setdefault('SEARCH_RANK_WINDOW', None)
+# Long polls of /api/events/changes wait at most this many seconds; change streams send a comment this often
+app.config.setdefault('CHANGES_MAX_WAIT', 30)
+app.config.setdefault('CHANGES_HEARTBEAT', 15)
+# Waiting readers also recheck the change log this often, to see writes committed by other processes
+app.config.setdefault('CHANGES_POLL_INTERVAL', 1.0)
+# Statistics count occurrences of recurring events at most this many days past today, unless
+# a later ``to`` is asked for; series without an end never count past it
+app.config.setdefault('RECURRENCE_HORIZON', 366)
+# A series' until may be at most this many years after its start
+app.config.setdefault('RECURRENCE_MAX_YEARS', 100)
+# Each log message template is emitted at most LOG_RATE_LIMIT times per LOG_RATE_PERIOD seconds
+app.config.setdefault('LOG_RATE_LIMIT', 10)
+app.config.setdefault('LOG_RATE_PERIOD', 60)
+# Exposes /debug/profile, which samples every thread's stack; leave off in production
+app.config.setdefault('PROFILER', False)
+
+
+class RateLimitFilter(logging.Filter):
+    """Let through at most ``limit`` records per message template every ``period`` seconds.
+
+    The next record let through for a template reports how many were dropped.
+    """
+
+    def __init__(self, limit, period):
+        super().__init__()
+        self.limit = limit
+        self.period = period
+        self._lock = threading.Lock()
+        self._windows = {}
+
+    def filter(self, record):
+        key = (record.levelno, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            started, emitted, dropped = self._windows.get(key, (now, 0, 0))
+            if now - started >= self.period:
+                started, emitted = now, 0
+            if emitted >= self.limit:
+                self._windows[key] = (started, emitted, dropped + 1)
+                return False
+            self._windows[key] = (started, emitted + 1, 0)
+        if dropped:
+            record.msg = f'{record.msg} [{dropped} similar messages suppressed]'
+        return True
+
+
+logger = logging.getLogger(__name__)
+logger.addFilter(RateLimitFilter(app.config['LOG_RATE_LIMIT'], app.config['LOG_RATE_PERIOD']))
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histogram:
+    """Prometheus-style histogram keeping bucket counts, sum and count per label set."""
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, value, *label_values):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # One slot per bucket, one for +Inf, then the sum
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *label_values)
+
+    def timed(self, *label_values):
+        """Decorator recording each call of the wrapped function."""
+        def decorate(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.time(*label_values):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def collect(self):
+        with self._lock:
+            series = {label_values: list(counts) for label_values, counts in self._series.items()}
+        samples = []
+        for label_values, counts in sorted(series.items()):
+            labels = dict(zip(self.labels, label_values))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                samples.append(('_bucket', {**labels, 'le': str(bound)}, cumulative))
+            samples.append(('_sum', labels, counts[-1]))
+            samples.append(('_count', labels, cumulative))
+        return [(self.name, 'histogram', self.help, samples)]
+
+
+class Metrics:
+    """Registry rendering histograms and collector callbacks in the Prometheus text format.
+
+    A collector returns ``[(name, type, help, [(suffix, labels, value)])]`` when
+    scraped, which suits values the app already tracks, like cache counters.
+    """
+
+    def __init__(self):
+        self._sources = []
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        histogram = Histogram(name, help, labels, buckets)
+        self._sources.append(histogram.collect)
+        return histogram
+
+    def collector(self, fn):
+        self._sources.append(fn)
+        return fn
+
+    def render(self):
+        lines = []
+        for source in self._sources:
+            for name, kind, help, samples in source():
+                lines.append(f'# HELP {name} {help}')
+                lines.append(f'# TYPE {name} {kind}')
+                for suffix, labels, value in samples:
+                    label_text = ','.join(f'{key}="{escape_label(value)}"' for key, value in labels.items())
+                    lines.append(f'{name}{suffix}{{{label_text}}} {value}' if label_text else f'{name}{suffix} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+metrics = Metrics()
+request_latency = metrics.histogram('http_request_duration_seconds', 'Request latency by route',
+                                    ('method', 'route', 'status'))
+sql_latency = metrics.histogram('sqlite_statement_duration_seconds', 'Time spent executing and fetching SQLite '
+                                'statements', ('statement', 'phase'))
+upstream_latency = metrics.histogram('upstream_request_duration_seconds', 'Outbound HTTP request latency',
+                                     ('upstream',))
+render_latency = metrics.histogram('render_duration_seconds', 'Matplotlib render time by image', ('image',))
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_latency(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        request_latency.observe(time.perf_counter() - started, request.method, route, str(response.status_code))
+    return response
+
+
 api = Api(app, version='1.0', title='MyCalendar API', description='A time-management and scheduling calendar service')
 ns = api.namespace('api/events', description='Events operations')
 
@@ -63,35 +305,128 @@ event_patch = api.model('EventPatch', {
     'description': fields.String(description='The event description'),
 })
 
-event_list_response = api.model('Event', {
+event_list_response = api.model('EventSummary', {
     'id': fields.Integer(description='The unique identifier of the event'),
     'name': fields.String(description='The name of the event'),
     'datetime': fields.String(description='The date and time of the event'),
     'last_update': fields.String(description='The date and time of the last update'),
-    '_links': fields.Nested(api.model('Links', {
-        'self': fields.String(attribute='href', description='The link to the event details'),
+    '_links': fields.Nested(api.model('EventSummaryLinks', {
+        'self': fields.String(attribute='self.href', description='The link to the event details'),
     }), description='The links related to the event')
 })
 
+bulk_import_response = api.model('BulkImportResponse', {
+    'imported': fields.Integer(description='The number of events inserted'),
+    'failed': fields.Integer(description='The number of rows rejected'),
+    'errors': fields.List(fields.Nested(api.model('BulkImportError', {
+        'row': fields.Integer(description='The 1-based row number in the upload'),
+        'error': fields.String(description='Why the row was rejected'),
+    })), description='Per-row errors, capped at BULK_MAX_ERRORS'),
+})
 
-def get_statistics_image(self):
-    data = self.get_statistics_json()
+event_list_page = api.model('EventListPage', {
+    'events': fields.List(fields.Nested(event_list_response), description='The events on this page'),
+    'metadata': fields.Raw(description='Paging metadata and links'),
+})
+
+recurrence_rule = api.model('RecurrenceRule', {
+    'freq': fields.String(required=True, enum=['daily', 'weekly', 'monthly'], description='How often it repeats'),
+    'interval': fields.Integer(default=1, description='Repeat every this many days, weeks or months'),
+    'by-day': fields.List(fields.String, description='Weekdays of a weekly rule (MO..SU), defaults to the start day'),
+    'start': fields.String(required=True, description='The first day of the series (dd-mm-YYYY)'),
+    'until': fields.String(description='The last day the series may fall on (dd-mm-YYYY)'),
+    'count': fields.Integer(description='Stop after this many occurrences, instead of until'),
+    'exceptions': fields.List(fields.String, description='Days (dd-mm-YYYY) the series skips'),
+})
+
+recurring_event = api.model('RecurringEvent', {
+    'id': fields.Integer(readOnly=True, description='The series unique identifier'),
+    'name': fields.String(required=True, description='The event name'),
+    'from': fields.String(required=True, description='The start time of every occurrence'),
+    'to': fields.String(required=True, description='The end time of every occurrence'),
+    'location': event['location'],
+    'description': fields.String(description='The event description'),
+    'rule': fields.Nested(recurrence_rule, required=True, description='When the event recurs'),
+    '_links': fields.Raw(description='The series links'),
+    'last-update': fields.String(readOnly=True, description='The series last update timestamp'),
+})
+
+recurring_event_patch = api.model('RecurringEventPatch', {
+    'name': fields.String(description='The event name'),
+    'from': fields.String(description='The start time of every occurrence'),
+    'to': fields.String(description='The end time of every occurrence'),
+    'location': event_patch['location'],
+    'description': fields.String(description='The event description'),
+    'rule': fields.Raw(description='Rule fields to change; exceptions replace the stored list'),
+})
+
+recurring_event_list = api.model('RecurringEventList', {
+    'series': fields.List(fields.Nested(recurring_event), description='Every recurring event'),
+})
+
+event_change = api.model('EventChange', {
+    'token': fields.String(description='Pass as since to resume after this change'),
+    'id': fields.Integer(description='The event unique identifier'),
+    'op': fields.String(enum=['insert', 'update', 'delete'], description='The latest write to the event'),
+    'changed-at': fields.String(description='When the change was made'),
+    'event': fields.Nested(event, allow_null=True, description='The event as it is now, absent once deleted'),
+})
+
+event_change_page = api.model('EventChangePage', {
+    'changes': fields.List(fields.Nested(event_change), description='Changes in commit order, one per event'),
+    'next': fields.String(description='The token to pass as since on the next call'),
+    'has_more': fields.Boolean(description='Whether more changes are waiting past this page'),
+    '_links': fields.Raw(description='Links to this page and the next'),
+})
+
+
+@render_latency.timed('statistics')
+def render_statistics_chart(per_days):
+    """Draw the per-day bar chart on its own Figure; nothing touches pyplot's global state."""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
 
     # Generate a bar chart
-    x = np.arange(len(data['per-days']))
-    plt.bar(x, data['per-days'].values())
-    plt.xticks(x, data['per-days'].keys(), rotation='vertical')
-    plt.xlabel('Date')
-    plt.ylabel('Number of Events')
-    plt.title('Number of Events per Day')
+    x = range(len(per_days))
+    ax.bar(x, list(per_days.values()))
+    ax.set_xticks(list(x), list(per_days.keys()), rotation='vertical')
+    ax.set_xlabel('Date')
+    ax.set_ylabel('Number of Events')
+    ax.set_title('Number of Events per Day')
 
     # Save the chart to a buffer
     buf = io.BytesIO()
-    plt.savefig(buf, format='png')
-    buf.seek(0)
+    fig.savefig(buf, format='png', bbox_inches='tight')
+    return buf.getvalue()
+
+
+def get_statistics_image(self):
+    data = self.get_statistics_json()
+    per_days = data['per-days']
+
+    # The chart is a pure function of the per-day counts, so they key the cache
+    key = tuple(per_days.items())
+    etag = statistics_chart_cache.name(key)
+    if request.if_none_match.contains(etag):
+        return '', 304, {'ETag': f'"{etag}"'}
+
+    def render():
+        # Renders run on a small pool; when it's saturated, shed load instead of tying up request threads
+        if not chart_slots.acquire(blocking=False):
+            api.abort(503, 'Too many charts are being rendered, retry shortly')
+        try:
+            return chart_executor.submit(render_statistics_chart, per_days).result()
+        finally:
+            chart_slots.release()
+
+    png = statistics_chart_cache.get_or_render(key, render)
 
     # Return the image
-    return send_file(buf, mimetype='image/png', as_attachment=False)
+    return send_file(io.BytesIO(png), mimetype='image/png', as_attachment=False, etag=etag, conditional=True)
 
 
 cities = {
@@ -105,94 +440,523 @@ cities = {
 }
 
 
+retry_statuses = (429, 500, 502, 503, 504)
+
+
+def upstream_session():
+    """A requests session pooling connections to the upstream APIs and retrying failed GETs."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_maxsize=app.config['UPSTREAM_POOL_SIZE'], max_retries=Retry(
+        total=app.config['UPSTREAM_RETRIES'], backoff_factor=app.config['UPSTREAM_BACKOFF'],
+        status_forcelist=retry_statuses, allowed_methods=frozenset({'GET'}), raise_on_status=False))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+upstream = upstream_session()
+
+
 # 获取天气数据
+@upstream_latency.timed('7timer')
 def get_weather_data(lat, lng):
-    url = f"https://www.7timer.info/bin/civil.php?lat={lat}&lng={lng}&ac=1&unit=metric&output=json&product=two"
-    response = requests.get(url)
+    url = app.config['CITY_WEATHER_API_URL'].format(lat=lat, lon=lng)
+    try:
+        response = upstream.get(url, timeout=app.config['UPSTREAM_TIMEOUT'])
+    except requests.RequestException:
+        return None
     if response.status_code == 200:
         return response.json()
     else:
         return None
 
 
-city_weather_data = {}
-for city, coords in cities.items():
-    weather_data = get_weather_data(coords[0], coords[1])
-    city_weather_data[city] = weather_data
+_city_weather = {'data': None, 'version': None, 'fetched_at': 0}
+_city_weather_lock = threading.Lock()
 
-# 创建GeoDataFrame
-city_points = [Point(xy) for xy in cities.values()]
-gdf = gpd.GeoDataFrame(cities.keys(), geometry=city_points, crs="EPSG:4326")
 
-# 转换坐标参考系统以适应底图
-gdf = gdf.to_crs(epsg=3857)
+def get_city_weather():
+    """Return ``(forecasts, version, fetched_at)`` for every city.
 
-print(city_weather_data)
+    Forecasts are fetched concurrently on first use and again after WEATHER_TTL.
+    ``version`` is a digest of the forecasts themselves, so it is the same in
+    every process and across restarts for as long as 7timer serves the same data.
+    """
+    with _city_weather_lock:
+        if city_weather_expired():
+            with ThreadPoolExecutor(max_workers=len(cities), thread_name_prefix='city-weather') as pool:
+                _set_city_weather(pool.map(lambda coords: get_weather_data(*coords), cities.values()))
+        return _city_weather['data'], _city_weather['version'], _city_weather['fetched_at']
 
 
-def plot_weather_forecast(date, city_weather_data):
-    # 创建一个新的matplotlib图像和坐标轴
-    date_object = datetime.strptime(date, '%Y-%m-%d')
-    today = datetime.now()
-    days_diff = (date_object - today).days
-    fig, ax = plt.subplots(figsize=(10, 10))
+def city_weather_expired():
+    return _city_weather['data'] is None or time.time() - _city_weather['fetched_at'] > app.config['WEATHER_TTL']
+
+
+def store_city_weather(forecasts):
+    """Replace the snapshot with forecasts fetched elsewhere, given in the order of ``cities``."""
+    with _city_weather_lock:
+        _set_city_weather(forecasts)
+
+
+def _set_city_weather(forecasts):
+    data = dict(zip(cities, forecasts))
+    _city_weather['data'] = data
+    _city_weather['version'] = hashlib.sha1(json.dumps(data, sort_keys=True).encode()).hexdigest()
+    _city_weather['fetched_at'] = int(time.time())
+
+
+@functools.lru_cache(maxsize=None)
+def get_city_gdf():
+    import geopandas as gpd
+    from shapely.geometry import Point
+
+    # 创建GeoDataFrame
+    city_points = [Point(lon, lat) for lat, lon in cities.values()]
+    gdf = gpd.GeoDataFrame(list(cities.keys()), geometry=city_points, crs="EPSG:4326")
+
+    # 转换坐标参考系统以适应底图
+    return gdf.to_crs(epsg=3857)
+
+
+class Geocoder:
+    """Post code and suburb lookup over a CSV of ``postcode,suburb,state,lat,lon`` rows.
 
-    # 读取世界地图数据
+    Coordinates live in flat ``array('d')`` columns. Post codes are kept sorted in
+    an ``array('i')`` and searched with bisect; suburbs map to their row through a
+    dict keyed by upper-cased ``(suburb, state)``.
+    """
+
+    def __init__(self, path):
+        with open(path, newline='', encoding='utf-8') as f:
+            rows = sorted((int(record['postcode']), record['suburb'].strip().upper(), record['state'].strip().upper(),
+                           float(record['lat']), float(record['lon'])) for record in csv.DictReader(f))
+        self.post_codes = array('i', (row[0] for row in rows))
+        self.lats = array('d', (row[3] for row in rows))
+        self.lons = array('d', (row[4] for row in rows))
+        self.suburbs = {}
+        for i, row in enumerate(rows):
+            self.suburbs.setdefault((row[1], row[2]), i)
+
+    def __len__(self):
+        return len(self.post_codes)
+
+    def locate(self, suburb, state, post_code):
+        """Return ``(lat, lon)`` for a suburb, falling back to its post code, or None."""
+        i = self.suburbs.get((str(suburb or '').strip().upper(), str(state or '').strip().upper()))
+        post_code = str(post_code or '').strip()
+        if i is None and post_code.isdigit():
+            j = bisect.bisect_left(self.post_codes, int(post_code))
+            if j < len(self.post_codes) and self.post_codes[j] == int(post_code):
+                i = j
+        if i is None:
+            return None
+        return self.lats[i], self.lons[i]
+
+
+@functools.lru_cache(maxsize=None)
+def get_geocoder():
+    return Geocoder(app.config['GEOCODE_DATA'])
+
+
+# Used for the forecast of events whose suburb and post code are not in the geocoding data
+state_capitals = {"NSW": "Sydney", "VIC": "Melbourne", "QLD": "Brisbane", "WA": "Perth", "SA": "Adelaide",
+                  "ACT": "Canberra", "TAS": "Hobart"}
+
+
+@functools.lru_cache(maxsize=4096)
+def weather_location(suburb, state, post_code):
+    """Return the ``(lat, lon)`` of the city whose forecast applies to an event's location."""
+    coords = get_geocoder().locate(suburb, state, post_code)
+    if coords is not None:
+        city = min(cities, key=lambda name: haversine_km(*coords, *cities[name]))
+    else:
+        city = state_capitals.get(str(state or '').strip().upper(), "Sydney")
+    return tuple(cities[city])
+
+
+class RenderCache:
+    """LRU of rendered images bounded by total bytes, with an optional directory tier.
+
+    Entries are named by a hash of their key, which also serves as the ETag, so a
+    conditional request can be answered without rendering anything.
+    """
+
+    def __init__(self, max_bytes, directory=None, max_files=256):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_files = max_files
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._size = 0
+        self._rendering = {}
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def name(key):
+        return hashlib.sha1(repr(key).encode()).hexdigest()
+
+    def get_or_render(self, key, render):
+        name = self.name(key)
+        with self._lock:
+            data = self._lookup(name)
+            if data is not None:
+                self.hits += 1
+                return data
+            render_lock = self._rendering.setdefault(name, threading.Lock())
+
+        # Concurrent misses for the same image wait for a single render
+        try:
+            with render_lock:
+                with self._lock:
+                    data = self._lookup(name)
+                if data is None:
+                    data = self._read_file(name)
+                    if data is not None:
+                        self.disk_hits += 1
+                    else:
+                        self.misses += 1
+                        data = render()
+                        self._write_file(name, data)
+                    with self._lock:
+                        self._store(name, data)
+        finally:
+            with self._lock:
+                self._rendering.pop(name, None)
+        return data
+
+    def _lookup(self, name):
+        data = self._entries.get(name)
+        if data is not None:
+            self._entries.move_to_end(name)
+        return data
+
+    def _store(self, name, data):
+        if name in self._entries or len(data) > self.max_bytes:
+            return
+        self._entries[name] = data
+        self._size += len(data)
+        while self._size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+
+    def _read_file(self, name):
+        if not self.directory:
+            return None
+        try:
+            with open(os.path.join(self.directory, name), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _write_file(self, name, data):
+        if not self.directory:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, name)
+            with open(f'{path}.{threading.get_ident()}.tmp', 'wb') as f:
+                f.write(data)
+            os.replace(f.name, path)
+
+            files = [os.path.join(self.directory, entry) for entry in os.listdir(self.directory)]
+            for stale in sorted(files, key=os.path.getmtime)[:-self.max_files]:
+                os.remove(stale)
+        except OSError as e:
+            logger.warning("Failed to persist rendered image %s: %s", name, e)
+
+
+weather_render_cache = RenderCache(app.config['RENDER_CACHE_BYTES'], app.config['RENDER_CACHE_DIR'],
+                                   app.config['RENDER_CACHE_FILES'])
+statistics_chart_cache = RenderCache(app.config['CHART_CACHE_BYTES'])
+chart_executor = ThreadPoolExecutor(max_workers=app.config['CHART_WORKERS'], thread_name_prefix='chart')
+chart_slots = threading.BoundedSemaphore(app.config['CHART_WORKERS'] + app.config['CHART_QUEUE'])
+
+# Web Mercator extent of the forecast map, roughly Australia
+MAP_XLIM = (11000000, 18000000)
+MAP_YLIM = (-6000000, 0)
+
+
+def map_axes(fig):
+    """Add the full-figure map axes; the base layer and the city overlay must line up exactly."""
+    ax = fig.add_axes([0, 0, 1, 1])
+    ax.set_xlim(*MAP_XLIM)
+    ax.set_ylim(*MAP_YLIM)
+    ax.set_aspect('equal')
+    ax.set_axis_off()
+    return ax
+
+
+@functools.lru_cache(maxsize=4)
+@render_latency.timed('base_map')
+def render_base_map(dpi):
+    """Rasterise the world map once per dpi so requests only draw the cities on top."""
+    import geopandas as gpd
+    import numpy as np
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(10, 10), dpi=dpi)
+    canvas = FigureCanvasAgg(fig)
+    ax = map_axes(fig)
+
+    # 读取世界地图数据，投影到与城市相同的坐标系
     world = gpd.read_file(gpd.datasets.get_path('naturalearth_lowres'))
+    world = world[world['continent'] != 'Antarctica'].to_crs(epsg=3857)
 
     # 绘制世界地图，限制显示范围为澳大利亚
     world.plot(ax=ax, alpha=0.5, edgecolor="k")
-    ax.set_xlim(11000000, 18000000)
-    ax.set_ylim(-6000000, 0)
+    ax.set_xlim(*MAP_XLIM)
+    ax.set_ylim(*MAP_YLIM)
+    ax.set_aspect('equal')
+
+    canvas.draw()
+    return np.asarray(canvas.buffer_rgba()).copy()
+
+
+def plot_weather_forecast(date, city_weather_data, dpi=300):
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    date_object = datetime.strptime(date, '%Y-%m-%d')
+    today = datetime.now()
+    days_diff = (date_object - today).days
+
+    # 在预渲染的底图上绘制
+    fig = Figure(figsize=(10, 10), dpi=dpi)
+    FigureCanvasAgg(fig)
+    fig.figimage(render_base_map(dpi), zorder=0)
+    ax = map_axes(fig)
+    ax.set_zorder(1)
 
     # 绘制城市和天气预报
+    gdf = get_city_gdf()
     gdf.plot(ax=ax, alpha=0.5, edgecolor="k")
     for idx, row in gdf.iterrows():
         city = row[0]
         point = row['geometry']
-        weather_summary = city_weather_data[city]['dataseries'][days_diff]['weather']
+        forecast = city_weather_data.get(city)
+        weather_summary = forecast['dataseries'][days_diff]['weather'] if forecast else 'n/a'
         ax.text(point.x, point.y, f"{city}\n{weather_summary}", fontsize=12, ha="center")
 
-    plt.close(fig)
     return fig
 
 
+@render_latency.timed('weather')
+def render_weather_forecast(date, city_weather_data, dpi):
+    img_buffer = io.BytesIO()
+    plot_weather_forecast(date, city_weather_data, dpi).savefig(img_buffer, format='png')
+    return img_buffer.getvalue()
+
+
+def parse_day(value, name):
+    """Validate a ``YYYY-mm-dd`` query parameter, aborting with 400 otherwise."""
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%d')
+    except ValueError:
+        api.abort(400, f"{name} must be a YYYY-mm-dd date")
+
+
+def statistics_range():
+    """The optional from/to arguments (YYYY-mm-dd, inclusive) bounding total and per-days; None if not given."""
+    start = request.args.get('from', type=str)
+    end = request.args.get('to', type=str)
+    start = parse_day(start, 'from') if start else None
+    end = parse_day(end, 'to') if end else None
+    return start, end
+
+
 def get_statistics_json(self):
-    conn = sqlite3.connect('events.db')
-    c = conn.cursor()
+    c = get_db().cursor()
+    start, end = statistics_range()
+    return statistics_figures(c, start, end, get_recurrences(c), app.config['RECURRENCE_HORIZON'])
 
-    # Total number of events
-    c.execute("SELECT COUNT(*) FROM events")
-    total_count = c.fetchone()[0]
 
-    # Total number of events in current week
-    c.execute("SELECT COUNT(*) FROM events WHERE date >= date('now', 'weekday 0', '-7 days') AND date <= date("
-              "'now', 'weekday 0')")
-    total_current_week = c.fetchone()[0]
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -64000,
+    'mmap_size': 268435456,
+    'temp_store': 'MEMORY',
+}
 
-    # Total number of events in current month
-    c.execute("SELECT COUNT(*) FROM events WHERE date >= date('now', 'start of month') AND date <= date('now', "
-              "'start of month', '+1 month', '-1 day')")
-    total_current_month = c.fetchone()[0]
 
-    # Number of events per day
-    c.execute("SELECT date, COUNT(*) FROM events GROUP BY date")
-    per_days = dict(c.fetchall())
+def statement_kind(sql):
+    return sql.lstrip().split(None, 1)[0].upper() if sql.strip() else 'EMPTY'
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor recording execute and fetch times per statement kind (SELECT, INSERT, ...)."""
+
+    kind = 'NONE'
+
+    def execute(self, sql, parameters=()):
+        self.kind = statement_kind(sql)
+        with sql_latency.time(self.kind, 'execute'):
+            return super().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        self.kind = statement_kind(sql)
+        with sql_latency.time(self.kind, 'execute'):
+            return super().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        with sql_latency.time('SCRIPT', 'execute'):
+            return super().executescript(sql_script)
+
+    def fetchone(self):
+        with sql_latency.time(self.kind, 'fetch'):
+            return super().fetchone()
+
+    def fetchmany(self, size=None):
+        with sql_latency.time(self.kind, 'fetch'):
+            return super().fetchmany(self.arraysize if size is None else size)
+
+    def fetchall(self):
+        with sql_latency.time(self.kind, 'fetch'):
+            return super().fetchall()
+
+
+class TimedConnection(sqlite3.Connection):
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+
+class ConnectionPool:
+    """Bounded pool of SQLite connections shared by the WSGI worker threads.
+
+    A connection is only ever used by one thread at a time, but it may be handed
+    to a different thread on its next checkout, hence ``check_same_thread=False``.
+    """
+
+    def __init__(self, database, size):
+        self.database = database
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._closed = False
+
+    def acquire(self, timeout=30):
+        if not self._slots.acquire(timeout=timeout):
+            raise RuntimeError('Timed out waiting for a database connection')
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            return self._connect()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+        self._slots.release()
+        if self._closed:
+            self.close()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        """Close the idle connections; those still checked out are closed when they are released."""
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
 
-    conn.close()
+    def _connect(self):
+        conn = sqlite3.connect(self.database, timeout=30, check_same_thread=False, cached_statements=256,
+                               factory=TimedConnection)
+        for pragma, value in SQLITE_PRAGMAS.items():
+            conn.execute(f'PRAGMA {pragma}={value}')
+        return conn
 
-    response_data = {
-        "total": total_count,
-        "total-current-week": total_current_week,
-        "total-current-month": total_current_month,
-        "per-days": per_days
-    }
 
-    return response_data
+def get_pool():
+    return current_shard().pool()
+
+
+def get_db():
+    """Return the connection bound to the current request, checking one out on first use."""
+    if 'db' not in g:
+        g.db_pool = get_pool()
+        g.db = g.db_pool.acquire()
+    return g.db
+
+
+@app.teardown_appcontext
+def release_db(exception):
+    conn = g.pop('db', None)
+    if conn is not None:
+        g.pop('db_pool').release(conn)
+
+
+class ChangeFeed:
+    """Wakes readers waiting on the change log when this process commits a write.
+
+    Commits by other processes aren't published here, which is why waiters also
+    recheck the log every ``CHANGES_POLL_INTERVAL``.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._version = 0
+        self._listeners = []
+
+    @property
+    def version(self):
+        return self._version
+
+    def publish(self):
+        with self._condition:
+            self._version += 1
+            self._condition.notify_all()
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener()
+
+    def wait(self, version, timeout):
+        """Block until something was published after ``version``, or ``timeout`` seconds pass."""
+        with self._condition:
+            return self._condition.wait_for(lambda: self._version != version, timeout)
+
+    def subscribe(self, listener):
+        """Call ``listener()`` after every publish, from the publishing thread."""
+        with self._condition:
+            self._listeners.append(listener)
+
+
+change_feed = LocalProxy(lambda: current_shard().change_feed)
+
+
+def commit_or_reload_index(conn):
+    """Commit ``conn``; on failure drop the in-process indexes, which may hold rows that never landed."""
+    try:
+        conn.commit()
+    except sqlite3.Error:
+        interval_index.loaded = False
+        recurrence_index.loaded = False
+        raise
+    change_feed.publish()
 
 
 def init_db():
-    conn = sqlite3.connect('events.db')
+    with get_pool().connection() as conn:
+        init_schema(conn)
+
+
+def init_schema(conn):
     c = conn.cursor()
     c.execute('''CREATE TABLE IF NOT EXISTS events
                  (id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -205,66 +969,1271 @@ def init_db():
                   state TEXT NOT NULL,
                   post_code TEXT NOT NULL,
                   description TEXT,
+                  last_update TEXT NOT NULL,
+                  start_epoch INTEGER,
+                  end_epoch INTEGER)''')
+
+    # Databases created before the epoch columns existed are migrated in place
+    columns = {row[1] for row in c.execute('PRAGMA table_info(events)')}
+    if 'start_epoch' not in columns:
+        c.execute('ALTER TABLE events ADD COLUMN start_epoch INTEGER')
+        c.execute('ALTER TABLE events ADD COLUMN end_epoch INTEGER')
+    c.execute('SELECT id, date, from_time, to_time FROM events WHERE start_epoch IS NULL')
+    backfill = [(*event_span(date, from_time, to_time), event_id)
+                for event_id, date, from_time, to_time in c.fetchall()]
+    c.executemany('UPDATE events SET start_epoch=?, end_epoch=? WHERE id=?', backfill)
+
+    c.execute('CREATE INDEX IF NOT EXISTS idx_events_date_span ON events (date, start_epoch, end_epoch)')
+    # Series conflict checks scan a range of start times across days
+    c.execute('CREATE INDEX IF NOT EXISTS idx_events_span ON events (start_epoch, end_epoch)')
+    # Keyset paging walks these instead of sorting the table for every page
+    c.execute('CREATE INDEX IF NOT EXISTS idx_events_name ON events (name, id)')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_events_datetime ON events (date || ' ' || from_time, id)")
+
+    # Per-day event counts keyed by ISO date, maintained by the triggers below
+    c.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='daily_counts'")
+    if c.fetchone() is None:
+        c.execute('CREATE TABLE daily_counts (day TEXT PRIMARY KEY, count INTEGER NOT NULL) WITHOUT ROWID')
+        c.execute("INSERT INTO daily_counts SELECT date(start_epoch, 'unixepoch'), COUNT(*) FROM events "
+                  "GROUP BY 1")
+    c.executescript(daily_count_triggers)
+
+    # Full-text index over the searchable columns, reading its text from events (external content)
+    c.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='events_fts'")
+    if c.fetchone() is None:
+        c.execute("CREATE VIRTUAL TABLE events_fts USING fts5(name, description, street, suburb, content='events', "
+                  "content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3')")
+        c.execute("INSERT INTO events_fts (events_fts) VALUES ('rebuild')")
+    c.executescript(events_fts_triggers)
+
+    # One row per recurring event; occurrences are computed from the rule, never stored.
+    # until_date also holds the last day of a series limited by count.
+    c.execute('''CREATE TABLE IF NOT EXISTS recurrences
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  name TEXT NOT NULL,
+                  from_time TEXT NOT NULL,
+                  to_time TEXT NOT NULL,
+                  street TEXT NOT NULL,
+                  suburb TEXT NOT NULL,
+                  state TEXT NOT NULL,
+                  post_code TEXT NOT NULL,
+                  description TEXT,
+                  freq TEXT NOT NULL,
+                  interval INTEGER NOT NULL,
+                  by_day TEXT,
+                  start_date TEXT NOT NULL,
+                  until_date TEXT,
+                  count INTEGER,
+                  exceptions TEXT NOT NULL,
                   last_update TEXT NOT NULL)''')
+
+    # The latest change of every event in commit order, maintained by the triggers below. A deleted event
+    # keeps a tombstone row; seq never goes back, so it serves as the client's sync token.
+    c.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='event_changes'")
+    if c.fetchone() is None:
+        c.execute('''CREATE TABLE event_changes
+                     (seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                      event_id INTEGER NOT NULL UNIQUE,
+                      op TEXT NOT NULL,
+                      changed_at TEXT NOT NULL)''')
+        # Events stored before the log existed start it, so syncing from 0 still yields every event
+        c.execute("INSERT INTO event_changes (event_id, op, changed_at) "
+                  "SELECT id, 'insert', last_update FROM events ORDER BY id")
+    c.executescript(event_change_triggers)
     conn.commit()
-    conn.close()
 
 
-init_db()
+daily_count_triggers = '''
+CREATE TRIGGER IF NOT EXISTS daily_counts_insert AFTER INSERT ON events
+WHEN NEW.start_epoch IS NOT NULL BEGIN
+    INSERT INTO daily_counts (day, count) VALUES (date(NEW.start_epoch, 'unixepoch'), 1)
+    ON CONFLICT (day) DO UPDATE SET count = count + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS daily_counts_delete AFTER DELETE ON events
+WHEN OLD.start_epoch IS NOT NULL BEGIN
+    UPDATE daily_counts SET count = count - 1 WHERE day = date(OLD.start_epoch, 'unixepoch');
+    DELETE FROM daily_counts WHERE day = date(OLD.start_epoch, 'unixepoch') AND count <= 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS daily_counts_update AFTER UPDATE OF start_epoch ON events
+WHEN date(OLD.start_epoch, 'unixepoch') IS NOT date(NEW.start_epoch, 'unixepoch') BEGIN
+    UPDATE daily_counts SET count = count - 1 WHERE day = date(OLD.start_epoch, 'unixepoch');
+    DELETE FROM daily_counts WHERE day = date(OLD.start_epoch, 'unixepoch') AND count <= 0;
+    INSERT INTO daily_counts (day, count) SELECT date(NEW.start_epoch, 'unixepoch'), 1
+    WHERE NEW.start_epoch IS NOT NULL
+    ON CONFLICT (day) DO UPDATE SET count = count + 1;
+END;
+'''
+
+
+events_fts_triggers = '''
+CREATE TRIGGER IF NOT EXISTS events_fts_insert AFTER INSERT ON events BEGIN
+    INSERT INTO events_fts (rowid, name, description, street, suburb)
+    VALUES (NEW.id, NEW.name, NEW.description, NEW.street, NEW.suburb);
+END;
+CREATE TRIGGER IF NOT EXISTS events_fts_delete AFTER DELETE ON events BEGIN
+    INSERT INTO events_fts (events_fts, rowid, name, description, street, suburb)
+    VALUES ('delete', OLD.id, OLD.name, OLD.description, OLD.street, OLD.suburb);
+END;
+CREATE TRIGGER IF NOT EXISTS events_fts_update AFTER UPDATE OF name, description, street, suburb ON events BEGIN
+    INSERT INTO events_fts (events_fts, rowid, name, description, street, suburb)
+    VALUES ('delete', OLD.id, OLD.name, OLD.description, OLD.street, OLD.suburb);
+    INSERT INTO events_fts (rowid, name, description, street, suburb)
+    VALUES (NEW.id, NEW.name, NEW.description, NEW.street, NEW.suburb);
+END;
+'''
+
+
+# REPLACE drops an event's previous change, so the log holds one row per event
+event_change_triggers = '''
+CREATE TRIGGER IF NOT EXISTS event_changes_insert AFTER INSERT ON events BEGIN
+    INSERT OR REPLACE INTO event_changes (event_id, op, changed_at) VALUES (NEW.id, 'insert', NEW.last_update);
+END;
+CREATE TRIGGER IF NOT EXISTS event_changes_update AFTER UPDATE ON events BEGIN
+    INSERT OR REPLACE INTO event_changes (event_id, op, changed_at) VALUES (NEW.id, 'update', NEW.last_update);
+END;
+CREATE TRIGGER IF NOT EXISTS event_changes_delete AFTER DELETE ON events BEGIN
+    INSERT OR REPLACE INTO event_changes (event_id, op, changed_at)
+    VALUES (OLD.id, 'delete', strftime('%Y-%m-%dT%H:%M:%f', 'now'));
+END;
+'''
+
+
+def to_epoch(date: str, time: str) -> int:
+    """Convert a ``dd-mm-YYYY`` date and ``HH:MM`` time to UTC epoch seconds."""
+    day, month, year = date.split('-')
+    hour, minute = time.split(':')
+    return int(datetime(int(year), int(month), int(day), int(hour), int(minute), tzinfo=timezone.utc).timestamp())
+
+
+def event_span(date: str, start: str, end: str) -> tuple:
+    """Return the ``(start_epoch, end_epoch)`` pair stored for an event."""
+    return to_epoch(date, start), to_epoch(date, end)
+
+
+class IntervalIndex:
+    """In-process index of event spans, bucketed by date and sorted by start.
+
+    Every bucket remembers the longest span it has held, so an overlap query
+    only looks at entries starting inside ``(start - longest, end)`` instead of
+    every event in the calendar.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._days = {}
+        self._longest = {}
+        self._spans = {}
+        self.loaded = False
+
+    def load(self, rows):
+        with self._lock:
+            self._days.clear()
+            self._longest.clear()
+            self._spans.clear()
+            for event_id, date, start, end in rows:
+                self._insert(event_id, date, start, end)
+            self.loaded = True
+
+    def add(self, event_id, date, start, end):
+        with self._lock:
+            self._remove(event_id)
+            self._insert(event_id, date, start, end)
+
+    def discard(self, event_id):
+        with self._lock:
+            self._remove(event_id)
+
+    def find_overlap(self, date, start, end, exclude_id=None):
+        with self._lock:
+            bucket = self._days.get(date)
+            if not bucket:
+                return None
+            lo = bisect.bisect_right(bucket, (start - self._longest[date], float('inf')))
+            hi = bisect.bisect_left(bucket, (end,))
+            for other_start, other_end, event_id in bucket[lo:hi]:
+                if other_end > start and event_id != exclude_id:
+                    return event_id
+            return None
+
+    def day_spans(self, date):
+        """Return the ``(start, end)`` spans held for ``date``, sorted by start."""
+        with self._lock:
+            return [(start, end) for start, end, _ in self._days.get(date, ())]
+
+    def _insert(self, event_id, date, start, end):
+        bisect.insort(self._days.setdefault(date, []), (start, end, event_id))
+        self._longest[date] = max(self._longest.get(date, 0), end - start)
+        self._spans[event_id] = (date, start, end)
+
+    def _remove(self, event_id):
+        span = self._spans.pop(event_id, None)
+        if span is None:
+            return
+        date, start, end = span
+        bucket = self._days[date]
+        i = bisect.bisect_left(bucket, (start, end, event_id))
+        if i < len(bucket) and bucket[i][2] == event_id:
+            del bucket[i]
+        if not bucket:
+            del self._days[date]
+            del self._longest[date]
+
+
+interval_index = LocalProxy(lambda: current_shard().interval_index)
+
+
+def get_interval_index(c):
+    if not interval_index.loaded:
+        c.execute('SELECT id, date, start_epoch, end_epoch FROM events')
+        interval_index.load(c.fetchall())
+    return interval_index
+
+
+def find_conflicting_event(c, date, start, end, exclude_id=None):
+    """Return the id of an event overlapping ``[start, end)`` on ``date``, if any."""
+    if app.config['INTERVAL_INDEX']:
+        return get_interval_index(c).find_overlap(date, start, end, exclude_id)
+
+    c.execute('SELECT id FROM events WHERE date=? AND start_epoch<? AND end_epoch>? AND id IS NOT ? LIMIT 1',
+              (date, end, start, exclude_id))
+    row = c.fetchone()
+    return row[0] if row else None
+
+
+# Days of stored events read per query by an availability search without the interval index
+BUSY_CHUNK_DAYS = 32
+
+
+def busy_days(c, first, last, recurrences):
+    """Yield ``(date, midnight, spans)`` for each day from ``first`` to ``last``, spans sorted by start.
+
+    Without the interval index stored events are read ``BUSY_CHUNK_DAYS`` days
+    per query off ``idx_events_span``, so a search that stops early leaves the
+    remaining chunks unread. ``recurrences`` holds the stored rules.
+    """
+    index = get_interval_index(c) if app.config['INTERVAL_INDEX'] else None
+    ordinal, last = first.toordinal(), last.toordinal()
+    while ordinal <= last:
+        chunk_end = min(ordinal + BUSY_CHUNK_DAYS, last + 1)
+        if index is None:
+            c.execute('SELECT start_epoch, end_epoch FROM events WHERE start_epoch >= ? AND start_epoch < ? '
+                      'ORDER BY start_epoch', ((ordinal - EPOCH_ORDINAL) * 86400, (chunk_end - EPOCH_ORDINAL) * 86400))
+            stored = c.fetchall()
+            starts = [start for start, _ in stored]
+            hi = 0
+        for day in range(ordinal, chunk_end):
+            date = datetime.fromordinal(day).strftime('%d-%m-%Y')
+            if index is None:
+                lo, hi = hi, bisect.bisect_left(starts, (day + 1 - EPOCH_ORDINAL) * 86400, hi)
+                spans = stored[lo:hi]
+            else:
+                spans = index.day_spans(date)
+            occurrences = recurrences.day_spans(day)
+            yield date, (day - EPOCH_ORDINAL) * 86400, sorted(spans + occurrences) if occurrences else spans
+        ordinal = chunk_end
+
+
+def free_slots(busy, window_start, window_end, duration):
+    """Sweep sorted busy spans and yield the gaps in ``[window_start, window_end)`` of at least ``duration``."""
+    cursor = window_start
+    for start, end in busy:
+        if start >= window_end:
+            break
+        if start - cursor >= duration:
+            yield cursor, start
+        cursor = max(cursor, end)
+    if window_end - cursor >= duration:
+        yield cursor, window_end
+
+
+recurrence_index = LocalProxy(lambda: current_shard().recurrence_index)
+
+
+def get_recurrences(c):
+    """Return the stored rules, cached in process alongside the interval index or re-read without it."""
+    if app.config['INTERVAL_INDEX'] and recurrence_index.loaded:
+        return recurrence_index
+    return load_recurrences(c, recurrence_index if app.config['INTERVAL_INDEX'] else RecurrenceIndex())
+
+
+def find_series_conflict(c, rule, exclude_id=None):
+    """Describe the first booking an occurrence of ``rule`` would overlap, or return None.
+
+    Other series are compared rule against rule. Stored events are narrowed in
+    SQL to the series' date range and time of day, then tested with
+    ``occurs_on``, so the series itself is never expanded.
+    """
+    for other in get_recurrences(c).rules():
+        if other.id != exclude_id and other.start < rule.end and other.end > rule.start:
+            day = rule.first_shared_day(other)
+            if day is not None:
+                return f"The series overlaps with series {other.id} on {ordinal_day(day)}."
+
+    until = MAX_ORDINAL if rule.until is None else rule.until
+    c.execute('SELECT id, start_epoch FROM events WHERE start_epoch >= ? AND start_epoch < ? '
+              'AND start_epoch % 86400 < ? AND end_epoch % 86400 > ?',
+              ((rule.first - EPOCH_ORDINAL) * 86400, (until + 1 - EPOCH_ORDINAL) * 86400, rule.end, rule.start))
+    for event_id, start in c.fetchall():
+        day = start // 86400 + EPOCH_ORDINAL
+        if rule.occurs_on(day):
+            return f"The series overlaps with event {event_id} on {ordinal_day(day)}."
+    return None
+
 
 column_mapping = {
     "from": "from_time",
     "to": "to_time"
 }
 
+# Columns the list endpoint can select and order by
+list_columns = ("id", "name", "date", "from_time", "to_time", "street", "suburb", "state", "post_code",
+                "description", "last_update", "datetime")
+
+# SQL expressions used when ordering by a column that isn't a plain non-null column
+sort_expressions = {
+    "datetime": "date || ' ' || from_time",
+    "description": "IFNULL(description, '')",
+    "rank": "matches.rank",
+}
+
+# bm25 weights for name, description, street and suburb; lower ranks are better matches
+search_rank = "bm25(events_fts, 10.0, 4.0, 1.0, 2.0)"
+search_ranked_source = (f"events JOIN (SELECT rowid AS match_id, {search_rank} AS rank FROM events_fts "
+                        "WHERE events_fts MATCH ? ORDER BY rowid DESC LIMIT ?) AS matches "
+                        "ON matches.match_id = events.id")
+search_condition = "id IN (SELECT rowid FROM events_fts WHERE events_fts MATCH ?)"
+
+
+def search_query(q):
+    """Translate a ``q`` search string into an FTS5 MATCH expression.
+
+    Every word must match; a trailing ``*`` makes it a prefix, and double-quoted
+    text must match as a phrase. Other punctuation is dropped, so user input
+    can't reach FTS5's query syntax.
+    """
+    terms = []
+    for phrase, word in re.findall(r'"([^"]*)"|(\S+)', q):
+        tokens = re.findall(r'\w+', phrase or word)
+        if tokens:
+            terms.append('"' + ' '.join(tokens) + '"' + ('*' if word.endswith('*') else ''))
+    if not terms:
+        api.abort(400, 'q must contain at least one word')
+    return ' '.join(terms)
+
+
+class EventCount:
+    """``SELECT COUNT(*) FROM events``, cached until a local write or ``ttl`` seconds pass."""
+
+    def __init__(self, ttl=5):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._value = None
+        self._expires = 0
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, c):
+        with self._lock:
+            if self._value is not None and time.monotonic() < self._expires:
+                self.hits += 1
+                return self._value
+            self.misses += 1
+            generation = self._generation
+        c.execute("SELECT COUNT(*) FROM events")
+        value = c.fetchone()[0]
+        with self._lock:
+            if generation == self._generation:
+                self._value, self._expires = value, time.monotonic() + self.ttl
+        return value
+
+    def invalidate(self):
+        with self._lock:
+            self._value = None
+            self._generation += 1
+
+
+event_count = LocalProxy(lambda: current_shard().event_count)
+
+
+def encode_cursor(order, keys, direction):
+    payload = json.dumps({'o': order, 'k': keys, 'd': direction}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, order, key_count):
+    """Return ``(keys, direction)`` from a cursor, rejecting ones minted for a different ordering."""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        keys, direction = payload['k'], payload['d']
+        valid = payload['o'] == order and direction in ('next', 'prev') and len(keys) == key_count
+    except (ValueError, TypeError, KeyError):
+        valid = False
+    if not valid:
+        api.abort(400, 'Invalid cursor')
+    return keys, direction
+
+
+def keyset_predicate(order_by, keys, forward):
+    """Build a WHERE clause matching rows strictly after (or before) ``keys`` in ``order_by`` order.
+
+    The leading bound on the first sort key is implied by the rest, but it is what
+    lets SQLite seek into the index rather than scanning up to the cursor.
+    """
+    ops = [">" if (direction == "ASC") == forward else "<" for _, direction in order_by]
+    clauses, params = [], [keys[0]]
+    for i, (expr, _) in enumerate(order_by):
+        terms = [f"{prefix} = ?" for prefix, _ in order_by[:i]] + [f"{expr} {ops[i]} ?"]
+        clauses.append("(" + " AND ".join(terms) + ")")
+        params.extend(keys[:i + 1])
+    return f"{order_by[0][0]} {ops[0]}= ? AND (" + " OR ".join(clauses) + ")", params
+
+
+def list_link(**params):
+    return events_path() + "?" + urlencode({key: value for key, value in params.items() if value is not None})
+
+
+def parse_list_params(order, filter, searching=False):
+    """Parse the ``order``/``filter`` query strings shared by the list and export endpoints.
+
+    Returns the ORDER BY terms as ``(expression, direction)`` with id appended as a
+    tie-breaker, and the validated filter columns. ``rank`` (search relevance) is
+    only accepted as an order when ``searching``.
+    """
+    # 处理排序参数
+    order_columns = order.split(',')
+    order_by = []
+    for col in order_columns:
+        if col.startswith('+'):
+            order_by.append((col[1:], "ASC"))
+        elif col.startswith('-'):
+            order_by.append((col[1:], "DESC"))
+
+    # 处理过滤参数
+    filter_columns = filter.split(',')
+
+    unknown = [col for col, _ in order_by if col not in list_columns and not (searching and col == "rank")]
+    unknown += [col for col in filter_columns if col not in list_columns]
+    if unknown:
+        api.abort(400, f"Unknown columns: {', '.join(unknown)}")
+
+    # id breaks ties so every row has a unique position for both paging modes
+    if "id" not in [col for col, _ in order_by]:
+        order_by.append(("id", "ASC"))
+    order_by = [(sort_expressions.get(col, col), direction) for col, direction in order_by]
+    return order_by, filter_columns
+
+
+def select_expressions(filter_columns):
+    return [col if col != "datetime" else "date || ' ' || from_time AS datetime" for col in filter_columns]
+
+
+class EventColumns:
+    """Columnar snapshot of the events table for vectorised analytics.
+
+    Rows live in growable NumPy arrays: epoch start/end, categorical suburb and
+    state codes, and numeric post codes (-1 when not a number). Each query first
+    patches in the rows the change log has seen since the snapshot was taken;
+    deletes clear a validity flag and the arrays are compacted when dead rows
+    make up half of them.
+    """
+
+    columns = ('id', 'start', 'end', 'suburb', 'state', 'post_code')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.sync_lock = threading.Lock()
+        self.synced_seq = 0
+        self.loaded = False
+
+    def load(self, rows):
+        import numpy as np
+
+        with self._lock:
+            self._size = 0
+            self._dead = 0
+            self._positions = {}
+            self._categories = {'suburb': {}, 'state': {}}
+            self._arrays = {
+                'id': np.zeros(0, np.int64), 'start': np.zeros(0, np.int64), 'end': np.zeros(0, np.int64),
+                'suburb': np.zeros(0, np.int32), 'state': np.zeros(0, np.int32),
+                'post_code': np.zeros(0, np.int32), 'valid': np.zeros(0, bool),
+            }
+            self._upsert(rows)
+            self.loaded = True
+
+    def upsert(self, rows):
+        """Insert or update ``(id, start_epoch, end_epoch, suburb, state, post_code)`` rows."""
+        with self._lock:
+            self._upsert(rows)
+
+    def discard(self, event_id):
+        with self._lock:
+            if not self.loaded:
+                return
+            position = self._positions.pop(event_id, None)
+            if position is None:
+                return
+            self._arrays['valid'][position] = False
+            self._dead += 1
+            if self._dead * 2 > self._size:
+                self._compact()
+
+    def view(self):
+        """Return compact copies of the live rows plus the suburb and state names by code."""
+        with self._lock:
+            valid = self._arrays['valid'][:self._size]
+            view = {name: self._arrays[name][:self._size][valid] for name in self.columns}
+            names = {kind: list(codes) for kind, codes in self._categories.items()}
+        return view, names
+
+    def spans(self, event_ids):
+        """Return ``(start, end)`` arrays for ``event_ids``, raising KeyError with the unknown ids."""
+        with self._lock:
+            positions = [self._positions.get(event_id) for event_id in event_ids]
+            missing = [event_id for event_id, position in zip(event_ids, positions) if position is None]
+            if missing:
+                raise KeyError(missing)
+            return self._arrays['start'][positions], self._arrays['end'][positions]
+
+    def _upsert(self, rows):
+        rows = list(rows)
+        self._reserve(self._size + len(rows))
+        arrays = self._arrays
+        for event_id, start, end, suburb, state, post_code in rows:
+            position = self._positions.get(event_id)
+            if position is None:
+                position = self._positions[event_id] = self._size
+                self._size += 1
+            arrays['id'][position] = event_id
+            arrays['start'][position] = start
+            arrays['end'][position] = end
+            arrays['suburb'][position] = self._categories['suburb'].setdefault(suburb, len(self._categories['suburb']))
+            arrays['state'][position] = self._categories['state'].setdefault(state, len(self._categories['state']))
+            arrays['post_code'][position] = int(post_code) if str(post_code).isdigit() else -1
+            arrays['valid'][position] = True
+
+    def _reserve(self, capacity):
+        import numpy as np
+
+        if capacity <= len(self._arrays['id']):
+            return
+        capacity = max(capacity, 2 * len(self._arrays['id']), 1024)
+        for name, column in self._arrays.items():
+            grown = np.zeros(capacity, column.dtype)
+            grown[:self._size] = column[:self._size]
+            self._arrays[name] = grown
+
+    def _compact(self):
+        valid = self._arrays['valid'][:self._size].copy()
+        for column in self._arrays.values():
+            live = column[:self._size][valid]
+            column[:len(live)] = live
+        self._size = int(valid.sum())
+        self._dead = 0
+        self._positions = {int(event_id): i for i, event_id in enumerate(self._arrays['id'][:self._size])}
+
+
+event_columns = LocalProxy(lambda: current_shard().event_columns)
+
+
+def day_epoch(day):
+    """Epoch seconds at the start of a ``YYYY-mm-dd`` day (UTC, like the stored spans)."""
+    return int(datetime.strptime(day, '%Y-%m-%d').replace(tzinfo=timezone.utc).timestamp())
+
+
+event_columns_query = 'SELECT id, start_epoch, end_epoch, suburb, state, post_code FROM events'
+
+# Past this many changed events a snapshot is reloaded rather than patched
+SNAPSHOT_MAX_DELTA = 10000
+
+
+def refresh_snapshot(c, snapshot, query):
+    """Bring an in-process snapshot of the events table up to date with the change log.
+
+    Any process may write the database, so the snapshot remembers the last
+    ``event_changes`` sequence it has seen and re-reads only the events changed
+    since. The sequence is read before the rows, so a commit landing in between
+    is applied again on the next call rather than missed.
+    """
+    with snapshot.sync_lock:
+        if snapshot.loaded:
+            c.execute('SELECT seq, event_id FROM event_changes WHERE seq > ? ORDER BY seq LIMIT ?',
+                      (snapshot.synced_seq, SNAPSHOT_MAX_DELTA + 1))
+            changes = c.fetchall()
+            if not changes:
+                return
+            if len(changes) <= SNAPSHOT_MAX_DELTA:
+                event_ids = {event_id for _, event_id in changes}
+                c.execute(f'{query} WHERE id IN (SELECT value FROM json_each(?))', (json.dumps(sorted(event_ids)),))
+                rows = c.fetchall()
+                snapshot.upsert(rows)
+                for event_id in event_ids.difference(row[0] for row in rows):
+                    snapshot.discard(event_id)
+                snapshot.synced_seq = changes[-1][0]
+                return
+        c.execute('SELECT COALESCE(MAX(seq), 0) FROM event_changes')
+        synced_seq = c.fetchone()[0]
+        c.execute(query)
+        snapshot.load(c.fetchall())
+        snapshot.synced_seq = synced_seq
+
+
+def get_event_columns(c):
+    refresh_snapshot(c, event_columns, event_columns_query)
+    return event_columns.view()
+
+
+def busy_hours(start, end):
+    """Per hour of day: how many events start in it, and how many event-minutes fall in it."""
+    import numpy as np
+
+    day_start = start - start % 86400
+    start_minute = (start - day_start) // 60
+    end_minute = np.clip((end - day_start) // 60, start_minute, 1440)
+    # Difference array over the minutes of a day: +1 where an event starts, -1 where it ends
+    change = np.bincount(start_minute, minlength=1441) - np.bincount(end_minute, minlength=1441)
+    busy = np.cumsum(change)[:1440].reshape(24, 60).sum(axis=1)
+    starts = np.bincount(start_minute // 60, minlength=24)[:24]
+    return {'starts': starts.tolist(), 'busy_minutes': busy.tolist()}
+
+
+def category_counts(codes, names):
+    import numpy as np
+
+    counts = np.bincount(codes, minlength=len(names))
+    return {names[code]: int(counts[code]) for code in np.flatnonzero(counts)}
+
+
+def daily_utilization(start, end):
+    """Fraction of each day covered by events (overlapping events count twice)."""
+    import numpy as np
+
+    days, inverse = np.unique(start // 86400, return_inverse=True)
+    busy = np.bincount(inverse, weights=end - start) / 86400
+    labels = np.datetime_as_string(days.astype('datetime64[D]'))
+    return dict(zip(labels.tolist(), np.round(busy, 4).tolist()))
+
+
+def overlap_matrix(start, end):
+    """Pairwise overlap flags for the given spans, with the diagonal cleared."""
+    import numpy as np
+
+    matrix = (start[:, None] < end[None, :]) & (start[None, :] < end[:, None])
+    np.fill_diagonal(matrix, False)
+    return matrix.astype(int).tolist()
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371.0 * math.asin(math.sqrt(a))
+
+
+class EventLocations:
+    """Spatial index of geocoded events for ``near`` and ``bbox`` list queries.
+
+    Events are grouped by their geocoded point and an STRtree is built over the
+    distinct points only, so it stays as small as the geocoding data. Events
+    changed since the last query are moved between points in place; the tree is
+    rebuilt on the next query after a new point appears. Events whose location
+    cannot be geocoded are left out.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.sync_lock = threading.Lock()
+        self.synced_seq = 0
+        self.loaded = False
+
+    def load(self, rows):
+        with self._lock:
+            self._points = {}
+            self._where = {}
+            self._tree = None
+            self._upsert(rows)
+            self.loaded = True
+
+    def upsert(self, rows):
+        """Insert or move ``(id, suburb, state, post_code)`` rows."""
+        with self._lock:
+            self._upsert(rows)
+
+    def discard(self, event_id):
+        with self._lock:
+            if self.loaded:
+                self._remove(event_id)
+
+    def within_bbox(self, min_lon, min_lat, max_lon, max_lat):
+        with self._lock:
+            points = self._query(min_lon, min_lat, max_lon, max_lat)
+            return sorted(event_id for point in points for event_id in self._points[point])
+
+    def within_radius(self, lat, lon, km):
+        # Search the enclosing box, then keep the points within the great-circle distance
+        dlat = km / 111.32
+        dlon = km / max(111.32 * math.cos(math.radians(lat)), 1e-6)
+        with self._lock:
+            points = self._query(lon - dlon, lat - dlat, lon + dlon, lat + dlat)
+            return sorted(event_id for point in points if haversine_km(lat, lon, *point) <= km
+                          for event_id in self._points[point])
+
+    def _query(self, min_lon, min_lat, max_lon, max_lat):
+        from shapely import STRtree
+        from shapely.geometry import Point, box
+
+        if self._tree is None:
+            self._tree_points = list(self._points)
+            self._tree = STRtree([Point(lon, lat) for lat, lon in self._tree_points])
+        hits = self._tree.query(box(min_lon, min_lat, max_lon, max_lat))
+        # Points emptied since the build are still in the tree
+        return [self._tree_points[i] for i in hits if self._tree_points[i] in self._points]
+
+    def _upsert(self, rows):
+        geocoder = get_geocoder()
+        for event_id, suburb, state, post_code in rows:
+            self._remove(event_id)
+            point = geocoder.locate(suburb, state, post_code)
+            if point is None:
+                continue
+            if point not in self._points:
+                self._points[point] = set()
+                self._tree = None
+            self._points[point].add(event_id)
+            self._where[event_id] = point
+
+    def _remove(self, event_id):
+        point = self._where.pop(event_id, None)
+        if point is None:
+            return
+        ids = self._points[point]
+        ids.discard(event_id)
+        if not ids:
+            del self._points[point]
+
+
+event_locations = LocalProxy(lambda: current_shard().event_locations)
+
+event_locations_query = 'SELECT id, suburb, state, post_code FROM events'
+
+
+def get_event_locations(c):
+    refresh_snapshot(c, event_locations, event_locations_query)
+    return event_locations
+
+
+def parse_numbers(value, name, count):
+    try:
+        numbers = [float(part) for part in value.split(',')]
+    except ValueError:
+        numbers = []
+    if len(numbers) != count or not all(map(math.isfinite, numbers)):
+        api.abort(400, f'{name} must be {count} comma-separated numbers')
+    return numbers
+
+
+def locate_events(c, near, radius, bbox):
+    """Return the sorted ids of events within ``radius`` km of ``near`` and inside ``bbox``.
+
+    Either filter may be omitted; returns None when both are.
+    """
+    if not near and not bbox:
+        return None
+    locations = get_event_locations(c)
+    ids = None
+    if near:
+        lat, lon = parse_numbers(near, 'near', 2)
+        if not -90 <= lat <= 90 or not -180 <= lon <= 180:
+            api.abort(400, 'near must be lat,lon')
+        if radius is None or radius <= 0:
+            api.abort(400, 'radius must be a positive number of km')
+        ids = locations.within_radius(lat, lon, radius)
+    if bbox:
+        min_lon, min_lat, max_lon, max_lat = parse_numbers(bbox, 'bbox', 4)
+        if min_lon > max_lon or min_lat > max_lat:
+            api.abort(400, 'bbox must be min_lon,min_lat,max_lon,max_lat')
+        boxed = locations.within_bbox(min_lon, min_lat, max_lon, max_lat)
+        ids = boxed if ids is None else sorted(set(ids).intersection(boxed))
+    return ids
+
 
 def delete_event_by_id(event_id):
-    conn = sqlite3.connect('events.db')
+    conn = get_db()
     c = conn.cursor()
     c.execute('DELETE FROM events WHERE id=?', (event_id,))
     deleted_rows = c.rowcount
     conn.commit()
-    conn.close()
+    change_feed.publish()
+    interval_index.discard(event_id)
+    event_count.invalidate()
+    event_cache.invalidate(event_id)
     return deleted_rows
 
 
-def get_event_by_id(event_id):
-    conn = sqlite3.connect('events.db')
-    c = conn.cursor()
+json_ascii = json.encoder.encode_basestring_ascii
+
+
+def json_string(value):
+    """A string field as JSON text: null, or the value as a string literal, as ``fields.String`` marshals it."""
+    if value is None:
+        return 'null'
+    return json_ascii(value if isinstance(value, str) else str(value))
+
+
+def json_scalar(value):
+    """A column value of any SQLite type as JSON text."""
+    if value is None:
+        return 'null'
+    if isinstance(value, str):
+        return json_ascii(value)
+    return json.dumps(value)
+
+
+def link_template(endpoint, key, **values):
+    """``url_for(endpoint, key=...)`` as a %-template for the id, so a page builds its links without url_for per row."""
+    marker = 9007199254740993
+    return url_for(endpoint, **{key: marker}, **values, _external=True).replace('%', '%%').replace(str(marker), '%d')
+
+
+event_fields = ('id', 'name', 'date', 'from_time', 'to_time', 'street', 'suburb', 'state', 'post_code', 'description',
+                'last_update', 'start_epoch', 'end_epoch')
+
+
+def event_href():
+    """The self link template of the Event representation, in the current calendar."""
+    return 'http://localhost:5000' + events_path().replace('%', '%%') + '/%d'
+
+
+class EventRecord(namedtuple('EventRecord', event_fields)):
+    """A ``SELECT * FROM events`` row. It is still the tuple (so ``row[2]`` works) and has no per-instance dict."""
+
+    __slots__ = ()
+
+    def json(self, metadata=None, href=None):
+        """The Event representation as JSON text, written straight from the row; ``href`` is ``event_href()``."""
+        return (f'{{"id": {self.id}, "name": {json_string(self.name)}, "date": {json_string(self.date)}, '
+                f'"from": {json_string(self.from_time)}, "to": {json_string(self.to_time)}, '
+                f'"location": {{"street": {json_string(self.street)}, "suburb": {json_string(self.suburb)}, '
+                f'"state": {json_string(self.state)}, "post-code": {json_string(self.post_code)}}}, '
+                f'"description": {json_string(self.description)}, '
+                f'"_links": {{"self": {{"href": {json_string((href or event_href()) % self.id)}}}}}, '
+                f'"_metadata": {json.dumps(metadata)}, "last-update": {json_string(self.last_update)}}}')
+
+
+def event_record(cursor, row):
+    """Row factory for ``SELECT * FROM events`` cursors."""
+    return EventRecord._make(row)
+
+
+def summary_encoder(filter_columns, href):
+    """Return a function writing a list row, the ``filter_columns`` in order, as EventSummary JSON.
+
+    The output is what marshalling ``event_list_response`` gave: every summary
+    field is present, null unless selected, and a date and from_time selection
+    join into datetime. ``href`` is the JSON self-link template.
+    """
+    position = {field: i for i, field in enumerate(filter_columns)}
+    # A selected datetime is replaced, and date/from_time selections are joined on, in filter order
+    base = max((i for i, field in enumerate(filter_columns) if field == 'datetime'), default=None)
+    parts = [i for i, field in enumerate(filter_columns)
+             if field in ('date', 'from_time') and (base is None or i > base)]
+    id_at, name_at, update_at = position.get('id'), position.get('name'), position.get('last_update')
+
+    def encode(row):
+        if base is not None:
+            stamp = ' '.join([row[base], *(row[i] for i in parts)])
+        else:
+            stamp = ' '.join([row[i] for i in parts]) if parts else None
+        return (f'{{"id": {"null" if id_at is None else int(row[id_at])}, '
+                f'"name": {"null" if name_at is None else json_string(row[name_at])}, '
+                f'"datetime": {json_string(stamp)}, '
+                f'"last_update": {"null" if update_at is None else json_string(row[update_at])}, '
+                f'"_links": {{"self": {"null" if id_at is None else href % row[id_at]}}}}}')
+
+    return encode
+
+
+def columns_encoder(columns):
+    """Return a function writing a row of ``columns`` as a JSON object keyed by column name."""
+    keys = [json_ascii(column) + ': ' for column in columns]
+
+    def encode(row):
+        return '{' + ', '.join([key + json_scalar(value) for key, value in zip(keys, row)]) + '}'
+
+    return encode
+
+
+class EventCache:
+    """LRU/TTL cache of ``EventRecord``s keyed by id.
+
+    Writers call ``invalidate`` after committing. A read that started before an
+    invalidation is not stored, so a slow reader can't put back a stale row.
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def generation(self):
+        return self._generation
+
+    def get(self, event_id):
+        with self._lock:
+            entry = self._entries.get(event_id)
+            if entry is None or entry[1] <= time.monotonic():
+                self.misses += 1
+                return None
+            self._entries.move_to_end(event_id)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, event_id, record, generation):
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._entries[event_id] = (record, time.monotonic() + self.ttl)
+            self._entries.move_to_end(event_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, event_id):
+        with self._lock:
+            self._entries.pop(event_id, None)
+            self._generation += 1
+
+
+event_cache = LocalProxy(lambda: current_shard().event_cache)
+
+
+class Shard:
+    """One calendar's SQLite file, with the connection pool and in-process state kept for it.
+
+    ``interval_index``, ``event_cache`` and the other module-level state are
+    proxies to the shard of the current request, so every endpoint (and its
+    overlap checks and statistics) works within one file. Outside a calendar
+    route that is ``default_shard``, whose file is ``DATABASE``.
+    """
+
+    def __init__(self, database=None):
+        self._database = database
+        self._pool = None
+        self._lock = threading.Lock()
+        self.interval_index = IntervalIndex()
+        self.recurrence_index = RecurrenceIndex()
+        self.event_count = EventCount()
+        self.event_columns = EventColumns()
+        self.event_locations = EventLocations()
+        self.event_cache = EventCache(app.config['EVENT_CACHE_SIZE'], app.config['EVENT_CACHE_TTL'])
+        self.change_feed = ChangeFeed()
+
+    @property
+    def database(self):
+        return self._database or app.config['DATABASE']
+
+    def pool(self):
+        with self._lock:
+            if self._pool is None or self._pool.database != self.database:
+                if self._pool is not None:
+                    self._pool.close()
+                pool = ConnectionPool(self.database, app.config['DB_POOL_SIZE'])
+                # The schema is created or migrated when the file is first opened, not at import
+                with pool.connection() as conn:
+                    init_schema(conn)
+                self._pool = pool
+            return self._pool
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool = None
+
+
+default_shard = Shard()
+
+calendar_id = re.compile(r'[A-Za-z0-9_-]{1,64}')
+shards = OrderedDict()
+_shards_lock = threading.Lock()
+
+
+def current_shard():
+    return g.get('shard', default_shard) if has_app_context() else default_shard
+
+
+def calendar_path(cid):
+    return os.path.join(app.config['CALENDAR_DIR'], f'{cid}.db')
+
+
+def calendar_ids():
+    """Every calendar with a shard file, sorted."""
+    try:
+        names = os.listdir(app.config['CALENDAR_DIR'])
+    except FileNotFoundError:
+        return []
+    return sorted(name[:-3] for name in names if name.endswith('.db') and calendar_id.fullmatch(name[:-3]))
+
+
+def get_shard(cid, create=False):
+    """Return the shard of calendar ``cid``, or None if it has no file and ``create`` is false.
+
+    The registry keeps the ``SHARD_CACHE_SIZE`` most recently used shards and
+    closes the pools of those it drops. Its lock only covers the lookup and
+    insert; opening the file and creating its schema happen under the shard's own lock.
+    """
+    with _shards_lock:
+        shard = shards.get(cid)
+        if shard is not None:
+            shards.move_to_end(cid)
+    if shard is None:
+        path = calendar_path(cid)
+        if not os.path.exists(path):
+            if not create:
+                return None
+            os.makedirs(app.config['CALENDAR_DIR'], exist_ok=True)
+        evicted = []
+        with _shards_lock:
+            shard = shards.setdefault(cid, Shard(path))
+            shards.move_to_end(cid)
+            while len(shards) > app.config['SHARD_CACHE_SIZE']:
+                evicted.append(shards.popitem(last=False)[1])
+        for old in evicted:
+            old.close()
+    try:
+        shard.pool()
+    except Exception:
+        # Don't leave a shard whose file may never have been created behind for the next lookup
+        with _shards_lock:
+            if shards.get(cid) is shard:
+                del shards[cid]
+        raise
+    return shard
+
+
+def use_calendar(cid, create=False):
+    """Address the rest of the app context to calendar ``cid``; returns its shard, or None if there is none."""
+    shard = get_shard(cid, create) if calendar_id.fullmatch(cid) else None
+    if shard is not None:
+        g.shard, g.calendar = shard, cid
+    return shard
+
+
+@app.url_value_preprocessor
+def select_calendar(endpoint, values):
+    if values and 'cid' in values:
+        cid = values.pop('cid')
+        # Posting to a calendar creates it; anything else on one that doesn't exist is a 404
+        if use_calendar(cid, create=request.method == 'POST') is None:
+            api.abort(404, f"Calendar {cid} doesn't exist")
+
+
+@app.url_defaults
+def add_calendar(endpoint, values):
+    if endpoint.startswith('calendar_') and 'cid' not in values and g.get('calendar'):
+        values['cid'] = g.calendar
+
+
+def resource_endpoint(resource):
+    """The endpoint of an events resource, e.g. ``'event'``, in the calendar the request is addressed to."""
+    return f'calendar_{resource}' if g.get('calendar') else f'api/events_{resource}'
+
+
+def events_path():
+    calendar = g.get('calendar') if has_app_context() else None
+    return f'/api/calendars/{calendar}/events' if calendar else '/api/events'
+
+
+def get_cached_event(event_id):
+    """Return the ``EventRecord`` of an event, reading through the cache, or None if it doesn't exist."""
+    record = event_cache.get(event_id)
+    if record is not None:
+        return record
+    generation = event_cache.generation
+    c = get_db().cursor()
+    c.row_factory = event_record
     c.execute('SELECT * FROM events WHERE id=?', (event_id,))
-    result = c.fetchone()
-    conn.close()
-    return result
+    record = c.fetchone()
+    if record is None:
+        return None
+    event_cache.put(event_id, record, generation)
+    return record
+
+
+def get_event_by_id(event_id):
+    return get_cached_event(event_id)
+
+
+class BackgroundCache:
+    """TTL/LRU cache whose misses and refreshes are loaded on a background pool.
+
+    Concurrent misses for a key share one in-flight load. Readers get the last
+    good value (or ``None`` while nothing has loaded yet) instead of waiting on
+    the loader, unless they ask to ``wait``.
+    """
+
+    def __init__(self, loader, ttl, max_entries, executor, error_ttl=60):
+        self._loader = loader
+        self.ttl = ttl
+        self.error_ttl = error_ttl
+        self.max_entries = max_entries
+        self._executor = executor
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._pending = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, wait=0):
+        value, future = self.lookup(key)
+        if future is not None and wait:
+            try:
+                return future.result(timeout=wait)
+            except Exception:
+                return None
+        return value
+
+    def lookup(self, key, start=None):
+        """Return ``(value, None)`` when anything is cached for ``key``, else ``(None, future)``.
+
+        A stale or missing entry is (re)loaded once through ``start(key)``, which
+        must return a ``concurrent.futures.Future`` and end in ``store``; by
+        default the loader runs on the executor.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                if entry[1] > time.monotonic():
+                    return entry[0], None
+            else:
+                self.misses += 1
+            future = self._pending.get(key)
+            if future is None:
+                future = self._pending[key] = (start or self._submit)(key)
+
+        if entry is not None:
+            # Serve the stale value while the refresh runs
+            return entry[0], None
+        return None, future
+
+    def drain(self, timeout=None):
+        """Wait for the loads in flight, e.g. before their upstream goes away."""
+        with self._lock:
+            pending = list(self._pending.values())
+        for future in pending:
+            future.result(timeout)
+
+    def _submit(self, key):
+        return self._executor.submit(self._load, key)
+
+    def _load(self, key):
+        try:
+            value = self._loader(key)
+        except Exception as e:
+            logger.warning("Failed to load %r: %s", key, e)
+            return self.store(key, None, failed=True)
+        return self.store(key, value)
+
+    def store(self, key, value, failed=False):
+        """Finish a load of ``key``; a failed one keeps the last good value and is retried sooner."""
+        with self._lock:
+            self._pending.pop(key, None)
+            if value is None and key in self._entries:
+                value = self._entries[key][0]
+            self._entries[key] = (value, time.monotonic() + (self.error_ttl if failed else self.ttl))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+
+@upstream_latency.timed('nager')
+def fetch_holidays(year):
+    """Return ``{'YYYY-mm-dd': name}`` for the public holidays in ``year``."""
+    response = upstream.get(app.config['HOLIDAY_API_URL'].format(year=year), timeout=app.config['UPSTREAM_TIMEOUT'])
+    response.raise_for_status()
+    return parse_holidays(response.json())
+
+
+def parse_holidays(payload):
+    holidays = {}
+    for holiday_item in payload:
+        holidays.setdefault(holiday_item['date'], holiday_item['name'])
+    return holidays
+
+
+@upstream_latency.timed('7timer')
+def fetch_forecast(cell):
+    """Return ``{'YYYY-mm-dd': weather}`` for the daily forecast of a grid cell."""
+    lat, lon = cell
+    response = upstream.get(app.config['WEATHER_API_URL'].format(lat=lat, lon=lon),
+                            timeout=app.config['UPSTREAM_TIMEOUT'])
+    response.raise_for_status()
+    return parse_forecast(response.json())
+
+
+def parse_forecast(payload):
+    forecast = {}
+    for day in payload.get('dataseries', []):
+        day_date = datetime.strptime(str(day['date']), '%Y%m%d').strftime('%Y-%m-%d')
+        forecast[day_date] = {
+            'temperature': f"{day['temp2m']['max']} C",
+            'wind_speed': f"{day['wind10m_max']} KM",
+            'weather': day['weather']
+        }
+        if 'rh2m' in day:
+            forecast[day_date]['humidity'] = f"{day['rh2m']}%"
+    return forecast
+
+
+def weather_cell(lat, lon):
+    size = app.config['WEATHER_GRID']
+    return round(round(lat / size) * size, 4), round(round(lon / size) * size, 4)
+
+
+metadata_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='metadata')
+holiday_cache = BackgroundCache(fetch_holidays, app.config['HOLIDAY_TTL'], 16, metadata_executor)
+weather_cache = BackgroundCache(fetch_forecast, app.config['WEATHER_TTL'], app.config['WEATHER_CACHE_SIZE'],
+                                metadata_executor)
+
+
+def metadata_keys(event_date, location):
+    """The ``holiday_cache`` and ``weather_cache`` keys behind an event's metadata."""
+    return datetime.strptime(event_date, '%d-%m-%Y').year, weather_cell(location['lat'], location['lon'])
 
 
 def get_metadata(event_date, location):
-    event_date = datetime.strptime(event_date, '%d-%m-%Y').strftime('%Y-%m-%d')
-    holiday_api_url = "https://date.nager.at/api/v2/publicholidays/2023/AU"
-    holiday_response = requests.get(holiday_api_url)
-    holiday_data = holiday_response.json()
-    holiday = None
-    for holiday_item in holiday_data:
-        if holiday_item['date'] == event_date:
-            holiday = holiday_item['name']
-            break
+    year, cell = metadata_keys(event_date, location)
+    event_datetime = datetime.strptime(event_date, '%d-%m-%Y')
+    event_date = event_datetime.strftime('%Y-%m-%d')
+
+    # Start both lookups before waiting on either, so misses load concurrently under one deadline
+    lookups = {'holiday': holiday_cache.lookup(year), 'weather': weather_cache.lookup(cell)}
+    deadline = time.monotonic() + app.config['METADATA_WAIT']
+    values = {}
+    for name, (value, future) in lookups.items():
+        if future is not None and app.config['METADATA_WAIT']:
+            try:
+                value = future.result(timeout=max(deadline - time.monotonic(), 0))
+            except Exception:
+                value = None
+        values[name] = value
+
+    holiday = values['holiday'].get(event_date) if values['holiday'] else None
+    weather = values['weather'].get(event_date) if values['weather'] else None
 
-    lat, lon = location['lat'], location['lon']
-    weather_api_url = f"http://www.7timer.info/bin/civil.php?lon={lon}&lat={lat}&ac=0&unit=metric&output=json&tzshift=0"
-    weather_response = requests.get(weather_api_url)
-    weather_data = weather_response.json()
-    weather = None
-    if 'dataseries' in weather_data:
-        for day in weather_data['dataseries']:
-            day_date = datetime.fromtimestamp(day['timepoint']).strftime('%Y-%m-%d')
-            if day_date == event_date:
-                weather = {
-                    'temperature': f"{day['temp2m']['max']} C",
-                    'humidity': f"{day['rh2m']}%",
-                    'wind_speed': f"{day['wind10m_max']} KM",
-                    'weather': day['weather']
-                }
-                break
-    event_datetime = datetime.strptime(event_date, "%Y-%m-%d")
     weekend = event_datetime.weekday() >= 5
 
     metadata = {
@@ -277,14 +2246,10 @@ def get_metadata(event_date, location):
 
 
 def is_time_overlap(date1: str, start1: str, end1: str, date2: str, start2: str, end2: str) -> bool:
-    datetime_format = '%d-%m-%Y %H:%M'
+    start1, end1 = event_span(date1, start1, end1)
+    start2, end2 = event_span(date2, start2, end2)
 
-    datetime_start1 = datetime.strptime(f'{date1} {start1}', datetime_format)
-    datetime_end1 = datetime.strptime(f'{date1} {end1}', datetime_format)
-    datetime_start2 = datetime.strptime(f'{date2} {start2}', datetime_format)
-    datetime_end2 = datetime.strptime(f'{date2} {end2}', datetime_format)
-
-    return datetime_start1 < datetime_end2 and datetime_start2 < datetime_end1
+    return start1 < end2 and start2 < end1
 
 
 @ns.route('/')
@@ -293,120 +2258,188 @@ class EventList(Resource):
     @api.param('page_size', 'The number of events per page', type=int)
     @api.param('order', '排序条件，用逗号分隔的字符串，例如：+name,-datetime', type=str)
     @api.param('filter', '过滤条件，用逗号分隔的字符串，例如：id,name,datetime', type=str)
-    @ns.marshal_with(event_list_response)
+    @api.param('paging', 'offset (page numbers) or cursor (keyset paging via the cursor parameter)', type=str)
+    @api.param('cursor', 'Opaque cursor taken from a next/prev link', type=str)
+    @api.param('count', 'Whether to include total_events, defaults to true', type=bool)
+    @api.param('near', 'Only events within radius of this point (lat,lon)', type=str)
+    @api.param('radius', 'Search radius around near, in km (default 10)', type=float)
+    @api.param('bbox', 'Only events inside this box (min_lon,min_lat,max_lon,max_lat)', type=str)
+    @api.param('q', 'Full-text search over name, description, street and suburb: words, prefix*, "a phrase". '
+                    'Ordered by +rank unless order is given', type=str)
+    @ns.response(200, 'Success', event_list_page)
     def get(self):
         page = request.args.get('page', default=1, type=int)
         page_size = request.args.get('page_size', default=10, type=int)
-        order = request.args.get('order', default="+id", type=str)
+        q = request.args.get('q', type=str)
+        order = request.args.get('order', default="+rank" if q else "+id", type=str)
         filter = request.args.get('filter', default="id,name", type=str)
-
-        # 处理排序参数
-        order_columns = order.split(',')
-        order_by = []
-        for col in order_columns:
-            if col.startswith('+'):
-                order_by.append((col[1:], "ASC"))
-            elif col.startswith('-'):
-                order_by.append((col[1:], "DESC"))
-
-        # 处理过滤参数
-        filter_columns = filter.split(',')
+        cursor = request.args.get('cursor', type=str)
+        paging = request.args.get('paging', default="cursor" if cursor else "offset", type=str)
+        with_count = request.args.get('count', default=True, type=inputs.boolean)
+        near = request.args.get('near', type=str)
+        radius = request.args.get('radius', default=10.0, type=float)
+        bbox = request.args.get('bbox', type=str)
+        if paging not in ("offset", "cursor"):
+            api.abort(400, "paging must be offset or cursor")
+        if page < 1 or page_size < 1:
+            api.abort(400, "page and page_size must be positive")
+
+        order_by, filter_columns = parse_list_params(order, filter, searching=bool(q))
 
         # 根据排序和过滤条件查询活动列表
-        conn = sqlite3.connect('events.db')
-        c = conn.cursor()
-
-        # 获取活动总数
-        c.execute("SELECT COUNT(*) FROM events")
-        total_count = c.fetchone()[0]
-
-        # 构建查询语句
-        select_columns = [col if col != "datetime" else "date || ' ' || from_time AS datetime" for col in
-                          filter_columns]
-        query = "SELECT " + ", ".join(select_columns) + " FROM events"
-
-        order_columns = [("date || ' ' || from_time" if col == "datetime" else col, direction) for col, direction in
-                         order_by]
-        if order_columns:
-            query += " ORDER BY " + ", ".join([f"{col} {direction}" for col, direction in order_columns])
-
-        c.execute(query)
-        result = c.fetchall()
-
-        # 分页
-        start = (page - 1) * page_size
-        end = page * page_size
-        result = result[start:end]
-
-        conn.close()
-
-        # 将查询结果转换为字典
-        print("Result:", result)  # 打印查询结果
-        result_dicts = []
-        for row in result:
-            event_dict = {}
-            for field, value in zip(filter_columns, row):
-                if field == 'date' or field == 'from_time':
-                    if 'datetime' not in event_dict:
-                        event_dict['datetime'] = value
-                    else:
-                        event_dict['datetime'] += " " + value
-                else:
-                    event_dict[field] = value
-
-            event_dict["_links"] = {
-                "self": {"href": url_for('api/events_event', event_id=event_dict['id'], _external=True)}}
-            print("Event Dict:", event_dict)  # 打印构建的事件字典
-            result_dicts.append(event_dict)
-
-        # 构建_links
-        self_link = f"/api/events?order={order}&page={page}&size={page_size}&filter={filter}"
-        prev_link = f"/api/events?order={order}&page={page - 1}&size={page_size}&filter={filter}" if page > 1 else None
-        next_link = f"/api/events?order={order}&page={page + 1}&size={page_size}&filter={filter}" if (page * page_size) < total_count else None
+        c = get_db().cursor()
+
+        # 全文检索：按相关度排序时与评分后的匹配结果连接，否则只作为过滤条件
+        source, conditions, params = "events", [], []
+        ranked = q and any(expr == sort_expressions["rank"] for expr, _ in order_by)
+        window = app.config['SEARCH_RANK_WINDOW'] if ranked else None
+        if q:
+            match = search_query(q)
+            if ranked:
+                source = search_ranked_source
+                params += [match, window or -1]
+            else:
+                conditions.append(search_condition)
+                params.append(match)
 
-        links = {
-            "self": {"href": self_link},
-            "prev": {"href": prev_link} if prev_link else None,
-            "next": {"href": next_link} if next_link else None,
-        }
+        # 按位置过滤：空间索引给出候选活动
+        location_ids = locate_events(c, near, radius, bbox)
+        if location_ids is not None:
+            conditions.append("id IN (SELECT value FROM json_each(?))")
+            params.append(json.dumps(location_ids))
 
-        metadata = {"total_events": total_count, "_links": links, "page": page, "page_size": page_size}
+        # 获取活动总数
+        if not with_count:
+            total_count = None
+        elif q and location_ids is None:
+            c.execute("SELECT COUNT(*) FROM events_fts WHERE events_fts MATCH ?", (match,))
+            total_count = c.fetchone()[0]
+        elif q:
+            # Counted over every match, even where the ranked source stops at the window
+            c.execute("SELECT COUNT(*) FROM events WHERE " + search_condition +
+                      " AND id IN (SELECT value FROM json_each(?))", (match, json.dumps(location_ids)))
+            total_count = c.fetchone()[0]
+        elif location_ids is not None:
+            total_count = len(location_ids)
+        else:
+            total_count = event_count.get(c)
+
+        # A rank window leaves out older matches; say so when there are any
+        truncated = None
+        if window:
+            c.execute("SELECT 1 FROM events_fts WHERE events_fts MATCH ? LIMIT 1 OFFSET ?", (match, window))
+            truncated = c.fetchone() is not None
+
+        # 构建查询语句，排序键附加在所选列之后以生成游标
+        select_columns = select_expressions(filter_columns) + [expr for expr, _ in order_by]
+        query = "SELECT " + ", ".join(select_columns) + " FROM " + source
+
+        forward = True
+        if paging == "cursor" and cursor:
+            keys, direction = decode_cursor(cursor, order, len(order_by))
+            forward = direction == "next"
+            predicate, keyset_params = keyset_predicate(order_by, keys, forward)
+            conditions.append(predicate)
+            params.extend(keyset_params)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+
+        scan_order = order_by if forward else [(expr, "DESC" if d == "ASC" else "ASC") for expr, d in order_by]
+        query += " ORDER BY " + ", ".join([f"{col} {direction}" for col, direction in scan_order])
+
+        # 分页：多取一行用于判断是否还有下一页
+        query += " LIMIT ?"
+        params.append(page_size + 1)
+        if paging == "offset":
+            query += " OFFSET ?"
+            params.append((page - 1) * page_size)
+
+        c.execute(query, params)
+        if forward:
+            # Rows stream from the cursor; the one past the page only tells whether there is a next
+            rows = itertools.chain.from_iterable(iter(lambda: c.fetchmany(500), []))
+        else:
+            # Scanned backwards, so the page has to be read whole and reversed
+            rows = c.fetchall()
+            backward_more = len(rows) > page_size
+            rows = iter(rows[:page_size][::-1])
+        encode = summary_encoder(filter_columns, json_string(link_template(resource_endpoint('event'), 'event_id')))
+        common = {"order": order, "page_size": page_size, "filter": filter, "q": q,
+                  "near": near, "radius": radius if near else None, "bbox": bbox}
+
+        def generate():
+            first = last = None
+            count = 0
+            buf = ['{"events": [']
+            for row in itertools.islice(rows, page_size):
+                buf.append((', ' if count else '') + encode(row))
+                first = row if first is None else first
+                last = row
+                count += 1
+                if len(buf) >= 500:
+                    yield ''.join(buf)
+                    buf = []
+            has_more = next(rows, None) is not None if forward else backward_more
+            logger.debug("List query returned %d rows: %s", count, query)
+
+            # 构建_links
+            if paging == "offset":
+                self_link = list_link(page=page, **common)
+                prev_link = list_link(page=page - 1, **common) if page > 1 else None
+                next_link = list_link(page=page + 1, **common) if has_more else None
+            else:
+                def cursor_link(row, direction):
+                    keys = list(row[len(filter_columns):])
+                    return list_link(paging="cursor", cursor=encode_cursor(order, keys, direction), **common)
+
+                self_link = list_link(paging="cursor", cursor=cursor, **common)
+                has_next = has_more if forward else cursor is not None
+                has_prev = cursor is not None if forward else has_more
+                prev_link = cursor_link(first, "prev") if count and has_prev else None
+                next_link = cursor_link(last, "next") if count and has_next else None
+
+            links = {
+                "self": {"href": self_link},
+                "prev": {"href": prev_link} if prev_link else None,
+                "next": {"href": next_link} if next_link else None,
+            }
 
-        # Create response object
-        response_data = {
-            "events": result_dicts,
-            "metadata": metadata,
-        }
+            metadata = {"total_events": total_count, "_links": links, "page_size": page_size}
+            if paging == "offset":
+                metadata["page"] = page
+            if truncated is not None:
+                metadata["truncated"] = truncated
+            buf.append('], "metadata": ' + json.dumps(metadata) + '}\n')
+            yield ''.join(buf)
 
-        return response_data
+        # Rows are written as JSON straight from the cursor; big pages go out as they are read
+        if page_size > app.config['LIST_STREAM_ROWS']:
+            return Response(stream_with_context(generate()), mimetype='application/json')
+        return Response(''.join(generate()), mimetype='application/json')
 
     @ns.expect(event)
     @ns.marshal_with(event_response, code=201)
     def post(self):
-        conn = sqlite3.connect('events.db')
+        conn = get_db()
         c = conn.cursor()
         new_event = request.json
         last_update = datetime.utcnow().isoformat()
-        c.execute('SELECT * FROM events')
-        existing_events = c.fetchall()
-        for existing_event in existing_events:
-            existing_event_dict = {
-                "id": existing_event[0],
-                "date": existing_event[2],
-                "from": existing_event[3],
-                "to": existing_event[4]
-            }
-            if is_time_overlap(new_event["date"], new_event["from"], new_event["to"], existing_event_dict["date"],
-                               existing_event_dict["from"], existing_event_dict["to"]):
-                raise ValueError("The new event overlaps with an existing event.")
+        start_epoch, end_epoch = event_span(new_event["date"], new_event["from"], new_event["to"])
+        # Hold the write lock from the overlap check until commit so concurrent posts can't both pass
+        c.execute('BEGIN IMMEDIATE')
+        if (find_conflicting_event(c, new_event["date"], start_epoch, end_epoch) is not None
+                or get_recurrences(c).find_overlap(start_epoch, end_epoch) is not None):
+            api.abort(409, "The new event overlaps with an existing event.")
         c.execute('''INSERT INTO events (name, date, from_time, to_time, street, suburb, state, post_code, 
-        description, last_update) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', (
+        description, last_update, start_epoch, end_epoch) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', (
             new_event['name'], new_event['date'], new_event['from'], new_event['to'], new_event['location']['street'],
             new_event['location']['suburb'], new_event['location']['state'], new_event['location']['post-code'],
-            new_event['description'], last_update))
+            new_event['description'], last_update, start_epoch, end_epoch))
         event_id = c.lastrowid
-        conn.commit()
-        conn.close()
+        if interval_index.loaded:
+            interval_index.add(event_id, new_event["date"], start_epoch, end_epoch)
+        commit_or_reload_index(conn)
+        event_count.invalidate()
         return {
                    'id': event_id,
                    'last-update': last_update,
@@ -422,36 +2455,30 @@ class EventList(Resource):
 @api.response(404, 'Event not found')
 @ns.param('event_id', 'The event identifier')
 class Event(Resource):
-    @ns.marshal_with(event)
+    @ns.response(200, 'Success', event)
+    @ns.response(304, 'Not modified')
     def get(self, event_id):
-        conn = sqlite3.connect('events.db')
-        c = conn.cursor()
-        c.execute('SELECT * FROM events WHERE id=?', (event_id,))
-        result = c.fetchone()
-        conn.close()
-
-        if result is not None:
-            metadata = get_metadata(result[2], {'lat': -33.865143, 'lon': 151.209900})
-            return {
-                'id': result[0],
-                'name': result[1],
-                'date': datetime.strptime(result[2], '%d-%m-%Y').strftime('%d-%m-%Y'),
-                'from': result[3],
-                'to': result[4],
-                'location': {'street': result[5], 'suburb': result[6], 'state': result[7], 'post-code': result[8]},
-                'description': result[9],
-                '_links': {'self': {'href': f'http://localhost:5000/api/events/{result[0]}'}},
-                '_metadata': metadata,
-                'last-update': result[10]
-            }
+        record = get_cached_event(event_id)
+
+        if record is not None:
+            lat, lon = weather_location(record.suburb, record.state, record.post_code)
+            metadata = get_metadata(record.date, {'lat': lat, 'lon': lon})
+
+            # The representation changes when the row is updated or its metadata fills in
+            etag = hashlib.sha1(f"{record.last_update}|{json.dumps(metadata, sort_keys=True)}".encode()).hexdigest()
+            if request.if_none_match.contains(etag):
+                return Response(status=304, headers={'ETag': f'"{etag}"'})
+
+            return Response(record.json(metadata) + '\n', mimetype='application/json', headers={'ETag': f'"{etag}"'})
         else:
             api.abort(404, 'Event not found')
 
     @ns.expect(event_patch)
     @ns.marshal_with(event_response)
     def patch(self, event_id):
-        conn = sqlite3.connect('events.db')
+        conn = get_db()
         c = conn.cursor()
+        c.execute('BEGIN IMMEDIATE')
         c.execute('SELECT * FROM events WHERE id=?', (event_id,))
         result = c.fetchone()
         if result is None:
@@ -459,21 +2486,12 @@ class Event(Resource):
 
         patched_event = request.json
         last_update = datetime.utcnow().isoformat()
-        c.execute('SELECT * FROM events')
-        existing_events = c.fetchall()
-        for existing_event in existing_events:
-            existing_event_dict = {
-                "id": existing_event[0],
-                "date": existing_event[2],
-                "from": existing_event[3],
-                "to": existing_event[4]
-            }
-            if existing_event_dict["id"] == event_id:
-                continue
-            if is_time_overlap(patched_event.get("date", result[2]), patched_event.get("from", result[3]),
-                               patched_event.get("to", result[4]),
-                               existing_event_dict["date"], existing_event_dict["from"], existing_event_dict["to"]):
-                raise ValueError("The modified event overlaps with an existing event.")
+        date = patched_event.get("date", result[2])
+        start_epoch, end_epoch = event_span(date, patched_event.get("from", result[3]),
+                                            patched_event.get("to", result[4]))
+        if (find_conflicting_event(c, date, start_epoch, end_epoch, exclude_id=event_id) is not None
+                or get_recurrences(c).find_overlap(start_epoch, end_epoch) is not None):
+            api.abort(409, "The modified event overlaps with an existing event.")
         for key, value in patched_event.items():
             db_column = column_mapping.get(key, key)
             if key == 'location':
@@ -482,9 +2500,12 @@ class Event(Resource):
             else:
                 c.execute(f'UPDATE events SET "{db_column}"=? WHERE id=?', (value, event_id))
 
-        c.execute('UPDATE events SET last_update=? WHERE id=?', (last_update, event_id))
-        conn.commit()
-        conn.close()
+        c.execute('UPDATE events SET last_update=?, start_epoch=?, end_epoch=? WHERE id=?',
+                  (last_update, start_epoch, end_epoch, event_id))
+        if interval_index.loaded:
+            interval_index.add(event_id, date, start_epoch, end_epoch)
+        commit_or_reload_index(conn)
+        event_cache.invalidate(event_id)
         return {
                    'id': event_id,
                    'last-update': last_update,
@@ -508,9 +2529,664 @@ class Event(Resource):
         return response, 200
 
 
+# Columns written by the export endpoint unless a filter is given
+export_columns = [col for col in list_columns if col != "datetime"]
+
+# Alternative spellings accepted by the import endpoint, so an export can be re-imported
+bulk_aliases = {"from_time": "from", "to_time": "to", "post_code": "post-code"}
+
+bulk_required = ("name", "date", "from", "to", "street", "suburb", "state", "post-code")
+
+ndjson_types = ("application/x-ndjson", "application/jsonl")
+
+
+def read_bulk_records(stream, mimetype):
+    """Yield ``(row_number, record, error)`` from an NDJSON or CSV upload without buffering it."""
+    text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    if mimetype == "text/csv":
+        for number, record in enumerate(csv.DictReader(text), start=1):
+            yield number, record, None
+        return
+
+    for number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line), None
+        except ValueError as e:
+            yield number, None, f"invalid JSON: {e}"
+
+
+def bulk_row(record):
+    """Normalise an event object or flat CSV row into the values stored for it."""
+    if not isinstance(record, dict):
+        raise ValueError("expected an event object")
+    flat = dict(record)
+    location = flat.pop("location", None) or {}
+    if not isinstance(location, dict):
+        raise ValueError("location must be an object")
+    flat.update(location)
+    flat = {bulk_aliases.get(key, key): value for key, value in flat.items()}
+
+    missing = [field for field in bulk_required if not flat.get(field)]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+    start_epoch, end_epoch = event_span(flat["date"], flat["from"], flat["to"])
+    return (flat["name"], flat["date"], flat["from"], flat["to"], flat["street"], flat["suburb"], flat["state"],
+            str(flat["post-code"]), flat.get("description") or None, start_epoch, end_epoch)
+
+
+def import_chunk(conn, chunk):
+    """Insert a chunk of ``(row_number, values)`` in one transaction.
+
+    Returns ``[(row_number, error)]`` for rows rejected as overlapping. The chunk
+    is sorted by (date, start) and swept once: each row is checked against the
+    stored events of its date by binary search over their starts (with a running
+    maximum of their ends), against the rows already kept from this chunk and
+    against the recurrence rules.
+    """
+    c = conn.cursor()
+    c.execute('BEGIN IMMEDIATE')
+
+    dates = sorted({values[1] for _, values in chunk})
+    c.execute(f"SELECT date, start_epoch, end_epoch FROM events WHERE date IN ({', '.join('?' * len(dates))}) "
+              "ORDER BY date, start_epoch", dates)
+    stored = {}
+    for date, start, end in c.fetchall():
+        starts, reach = stored.setdefault(date, ([], []))
+        starts.append(start)
+        reach.append(max(end, reach[-1]) if reach else end)
+
+    recurrences = get_recurrences(c)
+    last_update = datetime.utcnow().isoformat()
+    rejected, accepted = [], []
+    current_date, kept_reach = None, None
+    for number, values in sorted(chunk, key=lambda item: (item[1][1], item[1][-2])):
+        date, start, end = values[1], values[-2], values[-1]
+        if date != current_date:
+            current_date, kept_reach = date, None
+
+        starts, reach = stored.get(date, ((), ()))
+        i = bisect.bisect_left(starts, end)
+        if i and reach[i - 1] > start:
+            rejected.append((number, "The event overlaps with an existing event."))
+            continue
+        if kept_reach is not None and start < kept_reach:
+            rejected.append((number, "The event overlaps with another event in the import."))
+            continue
+        if recurrences.find_overlap(start, end) is not None:
+            rejected.append((number, "The event overlaps with a recurring event."))
+            continue
+        kept_reach = end if kept_reach is None else max(kept_reach, end)
+        accepted.append(values[:9] + (last_update,) + values[9:])
+
+    c.execute('SELECT IFNULL(MAX(id), 0) FROM events')
+    last_id = c.fetchone()[0]
+    c.executemany('''INSERT INTO events (name, date, from_time, to_time, street, suburb, state, post_code,
+    description, last_update, start_epoch, end_epoch) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', accepted)
+    if interval_index.loaded:
+        c.execute('SELECT id, date, start_epoch, end_epoch FROM events WHERE id > ?', (last_id,))
+        for event_id, date, start, end in c.fetchall():
+            interval_index.add(event_id, date, start, end)
+    commit_or_reload_index(conn)
+    return rejected
+
+
+@ns.route('/bulk')
+class EventBulk(Resource):
+    @api.param('format', 'ndjson (default) or csv', type=str)
+    @api.param('order', '排序条件，用逗号分隔的字符串，例如：+name,-datetime', type=str)
+    @api.param('filter', '过滤条件，用逗号分隔的字符串，默认导出所有列', type=str)
+    def get(self):
+        format = request.args.get('format', default='ndjson', type=str)
+        order = request.args.get('order', default="+id", type=str)
+        filter = request.args.get('filter', default=",".join(export_columns), type=str)
+        if format not in ('ndjson', 'csv'):
+            return {"error": "Invalid format"}, 400
+
+        order_by, filter_columns = parse_list_params(order, filter)
+        query = "SELECT " + ", ".join(select_expressions(filter_columns)) + " FROM events ORDER BY " + \
+                ", ".join([f"{col} {direction}" for col, direction in order_by])
+
+        def generate():
+            c = get_db().cursor()
+            c.execute(query)
+            buf = io.StringIO()
+            writer = csv.writer(buf)
+            encode = columns_encoder(filter_columns)
+            if format == 'csv':
+                writer.writerow(filter_columns)
+            while True:
+                rows = c.fetchmany(500)
+                if not rows:
+                    break
+                if format == 'csv':
+                    writer.writerows(rows)
+                else:
+                    buf.write("\n".join([encode(row) for row in rows]) + "\n")
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+
+        mimetype = 'text/csv' if format == 'csv' else ndjson_types[0]
+        return Response(stream_with_context(generate()), mimetype=mimetype)
+
+    @ns.doc(description='Import events from an NDJSON (application/x-ndjson) or CSV (text/csv) body')
+    @ns.marshal_with(bulk_import_response)
+    def post(self):
+        if request.mimetype not in ndjson_types + ("text/csv",):
+            api.abort(415, "Send application/x-ndjson or text/csv")
+
+        conn = get_db()
+        chunk_size = app.config['BULK_CHUNK_SIZE']
+        imported, errors, failed = 0, [], 0
+
+        def reject(number, error):
+            nonlocal failed
+            failed += 1
+            if len(errors) < app.config['BULK_MAX_ERRORS']:
+                errors.append({'row': number, 'error': error})
+
+        def flush(chunk):
+            nonlocal imported
+            rejected = import_chunk(conn, chunk)
+            imported += len(chunk) - len(rejected)
+            for number, error in rejected:
+                reject(number, error)
+
+        chunk = []
+        for number, record, error in read_bulk_records(request.stream, request.mimetype):
+            if error is None:
+                try:
+                    chunk.append((number, bulk_row(record)))
+                except (ValueError, TypeError, AttributeError) as e:
+                    error = str(e)
+            if error is not None:
+                reject(number, error)
+            if len(chunk) >= chunk_size:
+                flush(chunk)
+                chunk = []
+        if chunk:
+            flush(chunk)
+
+        if imported:
+            event_count.invalidate()
+        errors.sort(key=lambda error: error['row'])
+        return {'imported': imported, 'failed': failed, 'errors': errors}
+
+
+@ns.route('/analytics')
+class EventAnalytics(Resource):
+    @api.param('from', 'First day (YYYY-mm-dd) to include', type=str)
+    @api.param('to', 'Last day (YYYY-mm-dd) to include', type=str)
+    @api.param('ids', 'Comma-separated event ids to build an overlap matrix for', type=str)
+    def get(self):
+        start_day = request.args.get('from', type=str)
+        end_day = request.args.get('to', type=str)
+        ids = request.args.get('ids', default='', type=str)
+
+        view, names = get_event_columns(get_db().cursor())
+        start, end = view['start'], view['end']
+
+        # Optional date range over the event start
+        mask = None
+        if start_day:
+            mask = start >= day_epoch(parse_day(start_day, 'from'))
+        if end_day:
+            before_end = start < day_epoch(parse_day(end_day, 'to')) + 86400
+            mask = before_end if mask is None else mask & before_end
+        if mask is not None:
+            view = {name: column[mask] for name, column in view.items()}
+            start, end = view['start'], view['end']
+
+        response_data = {
+            'total': len(start),
+            'busy-hours': busy_hours(start, end),
+            'per-suburb': category_counts(view['suburb'], names['suburb']),
+            'per-state': category_counts(view['state'], names['state']),
+            'utilization-per-day': daily_utilization(start, end),
+        }
+
+        if ids:
+            try:
+                event_ids = [int(event_id) for event_id in ids.split(',')]
+            except ValueError:
+                api.abort(400, 'ids must be comma-separated integers')
+            if len(event_ids) > 1000:
+                api.abort(400, 'At most 1000 ids can be compared at once')
+            try:
+                spans = event_columns.spans(event_ids)
+            except KeyError as e:
+                api.abort(404, f"Events not found: {', '.join(map(str, e.args[0]))}")
+            response_data['overlaps'] = {'ids': event_ids, 'matrix': overlap_matrix(*spans)}
+
+        return response_data
+
+
+def parse_hours(value):
+    """Parse a ``HH:MM-HH:MM`` working-hours window into minutes since midnight; it may close at 24:00."""
+    try:
+        opening, closing = (part.strip() for part in value.split('-'))
+        opening = datetime.strptime(opening, '%H:%M')
+        closing = None if closing == '24:00' else datetime.strptime(closing, '%H:%M')
+    except ValueError:
+        api.abort(400, 'hours must be formatted as HH:MM-HH:MM')
+    opening = opening.hour * 60 + opening.minute
+    closing = 24 * 60 if closing is None else closing.hour * 60 + closing.minute
+    if opening >= closing:
+        api.abort(400, 'hours must close after they open')
+    return opening, closing
+
+
+@ns.route('/availability')
+class EventAvailability(Resource):
+    @api.param('from', 'First day (YYYY-mm-dd) to search', type=str, required=True)
+    @api.param('to', 'Last day (YYYY-mm-dd) to search, defaults to from', type=str)
+    @api.param('duration', 'Minimum free time needed, in minutes', type=int, required=True)
+    @api.param('hours', 'Working hours to search within (HH:MM-HH:MM)', type=str, default='00:00-24:00')
+    @api.param('limit', 'Return at most the next N free slots', type=int, default=20)
+    def get(self):
+        if 'from' not in request.args:
+            api.abort(400, 'from is required')
+        start_day = parse_day(request.args.get('from', type=str), 'from')
+        end_day = parse_day(request.args.get('to', default=start_day, type=str), 'to')
+        duration = request.args.get('duration', type=int)
+        opening, closing = parse_hours(request.args.get('hours', default='00:00-24:00', type=str))
+        limit = request.args.get('limit', default=20, type=int)
+
+        if not duration or duration <= 0:
+            api.abort(400, 'duration must be a positive number of minutes')
+        if limit <= 0 or limit > 1000:
+            api.abort(400, 'limit must be between 1 and 1000')
+        first, last = datetime.strptime(start_day, '%Y-%m-%d'), datetime.strptime(end_day, '%Y-%m-%d')
+        if last < first:
+            api.abort(400, 'to must not be before from')
+        if (last - first).days > 366:
+            api.abort(400, 'At most a year can be searched at once')
+
+        c = get_db().cursor()
+        slots = []
+        for date, midnight, busy in busy_days(c, first, last, get_recurrences(c)):
+            for slot_start, slot_end in free_slots(busy, midnight + opening * 60,
+                                                   midnight + closing * 60, duration * 60):
+                slots.append({
+                    'date': date,
+                    'from': time.strftime('%H:%M', time.gmtime(slot_start)),
+                    'to': '24:00' if slot_end == midnight + 86400 else time.strftime('%H:%M', time.gmtime(slot_end)),
+                    'minutes': (slot_end - slot_start) // 60,
+                })
+                if len(slots) == limit:
+                    break
+            if len(slots) == limit:
+                break
+
+        return {'slots': slots}
+
+
+series_columns = ("id", "name", "from_time", "to_time", "street", "suburb", "state", "post_code", "description",
+                  "freq", "interval", "by_day", "start_date", "until_date", "count", "exceptions", "last_update")
+
+series_required = ("name", "from", "to", "location", "rule")
+
+
+def parse_clock(value, name):
+    try:
+        datetime.strptime(value, '%H:%M')
+    except (TypeError, ValueError):
+        api.abort(400, f"{name} must be a HH:MM time")
+    return day_seconds(value)
+
+
+def parse_ordinal(value, name):
+    try:
+        return datetime.strptime(value, '%d-%m-%Y').toordinal()
+    except (TypeError, ValueError):
+        api.abort(400, f"{name} must be a dd-mm-YYYY date")
+
+
+def parse_series(series):
+    """Validate a recurring event into the values stored for it and its Recurrence.
+
+    The values follow series_columns, less id and last_update.
+    """
+    if not isinstance(series, dict):
+        api.abort(400, 'expected a recurring event object')
+    location = series.get('location') or {}
+    missing = [field for field in series_required if not series.get(field)]
+    missing += [f'location.{field}' for field in ('street', 'suburb', 'state', 'post-code')
+                if location and not location.get(field)]
+    if missing:
+        api.abort(400, f"missing {', '.join(missing)}")
+
+    rule = series['rule']
+    freq = rule.get('freq')
+    if freq not in recurrence_frequencies:
+        api.abort(400, 'rule.freq must be daily, weekly or monthly')
+    interval = rule.get('interval', 1)
+    if not isinstance(interval, int) or not 1 <= interval <= 1000:
+        api.abort(400, 'rule.interval must be between 1 and 1000')
+    first = parse_ordinal(rule.get('start'), 'rule.start')
+    by_day = rule.get('by-day') or []
+    if by_day and freq != 'weekly':
+        api.abort(400, 'rule.by-day only applies to weekly rules')
+    if any(code not in weekday_codes for code in by_day):
+        api.abort(400, f"rule.by-day must list weekdays out of {', '.join(weekday_codes)}")
+    if freq == 'weekly' and not by_day:
+        by_day = [weekday_codes[(first - 1) % 7]]
+    if rule.get('until') and rule.get('count'):
+        api.abort(400, 'rule takes until or count, not both')
+    until = parse_ordinal(rule['until'], 'rule.until') if rule.get('until') else None
+    if until is not None and until < first:
+        api.abort(400, 'rule.until must not be before rule.start')
+    max_years = app.config['RECURRENCE_MAX_YEARS']
+    if until is not None and until - first > max_years * 36525 // 100:
+        api.abort(400, f'rule.until must be within {max_years} years of rule.start')
+    count = rule.get('count')
+    if count is not None and (not isinstance(count, int) or not 1 <= count <= 10000):
+        api.abort(400, 'rule.count must be between 1 and 10000')
+    exceptions = sorted({parse_ordinal(day, 'rule.exceptions') for day in rule.get('exceptions') or ()})
+    start, end = parse_clock(series['from'], 'from'), parse_clock(series['to'], 'to')
+    if start >= end:
+        api.abort(400, 'from must be before to')
+
+    weekdays = frozenset(weekday_codes.index(code) for code in by_day)
+    recurrence = Recurrence(None, freq, interval, weekdays, first, until, start, end, frozenset(exceptions))
+    if count:
+        # Exceptions don't give back occurrences, so the count runs over the bare rule
+        bare = Recurrence(None, freq, interval, weekdays, first, None, start, end)
+        for day in itertools.islice(bare.occurrences(first, MAX_ORDINAL), count):
+            recurrence.until = day
+    values = (series['name'], series['from'], series['to'], location['street'], location['suburb'], location['state'],
+              str(location['post-code']), series.get('description'), freq, interval,
+              ','.join(code for code in weekday_codes if code in by_day) or None, ordinal_day(first),
+              None if recurrence.until is None else ordinal_day(recurrence.until), count,
+              json.dumps([ordinal_day(day) for day in exceptions]))
+    return values, recurrence
+
+
+def series_body(row):
+    (series_id, name, from_time, to_time, street, suburb, state, post_code, description, freq, interval, by_day,
+     start_date, until_date, count, exceptions, last_update) = row
+    rule = {'freq': freq, 'interval': interval, 'start': start_date, 'exceptions': json.loads(exceptions)}
+    if by_day:
+        rule['by-day'] = by_day.split(',')
+    if count:
+        rule['count'] = count
+    elif until_date:
+        rule['until'] = until_date
+    return {
+        'id': series_id,
+        'name': name,
+        'from': from_time,
+        'to': to_time,
+        'location': {'street': street, 'suburb': suburb, 'state': state, 'post-code': post_code},
+        'description': description,
+        'rule': rule,
+        '_links': {'self': {'href': url_for(resource_endpoint('recurring_event'), series_id=series_id, _external=True)}},
+        'last-update': last_update,
+    }
+
+
+def get_series_row(c, series_id):
+    c.execute(f"SELECT {', '.join(series_columns)} FROM recurrences WHERE id=?", (series_id,))
+    row = c.fetchone()
+    if row is None:
+        api.abort(404, 'Series not found')
+    return row
+
+
+@ns.route('/recurring')
+class RecurringEventList(Resource):
+    @ns.marshal_with(recurring_event_list)
+    def get(self):
+        c = get_db().cursor()
+        c.execute(f"SELECT {', '.join(series_columns)} FROM recurrences ORDER BY id")
+        return {'series': [series_body(row) for row in c.fetchall()]}
+
+    @ns.expect(recurring_event)
+    @ns.marshal_with(event_response, code=201)
+    def post(self):
+        conn = get_db()
+        c = conn.cursor()
+        values, rule = parse_series(request.json)
+        last_update = datetime.utcnow().isoformat()
+        c.execute('BEGIN IMMEDIATE')
+        conflict = find_series_conflict(c, rule)
+        if conflict is not None:
+            api.abort(409, conflict)
+        c.execute(f"INSERT INTO recurrences ({', '.join(series_columns[1:])}) "
+                  f"VALUES ({', '.join('?' * (len(series_columns) - 1))})", values + (last_update,))
+        rule.id = c.lastrowid
+        if recurrence_index.loaded:
+            recurrence_index.add(rule)
+        commit_or_reload_index(conn)
+        return {'id': rule.id, 'last-update': last_update,
+                '_links': {'self': {'href': f'/events/recurring/{rule.id}'}}}, 201
+
+
+@ns.route('/recurring/<int:series_id>')
+@api.response(404, 'Series not found')
+@ns.param('series_id', 'The recurring event identifier')
+class RecurringEvent(Resource):
+    @ns.marshal_with(recurring_event)
+    def get(self, series_id):
+        return series_body(get_series_row(get_db().cursor(), series_id))
+
+    @ns.expect(recurring_event_patch)
+    @ns.marshal_with(event_response)
+    def patch(self, series_id):
+        conn = get_db()
+        c = conn.cursor()
+        c.execute('BEGIN IMMEDIATE')
+        series = series_body(get_series_row(c, series_id))
+        patch = request.json or {}
+        rule = dict(series['rule'], **(patch.get('rule') or {}))
+        # A new bound replaces the old one, and by-day belongs to weekly rules only
+        if 'until' in (patch.get('rule') or {}):
+            rule.pop('count', None)
+        if 'count' in (patch.get('rule') or {}):
+            rule.pop('until', None)
+        if 'freq' in (patch.get('rule') or {}) and 'by-day' not in patch['rule']:
+            rule.pop('by-day', None)
+        series.update(patch, location=dict(series['location'], **(patch.get('location') or {})), rule=rule)
+        values, rule = parse_series(series)
+        rule.id = series_id
+        conflict = find_series_conflict(c, rule, exclude_id=series_id)
+        if conflict is not None:
+            api.abort(409, conflict)
+
+        last_update = datetime.utcnow().isoformat()
+        c.execute(f"UPDATE recurrences SET {', '.join(f'{column}=?' for column in series_columns[1:])} WHERE id=?",
+                  values + (last_update, series_id))
+        if recurrence_index.loaded:
+            recurrence_index.add(rule)
+        commit_or_reload_index(conn)
+        return {'id': series_id, 'last-update': last_update,
+                '_links': {'self': {'href': f'/events/recurring/{series_id}'}}}, 200
+
+    @ns.marshal_with(event_delete_response, code=200)
+    def delete(self, series_id):
+        conn = get_db()
+        c = conn.cursor()
+        c.execute('DELETE FROM recurrences WHERE id=?', (series_id,))
+        if c.rowcount == 0:
+            api.abort(404, f"Series {series_id} doesn't exist")
+        conn.commit()
+        recurrence_index.discard(series_id)
+        return {'message': f"The series with id {series_id} was removed from the database!", 'id': series_id}, 200
+
+
+@ns.route('/occurrences')
+class EventOccurrences(Resource):
+    @api.param('from', 'First day (YYYY-mm-dd) to list', type=str, required=True)
+    @api.param('to', 'Last day (YYYY-mm-dd) to list, defaults to from', type=str)
+    @api.param('limit', 'Return at most the first N occurrences', type=int, default=100)
+    def get(self):
+        if 'from' not in request.args:
+            api.abort(400, 'from is required')
+        start_day = parse_day(request.args.get('from', type=str), 'from')
+        end_day = parse_day(request.args.get('to', default=start_day, type=str), 'to')
+        limit = request.args.get('limit', default=100, type=int)
+        if limit <= 0 or limit > 1000:
+            api.abort(400, 'limit must be between 1 and 1000')
+        first, last = iso_ordinal(start_day), iso_ordinal(end_day)
+        if last < first:
+            api.abort(400, 'to must not be before from')
+        if last - first > 366:
+            api.abort(400, 'At most a year can be listed at once')
+
+        c = get_db().cursor()
+        recurrences = get_recurrences(c)
+        days = json.dumps([ordinal_day(day) for day in range(first, last + 1)])
+        c.execute("SELECT start_epoch, end_epoch, id FROM events WHERE date IN (SELECT value FROM json_each(?)) "
+                  "ORDER BY start_epoch, end_epoch, id", (days,))
+        # Stored events stream from the cursor and each rule generates its own days; merging stops at the limit
+        events = ((start, end, 'event', event_id) for start, end, event_id in iter(c.fetchone, None))
+        series = ((start, end, 'series', series_id)
+                  for start, end, series_id in recurrences.occurrences(first, last))
+        page = list(itertools.islice(heapq.merge(events, series), limit))
+
+        names = {}
+        for kind, table in (('event', 'events'), ('series', 'recurrences')):
+            ids = [key for _, _, item_kind, key in page if item_kind == kind]
+            c.execute(f"SELECT id, name FROM {table} WHERE id IN (SELECT value FROM json_each(?))", (json.dumps(ids),))
+            names[kind] = dict(c.fetchall())
+
+        hrefs = {'event': link_template(resource_endpoint('event'), 'event_id'),
+                 'series': link_template(resource_endpoint('recurring_event'), 'series_id')}
+        results = []
+        for start, end, kind, key in page:
+            href = hrefs[kind] % key
+            results.append({
+                'id' if kind == 'event' else 'series': key,
+                'name': names[kind].get(key),
+                'date': time.strftime('%d-%m-%Y', time.gmtime(start)),
+                'from': time.strftime('%H:%M', time.gmtime(start)),
+                'to': time.strftime('%H:%M', time.gmtime(end)),
+                '_links': {'self': {'href': href}},
+            })
+
+        return {'occurrences': results}
+
+
+def parse_change_token(value):
+    try:
+        since = int(value)
+    except (TypeError, ValueError):
+        since = -1
+    if since < 0:
+        api.abort(400, 'since must be 0 or a token from an earlier response')
+    return since
+
+
+def read_changes(c, since, limit):
+    """Return up to ``limit`` changes committed after token ``since``, and whether more are waiting.
+
+    Each change is ``(token, json)``, the JSON being an EventChange.
+    """
+    c.execute("SELECT ch.seq, ch.event_id, ch.op, ch.changed_at, e.* FROM event_changes ch "
+              "LEFT JOIN events e ON e.id = ch.event_id WHERE ch.seq > ? ORDER BY ch.seq LIMIT ?",
+              (since, limit + 1))
+    rows = c.fetchall()
+    changes = []
+    href = event_href()
+    for seq, event_id, op, changed_at, *row in rows[:limit]:
+        event = '' if op == 'delete' else ', "event": ' + EventRecord._make(row).json(href=href)
+        changes.append((seq, f'{{"token": "{seq}", "id": {event_id}, "op": "{op}", '
+                             f'"changed-at": {json_string(changed_at)}{event}}}'))
+    return changes, len(rows) > limit
+
+
+def wait_for_changes(since, limit, wait):
+    """``read_changes``, holding on for up to ``wait`` seconds while there are none.
+
+    Each read checks a connection out and back in, so a waiting request doesn't
+    hold one of the pool's connections.
+    """
+    deadline = time.monotonic() + wait
+    while True:
+        version = change_feed.version
+        with get_pool().connection() as conn:
+            changes, has_more = read_changes(conn.cursor(), since, limit)
+        remaining = deadline - time.monotonic()
+        if changes or remaining <= 0:
+            return changes, has_more
+        change_feed.wait(version, min(remaining, app.config['CHANGES_POLL_INTERVAL']))
+
+
+def change_message(token, change):
+    """Format a change as a Server-Sent Event whose id is its token, so EventSource resumes after it."""
+    return f"id: {token}\ndata: {change}\n\n"
+
+
+@ns.route('/changes')
+class EventChanges(Resource):
+    @api.param('since', 'Token from the previous response; 0 (the default) lists every event', type=str)
+    @api.param('limit', 'Return at most N changes', type=int, default=100)
+    @api.param('wait', 'Seconds to hold the request while nothing has changed (long poll), '
+                       'at most CHANGES_MAX_WAIT', type=float, default=0)
+    @ns.response(200, 'Success', event_change_page)
+    def get(self):
+        since = parse_change_token(request.args.get('since', default='0', type=str))
+        limit = request.args.get('limit', default=100, type=int)
+        if limit <= 0 or limit > 1000:
+            api.abort(400, 'limit must be between 1 and 1000')
+        wait = min(max(request.args.get('wait', default=0.0, type=float), 0.0), app.config['CHANGES_MAX_WAIT'])
+
+        changes, has_more = wait_for_changes(since, limit, wait)
+        token = changes[-1][0] if changes else since
+        links = {
+            'self': {'href': url_for(resource_endpoint('event_changes'), since=since, limit=limit, _external=True)},
+            'next': {'href': url_for(resource_endpoint('event_changes'), since=token, limit=limit, _external=True)},
+        }
+        return Response(f'{{"changes": [{", ".join(change for _, change in changes)}], "next": "{token}", '
+                        f'"has_more": {json.dumps(has_more)}, "_links": {json.dumps(links)}}}\n',
+                        mimetype='application/json')
+
+
+@ns.route('/changes/stream')
+class EventChangeStream(Resource):
+    @api.param('since', 'Token to start after, 0 (the default) for every event; a Last-Event-ID header wins',
+               type=str)
+    @ns.produces(['text/event-stream'])
+    @ns.doc(description='Server-Sent Events: one message per change, data as in /changes, id as its token')
+    def get(self):
+        since = parse_change_token(request.headers.get('Last-Event-ID')
+                                   or request.args.get('since', default='0', type=str))
+        heartbeat = app.config['CHANGES_HEARTBEAT']
+
+        def generate():
+            token = since
+            quiet_until = time.monotonic() + heartbeat
+            while True:
+                version = change_feed.version
+                with get_pool().connection() as conn:
+                    changes, has_more = read_changes(conn.cursor(), token, 100)
+                if changes:
+                    token = changes[-1][0]
+                    yield ''.join(change_message(*change) for change in changes)
+                    quiet_until = time.monotonic() + heartbeat
+                    if has_more:
+                        continue
+                elif time.monotonic() >= quiet_until:
+                    # A comment keeps proxies from closing an idle stream and finds clients that went away
+                    yield ': keep-alive\n\n'
+                    quiet_until = time.monotonic() + heartbeat
+                change_feed.wait(version, max(min(quiet_until - time.monotonic(),
+                                                  app.config['CHANGES_POLL_INTERVAL']), 0))
+
+        return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
 @ns.route('/statistics')
 class EventStatistics(Resource):
+    get_statistics_json = get_statistics_json
+    get_statistics_image = get_statistics_image
+
     @api.param('format', 'The response format (json or image)', type=str)
+    @api.param('from', 'First day (YYYY-mm-dd) counted in total and per-days', type=str)
+    @api.param('to', 'Last day (YYYY-mm-dd) counted in total and per-days', type=str)
     def get(self):
         format = request.args.get('format', default='json', type=str)
         if format not in ('json', 'image'):
@@ -522,19 +3198,223 @@ class EventStatistics(Resource):
             return self.get_statistics_image()
 
 
+# The same resources again under /api/calendars/<cid>/events, where they work on that calendar's shard
+calendar_ns = api.namespace('calendar', path='/api/calendars/<string:cid>/events',
+                            description='Events of one calendar, kept in its own SQLite file')
+for route in ns.resources:
+    calendar_ns.add_resource(route.resource, *route.urls, route_doc=route.route_doc, **route.kwargs)
+
+calendars_ns = api.namespace('calendars', path='/api/calendars', description='Queries across every calendar')
+
+
+_shard_executor = None
+_shard_executor_lock = threading.Lock()
+
+
+def shard_executor(broken=None):
+    """The worker pool, started on first use and started again when ``broken`` is the current one."""
+    global _shard_executor
+    with _shard_executor_lock:
+        if _shard_executor is not None and _shard_executor is broken:
+            _shard_executor.shutdown(wait=False, cancel_futures=True)
+            _shard_executor = None
+        if _shard_executor is None:
+            # Spawned rather than forked, since this process runs threads
+            _shard_executor = ProcessPoolExecutor(app.config['SHARD_WORKERS'],
+                                                  mp_context=multiprocessing.get_context('spawn'))
+        return _shard_executor
+
+
+def fan_out(fn, cids, *args):
+    """Run ``fn(database, *args)`` for every calendar on the worker processes and return ``{cid: result}``."""
+    def run(executor):
+        futures = {cid: executor.submit(fn, calendar_path(cid), *args) for cid in cids}
+        return {cid: future.result() for cid, future in futures.items()}
+
+    executor = shard_executor()
+    try:
+        return run(executor)
+    except BrokenProcessPool:
+        # A worker died (killed, out of memory); the queries only read, so run them once more on a new pool
+        logger.warning("Shard worker pool broke, starting a new one")
+        return run(shard_executor(broken=executor))
+
+
+@calendars_ns.route('/')
+class CalendarList(Resource):
+    def get(self):
+        return {'calendars': [{'id': cid, '_links': {'events': {'href': url_for('calendar_event_list', cid=cid,
+                                                                                 _external=True)}}}
+                              for cid in calendar_ids()]}
+
+
+@calendars_ns.route('/events')
+class CalendarEventList(Resource):
+    @api.param('page', 'The page number', type=int)
+    @api.param('page_size', 'The number of events per page', type=int)
+    @api.param('order', '排序条件，用逗号分隔的字符串，例如：+name,-datetime', type=str)
+    @api.param('filter', '过滤条件，用逗号分隔的字符串，例如：id,name,datetime', type=str)
+    @api.param('count', 'Whether to include total_events, defaults to true', type=bool)
+    @ns.response(200, 'Success', event_list_page)
+    def get(self):
+        page = request.args.get('page', default=1, type=int)
+        page_size = request.args.get('page_size', default=10, type=int)
+        order = request.args.get('order', default="+id", type=str)
+        filter = request.args.get('filter', default="id,name", type=str)
+        with_count = request.args.get('count', default=True, type=inputs.boolean)
+        if page < 1 or page_size < 1:
+            api.abort(400, "page and page_size must be positive")
+        order_by, filter_columns = parse_list_params(order, filter)
+
+        # Each calendar returns its own first rows up to the end of the page; the page is cut from their merge
+        select_columns = select_expressions(filter_columns) + [expr for expr, _ in order_by]
+        queries = [("SELECT " + ", ".join(select_columns) + " FROM events ORDER BY " +
+                    ", ".join([f"{col} {direction}" for col, direction in order_by]) + " LIMIT ?",
+                    (page * page_size + 1,))]
+        if with_count:
+            queries.append(("SELECT COUNT(*) FROM events", ()))
+        cids = calendar_ids()
+        results = fan_out(shard_queries, cids, queries)
+
+        rows = [(cid, row) for cid in cids for row in results[cid][0]]
+        # Stable sorts from the last ORDER BY term to the first; ties between calendars stay in calendar order
+        for i, (_, direction) in reversed(list(enumerate(order_by))):
+            rows.sort(key=lambda item: item[1][len(filter_columns) + i], reverse=direction == "DESC")
+        first = (page - 1) * page_size
+        has_more = len(rows) > first + page_size
+
+        encoders = {cid: summary_encoder(filter_columns, json_string(link_template('calendar_event', 'event_id',
+                                                                                   cid=cid)))
+                    for cid in cids}
+        events = [f'{{"calendar": "{cid}", ' + encoders[cid](row)[1:] for cid, row in rows[first:first + page_size]]
+
+        def link(page):
+            return "/api/calendars/events?" + urlencode({"page": page, "page_size": page_size, "order": order,
+                                                        "filter": filter})
+
+        metadata = {
+            "total_events": sum(results[cid][1][0][0] for cid in cids) if with_count else None,
+            "_links": {
+                "self": {"href": link(page)},
+                "prev": {"href": link(page - 1)} if page > 1 else None,
+                "next": {"href": link(page + 1)} if has_more else None,
+            },
+            "page_size": page_size,
+            "page": page,
+        }
+        return Response('{"events": [' + ', '.join(events) + '], "metadata": ' + json.dumps(metadata) + '}\n',
+                        mimetype='application/json')
+
+
+@calendars_ns.route('/statistics')
+class CalendarStatistics(Resource):
+    @api.param('from', 'First day (YYYY-mm-dd) counted in total and per-days', type=str)
+    @api.param('to', 'Last day (YYYY-mm-dd) counted in total and per-days', type=str)
+    def get(self):
+        start, end = statistics_range()
+        results = fan_out(shard_statistics, calendar_ids(), start, end, app.config['RECURRENCE_HORIZON'])
+        merged = {"total": 0, "total-current-week": 0, "total-current-month": 0}
+        per_days = Counter()
+        for figures in results.values():
+            for key in merged:
+                merged[key] += figures[key]
+            per_days.update(figures["per-days"])
+        merged["per-days"] = dict(sorted(per_days.items()))
+        merged["calendars"] = {cid: figures["total"] for cid, figures in results.items()}
+        return merged
+
+
 @app.route('/weather', methods=['GET'])
 def get_weather():
     date = request.args.get('date', default=datetime.now().strftime('%Y-%m-%d'), type=str)
-    fig = plot_weather_forecast(date, city_weather_data)
+    dpi = min(max(request.args.get('dpi', default=300, type=int), 50), 300)
+    city_weather_data, version, fetched_at = get_city_weather()
 
-    img_buffer = io.BytesIO()
-    fig.savefig(img_buffer, format='png', dpi=300, bbox_inches="tight")
-    plt.close(fig)
-    img_buffer.seek(0)
-
-    # Send the buffer as an image response
-    return send_file(img_buffer, mimetype='image/png')
+    # The image only depends on the date, forecast snapshot and resolution
+    key = (date, version, dpi)
+    etag = weather_render_cache.name(key)
+    if request.if_none_match.contains(etag):
+        return '', 304, {'ETag': f'"{etag}"'}
 
+    png = weather_render_cache.get_or_render(key, lambda: render_weather_forecast(date, city_weather_data, dpi))
 
+    # Send the buffer as an image response
+    return send_file(io.BytesIO(png), mimetype='image/png', etag=etag, last_modified=fetched_at, conditional=True)
+
+
+@metrics.collector
+def cache_metrics():
+    caches = {'event': event_cache, 'event_count': event_count, 'holiday': holiday_cache, 'weather': weather_cache,
+              'weather_render': weather_render_cache, 'statistics_chart': statistics_chart_cache}
+    hits = {name: cache.hits + getattr(cache, 'disk_hits', 0) for name, cache in caches.items()}
+    misses = {name: cache.misses for name, cache in caches.items()}
+    return [
+        ('cache_hits_total', 'counter', 'Cache lookups answered from the cache',
+         [('', {'cache': name}, value) for name, value in hits.items()]),
+        ('cache_misses_total', 'counter', 'Cache lookups that had to load or render',
+         [('', {'cache': name}, value) for name, value in misses.items()]),
+        ('cache_hit_ratio', 'gauge', 'Hits over lookups since startup',
+         [('', {'cache': name}, round(hits[name] / (hits[name] + misses[name]), 4))
+          for name in caches if hits[name] + misses[name]]),
+    ]
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+class StackSampler:
+    """Samples every other thread's stack and counts them as folded stacks.
+
+    The output has one ``thread;outer;...;inner count`` line per distinct stack,
+    the input format of flamegraph.pl and speedscope.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def sample(self, seconds, interval):
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            stacks = Counter()
+            me = threading.get_ident()
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == me:
+                        continue
+                    frames = []
+                    while frame is not None:
+                        code = frame.f_code
+                        frames.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                        frame = frame.f_back
+                    frames.append(names.get(ident, str(ident)))
+                    stacks[';'.join(reversed(frames))] += 1
+                time.sleep(interval)
+            return ''.join(f'{stack} {count}\n' for stack, count in stacks.most_common())
+        finally:
+            self._lock.release()
+
+
+stack_sampler = StackSampler()
+
+
+@app.route('/debug/profile', methods=['GET'])
+def get_profile():
+    if not app.config['PROFILER']:
+        return Response('Profiling is disabled, set PROFILER to enable it\n', status=404, mimetype='text/plain')
+    seconds = min(max(request.args.get('seconds', default=10, type=float), 0.1), 60)
+    interval = min(max(request.args.get('interval_ms', default=5, type=float), 1), 1000) / 1000
+    folded = stack_sampler.sample(seconds, interval)
+    if folded is None:
+        return Response('A profile is already being taken\n', status=409, mimetype='text/plain')
+    return Response(folded, mimetype='text/plain')
+
+
+# Development server; in production serve asgi:app with uvicorn
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
     app.run(debug=True)
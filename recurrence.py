@@ -0,0 +1,216 @@
+"""Recurring events: rules evaluated day by day, never expanded ahead of time.
+
+Kept apart from the app so the cross-calendar workers in ``shard_worker`` can
+count occurrences without importing it.
+"""
+import heapq
+import json
+import math
+import threading
+from collections import Counter
+from datetime import datetime
+
+# Recurring events work in proleptic Gregorian day ordinals (datetime.toordinal)
+EPOCH_ORDINAL = datetime(1970, 1, 1).toordinal()
+MAX_ORDINAL = datetime.max.toordinal()
+# Every calendar pattern repeats after 400 Gregorian years
+GREGORIAN_CYCLE = 146097
+weekday_codes = ('MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU')
+recurrence_frequencies = ('daily', 'weekly', 'monthly')
+
+
+def iso_ordinal(day):
+    return datetime.strptime(day, '%Y-%m-%d').toordinal()
+
+
+def ordinal_day(ordinal):
+    """Format a day ordinal the way events store dates (``dd-mm-YYYY``)."""
+    return datetime.fromordinal(ordinal).strftime('%d-%m-%Y')
+
+
+def day_seconds(time: str) -> int:
+    hour, minute = time.split(':')
+    return int(hour) * 3600 + int(minute) * 60
+
+
+class Recurrence:
+    """When a recurring event happens: its rule, the days it spans and its time of day.
+
+    Days are ordinals and ``start``/``end`` are seconds after midnight UTC. A
+    count is resolved to ``until`` when the series is stored, so whether a day
+    is an occurrence is arithmetic on that day alone.
+    """
+
+    def __init__(self, series_id, freq, interval, weekdays, first, until, start, end, exceptions=frozenset()):
+        self.id = series_id
+        self.freq = freq
+        self.interval = interval
+        self.weekdays = weekdays
+        self.first = first
+        self.until = until
+        self.start = start
+        self.end = end
+        self.exceptions = exceptions
+
+    @classmethod
+    def from_row(cls, row):
+        series_id, freq, interval, by_day, start_date, until_date, from_time, to_time, exceptions = row
+        return cls(series_id, freq, interval,
+                   frozenset(weekday_codes.index(code) for code in by_day.split(',')) if by_day else frozenset(),
+                   datetime.strptime(start_date, '%d-%m-%Y').toordinal(),
+                   datetime.strptime(until_date, '%d-%m-%Y').toordinal() if until_date else None,
+                   day_seconds(from_time), day_seconds(to_time),
+                   frozenset(datetime.strptime(day, '%d-%m-%Y').toordinal() for day in json.loads(exceptions)))
+
+    @property
+    def density(self):
+        """Roughly how many occurrences fall on each day."""
+        if self.freq == 'daily':
+            return 1 / self.interval
+        if self.freq == 'weekly':
+            return len(self.weekdays) / (7 * self.interval)
+        return 1 / (30.44 * self.interval)
+
+    def occurs_on(self, day):
+        if day < self.first or (self.until is not None and day > self.until) or day in self.exceptions:
+            return False
+        if self.freq == 'daily':
+            return (day - self.first) % self.interval == 0
+        if self.freq == 'weekly':
+            # Ordinal 1 is a Monday, so weeks run Monday to Sunday
+            return (day - 1) % 7 in self.weekdays and ((day - 1) // 7 - (self.first - 1) // 7) % self.interval == 0
+        this, first = datetime.fromordinal(day), datetime.fromordinal(self.first)
+        months = (this.year - first.year) * 12 + this.month - first.month
+        return this.day == first.day and months % self.interval == 0
+
+    def occurrences(self, first, last):
+        """Yield the days in ``[first, last]`` the series falls on, in order, skipping straight between them."""
+        first = max(first, self.first)
+        if self.until is not None:
+            last = min(last, self.until)
+        if self.freq == 'daily':
+            days = range(first + (self.first - first) % self.interval, last + 1, self.interval)
+        elif self.freq == 'weekly':
+            days = self._weekly(first, last)
+        else:
+            days = self._monthly(first, last)
+        for day in days:
+            if day not in self.exceptions:
+                yield day
+
+    def first_shared_day(self, other):
+        """Return the first day both series fall on, or None.
+
+        Once past both starts and every exception, the pair repeats with the lcm
+        of their periods (or the 400-year cycle when months are involved), so one
+        cycle of the sparser series is all that needs checking.
+        """
+        first = max(self.first, other.first)
+        last = min(until for until in (self.until, other.until, MAX_ORDINAL) if until is not None)
+        if 'monthly' in (self.freq, other.freq):
+            cycle = GREGORIAN_CYCLE
+        else:
+            cycle = math.lcm(*(rule.interval * (7 if rule.freq == 'weekly' else 1) for rule in (self, other)))
+        last = min(last, max((first, *self.exceptions, *other.exceptions)) + cycle)
+        sparse, dense = sorted((self, other), key=lambda rule: rule.density)
+        for day in sparse.occurrences(first, last):
+            if dense.occurs_on(day):
+                return day
+        return None
+
+    def _weekly(self, first, last):
+        week = (first - 1) // 7
+        week += ((self.first - 1) // 7 - week) % self.interval
+        weekdays = sorted(self.weekdays)
+        while week * 7 + 1 <= last:
+            for weekday in weekdays:
+                day = week * 7 + 1 + weekday
+                if first <= day <= last:
+                    yield day
+            week += self.interval
+
+    def _monthly(self, first, last):
+        origin, begin = datetime.fromordinal(self.first), datetime.fromordinal(first)
+        month = begin.year * 12 + begin.month - 1
+        month += (origin.year * 12 + origin.month - 1 - month) % self.interval
+        while month < 10000 * 12 and datetime(month // 12, month % 12 + 1, 1).toordinal() <= last:
+            try:
+                day = datetime(month // 12, month % 12 + 1, origin.day).toordinal()
+            except ValueError:
+                # Months without that day (the 31st, 29 February) are skipped
+                day = None
+            if day is not None and first <= day <= last:
+                yield day
+            month += self.interval
+
+
+class RecurrenceIndex:
+    """The stored recurrence rules, one per series, held in process.
+
+    Nothing is expanded ahead of time: overlap checks, busy spans and counts
+    evaluate the rules for just the days they ask about.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rules = {}
+        self.loaded = False
+
+    def __len__(self):
+        return len(self._rules)
+
+    def load(self, rules):
+        with self._lock:
+            self._rules = {rule.id: rule for rule in rules}
+            self.loaded = True
+
+    def add(self, rule):
+        with self._lock:
+            self._rules[rule.id] = rule
+
+    def discard(self, series_id):
+        with self._lock:
+            self._rules.pop(series_id, None)
+
+    def rules(self):
+        with self._lock:
+            return list(self._rules.values())
+
+    def find_overlap(self, start, end):
+        """Return the id of a series with an occurrence overlapping ``[start, end)`` (epoch seconds), if any."""
+        day = start // 86400 + EPOCH_ORDINAL
+        midnight = (day - EPOCH_ORDINAL) * 86400
+        for rule in self.rules():
+            if rule.start < end - midnight and rule.end > start - midnight and rule.occurs_on(day):
+                return rule.id
+        return None
+
+    def day_spans(self, day):
+        midnight = (day - EPOCH_ORDINAL) * 86400
+        return [(midnight + rule.start, midnight + rule.end) for rule in self.rules() if rule.occurs_on(day)]
+
+    def occurrences(self, first, last):
+        """Yield ``(start_epoch, end_epoch, series_id)`` for the occurrences in ``[first, last]``, by start."""
+        def expand(rule):
+            for day in rule.occurrences(first, last):
+                midnight = (day - EPOCH_ORDINAL) * 86400
+                yield midnight + rule.start, midnight + rule.end, rule.id
+
+        return heapq.merge(*(expand(rule) for rule in self.rules()))
+
+    def daily_counts(self, first, last, horizon=MAX_ORDINAL):
+        """Count occurrences per day in ``[first, last]``; series without an end stop at ``horizon``."""
+        return Counter(day for rule in self.rules()
+                       for day in rule.occurrences(first, last if rule.until is not None else min(last, horizon)))
+
+    def count(self, first, last):
+        return sum(1 for rule in self.rules() for _ in rule.occurrences(first, last))
+
+
+recurrence_columns = 'id, freq, interval, by_day, start_date, until_date, from_time, to_time, exceptions'
+
+
+def load_recurrences(c, index):
+    c.execute(f'SELECT {recurrence_columns} FROM recurrences')
+    index.load([Recurrence.from_row(row) for row in c.fetchall()])
+    return index
@@ -0,0 +1,89 @@
+"""Read-only queries on one calendar file, shared by the app and its cross-calendar workers.
+
+``fan_out`` runs ``shard_queries`` and ``shard_statistics`` in spawned worker
+processes, which import this module rather than the app: a worker opens its
+shard read-only and has no database, thread pools or HTTP session to set up.
+"""
+import pathlib
+import sqlite3
+from datetime import datetime, timedelta
+
+from recurrence import RecurrenceIndex, iso_ordinal, load_recurrences
+
+
+def statistics_figures(c, start, end, recurrences, horizon):
+    """The statistics of one database, with totals and per-days limited to ``start``..``end``.
+
+    Without an ``end``, recurring events are expanded only up to ``horizon`` days past today.
+    """
+    start = start or '0000-01-01'
+    series_end = end
+    end = end or '9999-12-31'
+    # Every figure comes from the daily_counts rollup, which triggers keep in step with events
+
+    # Total number of events
+    c.execute("SELECT IFNULL(SUM(count), 0) FROM daily_counts WHERE day BETWEEN ? AND ?", (start, end))
+    total_count = c.fetchone()[0]
+
+    # Total number of events in current week (Monday to Sunday)
+    c.execute("SELECT IFNULL(SUM(count), 0) FROM daily_counts WHERE day BETWEEN date('now', 'weekday 0', '-6 days') "
+              "AND date('now', 'weekday 0')")
+    total_current_week = c.fetchone()[0]
+
+    # Total number of events in current month
+    c.execute("SELECT IFNULL(SUM(count), 0) FROM daily_counts WHERE day BETWEEN date('now', 'start of month') "
+              "AND date('now', 'start of month', '+1 month', '-1 day')")
+    total_current_month = c.fetchone()[0]
+
+    # Number of events per day
+    c.execute("SELECT day, count FROM daily_counts WHERE day BETWEEN ? AND ? ORDER BY day", (start, end))
+    per_days = dict(c.fetchall())
+
+    # Recurring events add their occurrences in the same ranges
+    if recurrences:
+        now = datetime.utcnow()
+        today = now.toordinal()
+        series_days = recurrences.daily_counts(iso_ordinal(max(start, '0001-01-01')),
+                                               iso_ordinal(series_end) if series_end else today + horizon,
+                                               today + horizon)
+        total_count += sum(series_days.values())
+        week_start = today - now.weekday()
+        total_current_week += recurrences.count(week_start, week_start + 6)
+        next_month = (now.replace(day=28) + timedelta(days=4)).replace(day=1)
+        total_current_month += recurrences.count(now.replace(day=1).toordinal(), next_month.toordinal() - 1)
+        for day, count in series_days.items():
+            day = datetime.fromordinal(day).strftime('%Y-%m-%d')
+            per_days[day] = per_days.get(day, 0) + count
+        per_days = dict(sorted(per_days.items()))
+
+    response_data = {
+        "total": total_count,
+        "total-current-week": total_current_week,
+        "total-current-month": total_current_month,
+        "per-days": per_days
+    }
+
+    return response_data
+
+
+def read_only(database):
+    return sqlite3.connect(pathlib.Path(database).resolve().as_uri() + '?mode=ro', uri=True)
+
+
+def shard_queries(database, queries):
+    """Run ``(sql, params)`` read queries against one calendar file and return their rows; runs in a worker."""
+    conn = read_only(database)
+    try:
+        return [conn.execute(sql, params).fetchall() for sql, params in queries]
+    finally:
+        conn.close()
+
+
+def shard_statistics(database, start, end, horizon):
+    """``statistics_figures`` of one calendar file; runs in a worker."""
+    conn = read_only(database)
+    try:
+        c = conn.cursor()
+        return statistics_figures(c, start, end, load_recurrences(c, RecurrenceIndex()), horizon)
+    finally:
+        conn.close()